@@ -0,0 +1,164 @@
+import numpy as np
+import requests
+from DataGeneration.DatabaseHandler import _location_keys
+from DataGeneration.MapLocation import MapLocation
+from DataGeneration.UniformMapGenerator import UniformMapGenerator
+
+
+class AdaptiveSampler:
+    """
+    Samples travel times on a coarse uniform grid, then recursively splits
+    each grid cell into four wherever the travel times at its corners differ
+    by more than a threshold. Areas where travel time changes slowly keep the
+    coarse spacing, while areas near stops, where it changes quickly, are
+    sampled finely.
+
+    Every sampled point is added to the addresses table and its routes to
+    the routes table, so the results can be output like any other run. Points
+    that are already in the addresses table are reused along with their
+    routes, so an interrupted run can be resumed without querying them again.
+    """
+
+    def __init__(self, generator, threshold=120, max_depth=4,
+                 stops_per_point=1, precision=6):
+        """
+        Args:
+            generator (DataGenerator): generator whose handler, wrapper, and
+                stops are used to sample points.
+            threshold (float): a cell is split when the largest and smallest
+                travel times at its corners differ by more than this many
+                seconds.
+            max_depth (int): maximum number of times a coarse cell is split.
+                The finest spacing is the coarse resolution / 2 ** max_depth.
+            stops_per_point (int): number of closest stops routed to from each
+                point. The travel time of a point is the shortest of these.
+            precision (int): decimal places coordinates are rounded to when
+                looking for points already in the addresses table.
+        """
+        self.generator = generator
+        self.threshold = threshold
+        self.max_depth = max_depth
+        self.stops_per_point = stops_per_point
+        self.precision = precision
+        self.times = {}
+        self.api_calls = 0
+
+    def sample(self, lat_min, lat_max, lng_min, lng_max, lat_res, lng_res,
+               mode='walking', verbose=False):
+        """
+        Samples the area between the given bounds, starting from a grid with
+        the given resolution. The points of the coarse grid, and then of each
+        level of refinement, are added to the database together.
+
+        Args:
+            lat_min, lat_max, lng_min, lng_max, lat_res, lng_res: bounds and
+                resolution of the coarse grid, as in
+                UniformMapGenerator.get_uniform_coordinate_map.
+            mode (str): 'walking' (default), 'driving', or 'cycling'.
+            verbose (bool): if True, displays status information.
+        Returns:
+            list of (MapLocation, time) tuples for every sampled point, where
+            time is None if no route could be found.
+        """
+        generator = UniformMapGenerator()
+        self.latitudes = generator.get_coordinates(lat_min, lat_max, lat_res)
+        self.longitudes = generator.get_coordinates(lng_min, lng_max, lng_res)
+        self.scale = 2 ** self.max_depth
+        self.times = {}
+        self.mode = mode
+        self.verbose = verbose
+        self.address_ids = self.generator.handler.get_location_ids(
+            'addresses', self.precision)
+        # Points are keyed by their integer index on the finest possible grid,
+        # so a corner shared by neighboring cells is only sampled once
+        self._sample_points([(i * self.scale, j * self.scale)
+                             for i in range(len(self.latitudes))
+                             for j in range(len(self.longitudes))])
+        cells = [(i * self.scale, (i + 1) * self.scale,
+                  j * self.scale, (j + 1) * self.scale)
+                 for i in range(len(self.latitudes) - 1)
+                 for j in range(len(self.longitudes) - 1)]
+        for depth in range(self.max_depth):
+            cells = [child for cell in cells if self._needs_split(cell)
+                     for child in _split(cell)]
+            if not cells:
+                break
+            self._sample_points([key for cell in cells
+                                 for key in _corners(cell)])
+        return [self.times[key] for key in sorted(self.times)]
+
+    def _needs_split(self, cell):
+        times = [self.times[key][1] for key in _corners(cell)]
+        times = [time for time in times if time is not None]
+        return bool(times) and max(times) - min(times) > self.threshold
+
+    def _sample_points(self, keys):
+        keys = sorted(set(key for key in keys if key not in self.times))
+        if not keys:
+            return
+        locations = [MapLocation(self._coordinate(self.latitudes, i),
+                                 self._coordinate(self.longitudes, j))
+                     for i, j in keys]
+        location_keys = _location_keys(
+            np.array([location.latitude for location in locations]),
+            np.array([location.longitude for location in locations]),
+            self.precision).tolist()
+        new = []
+        for location, location_key in zip(locations, location_keys):
+            if location_key in self.address_ids:
+                location.id = self.address_ids[location_key]
+            else:
+                new.append((location, location_key))
+        handler = self.generator.handler
+        existing = handler.get_routes_by_address(
+            [location.id for location in locations if location.id])
+        handler.add_address_locations([location for location, _ in new])
+        for location, location_key in new:
+            self.address_ids[location_key] = location.id
+
+        routes = []
+        for key, location in zip(keys, locations):
+            if self.verbose:
+                print('sampling point: {}, id: {}'.format(location,
+                                                          location.id))
+            known = existing.get(location.id, {})
+            time = None
+            for stop in self.generator.get_closest_stops(
+                    location, self.stops_per_point):
+                if stop.id in known:
+                    result = {"distance": known[stop.id][0],
+                              "time": known[stop.id][1]}
+                else:
+                    self.api_calls += 1
+                    try:
+                        result = self.generator.wrapper.get_distance_from_api(
+                            location, stop, self.mode)
+                    except requests.exceptions.RequestException as e:
+                        print('error processing stop: {}'.format(e))
+                        continue
+                    routes.append((location.id, stop.id, result["distance"],
+                                   result["time"]))
+                if time is None or result["time"] < time:
+                    time = result["time"]
+            self.times[key] = (location, time)
+        handler.add_routes(routes)
+
+    def _coordinate(self, values, index):
+        coarse, remainder = divmod(index, self.scale)
+        if remainder == 0:
+            return float(values[coarse])
+        return float(values[coarse] + (values[coarse + 1] - values[coarse]) *
+                     remainder / float(self.scale))
+
+
+def _corners(cell):
+    i0, i1, j0, j1 = cell
+    return (i0, j0), (i0, j1), (i1, j0), (i1, j1)
+
+
+def _split(cell):
+    i0, i1, j0, j1 = cell
+    i_mid = (i0 + i1) // 2
+    j_mid = (j0 + j1) // 2
+    return ((i0, i_mid, j0, j_mid), (i0, i_mid, j_mid, j1),
+            (i_mid, i1, j0, j_mid), (i_mid, i1, j_mid, j1))
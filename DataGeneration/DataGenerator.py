@@ -1,16 +1,57 @@
 from DataGeneration import DatabaseHandler
 from MapboxAPIWrapper import MapboxAPIWrapper
 from MapboxAPIWrapper import MapboxAPIError
-import math
+from DataGeneration.StopIndex import KDTreeStopIndex
+from DataGeneration.DistanceMetric import get_metric, HaversineMetric
+from DataGeneration.RouteWriter import RouteWriter
+import collections
+import itertools
+import threading
+import numpy as np
 import requests
 
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
 
 class DataGenerator:
 
+    # Spatial indexes that can be selected by name in the constructor
+    SPATIAL_INDEXES = {'kdtree': KDTreeStopIndex}
+
+    # Great-circle distances on a sphere can overestimate distances on the
+    # earth by up to about half a percent, so lower bounds used for pruning
+    # are scaled down by this factor
+    PRUNE_TOLERANCE = 0.995
+
     def __init__(self,
                  handler=DatabaseHandler(db_file_name='db.sqlite3'),
                  stops=None,
-                 wrapper=None):
+                 wrapper=None,
+                 spatial_index=None,
+                 metric='euclidean'):
+        """
+        Args:
+            handler (DatabaseHandler): handler for the database that holds the
+                addresses, stops, and routes.
+            stops (list): stops to route to. Defaults to all stops in the
+                database.
+            wrapper (MapboxAPIWrapper): wrapper used to query routes.
+            spatial_index: index used to select the closest stops to each
+                address. Either the name of an index in SPATIAL_INDEXES (such
+                as 'kdtree'), which is built with metric, or a callable that
+                takes a list of stops and returns an object with a
+                nearest(location, n) method. If None (default), every stop is
+                compared against every address.
+            metric: straight line distance metric used to select the closest
+                stops. Options are:
+                'euclidean' (default) - Distance in degrees
+                'equirectangular' - Meters on a local projection
+                'haversine' - Great-circle meters
+                A metric instance from DistanceMetric may also be passed.
+        """
         self.handler = handler
         if stops is None:
             self.stops = handler.get_all_stops()
@@ -20,6 +61,11 @@ class DataGenerator:
             self.wrapper = self._get_api_wrapper('api_key.txt')
         else:
             self.wrapper = wrapper
+        self.metric = get_metric(metric)
+        self.route_writer = None
+        self.address_progress = None
+        self.spatial_index = spatial_index
+        self.stop_index = self._build_stop_index(spatial_index, self.stops)
 
     def initialize(self, db='db.sqlite3', api_key='api_key.txt'):
         """
@@ -32,9 +78,15 @@ class DataGenerator:
         """
         self.handler = self._get_database_handler(db)
         self.stops = self.handler.get_all_stops()
+        self.stop_index = self._build_stop_index(self.spatial_index,
+                                                 self.stops)
         self.wrapper = self._get_api_wrapper(api_key)
 
-    def begin(self, stops_per_address=5, verbose=True, mode='walking'):
+    def begin(self, stops_per_address=5, verbose=True, mode='walking',
+              batch_size=None, workers=1, max_in_flight=None,
+              use_matrix=False, write_batch_size=None, use_queue=False,
+              claim_size=100, worker_id='', max_attempts=3, prune=False,
+              prune_snap_allowance=0):
         """
         Begins collection of distances to closest stops from each address.
         Stores each address-stop pair and associated walking distance and time
@@ -51,34 +103,383 @@ class DataGenerator:
                 'walking' (default) - Walking on foot
                 'driving' - Driving by car
                 'cycling' - Cycling by bicycle
+            batch_size (int): If set, the closest stops are selected for this
+                many addresses at a time with vectorized distance computations
+                instead of one address at a time. Memory use is bounded by
+                batch_size times the number of stops.
+            workers (int): Number of threads querying the api in parallel.
+                Default value is 1, which queries one route at a time. Routes
+                are always written to the database from the calling thread.
+            max_in_flight (int): Maximum number of routes that have been
+                dispatched to workers but not yet written to the database.
+                Defaults to twice the number of workers.
+            use_matrix (bool): If True, routes are fetched with matrix
+                requests that cover several addresses and their stops at once
+                instead of one request per route. Matrix requests are made
+                from the calling thread, so workers is ignored.
+            write_batch_size (int): If set, routes are buffered and written
+                to the database this many at a time in one transaction,
+                instead of one transaction per route.
+            use_queue (bool): If True, addresses are claimed in batches from
+                the database's work queue instead of selecting every address
+                without routes. Each address is marked done once all of its
+                routes are written, or failed if any of them errored, so
+                failures are retried and several generators can share one
+                database without querying the same address twice.
+            claim_size (int): Number of addresses claimed from the work queue
+                at a time.
+            worker_id (str): Identifies this generator in the work queue.
+            max_attempts (int): Number of times an address is tried before it
+                is left as failed in the work queue.
+            prune (bool): If True, only routes that could be the shortest
+                from each address are queried. Stops are queried in order of
+                straight line distance, and the remaining stops are skipped
+                once the shortest route found is no longer than the straight
+                line distance to the next stop. Use this when only the
+                closest stop to each address is needed. Routes are queried
+                one at a time from the calling thread, so workers and
+                use_matrix are ignored. Pruning is only exact when addresses
+                and stops lie on the street network, since the api measures
+                routes from the points it snaps them to.
+            prune_snap_allowance (float): Meters by which snapping both ends
+                of a route to the street network can shorten it compared to
+                the straight line distance between them. Subtracted from the
+                straight line distance used for pruning. Default value is 0.
+        """
+        if use_queue:
+            self.handler.populate_address_queue()
+            self.address_progress = {}
+            address_generator = self._iter_claimed_addresses(
+                claim_size, worker_id, max_attempts, verbose)
+        else:
+            self.address_progress = None
+            address_generator = self.handler.get_address_generator(
+                verbose=verbose)
+        if batch_size is None:
+            candidates = self._iter_closest_locations(address_generator,
+                                                      stops_per_address)
+        else:
+            candidates = self._get_closest_locations_batch(
+                address_generator, self.stops, n=stops_per_address,
+                chunk_size=batch_size)
+        if use_queue:
+            candidates = self._skip_existing_routes(candidates)
+        if write_batch_size is not None:
+            self.route_writer = RouteWriter(self.handler,
+                                            flush_rows=write_batch_size)
+        try:
+            if prune:
+                self._process_pruned(candidates, verbose, mode,
+                                     prune_snap_allowance)
+            else:
+                self._process_candidates(candidates, verbose, mode, workers,
+                                         max_in_flight, use_matrix)
+        finally:
+            if self.route_writer is not None:
+                self.route_writer.close()
+                self.route_writer = None
+
+    def begin_closest_stops(self, verbose=True, mode='walking',
+                            write_batch_size=1000):
+        """
+        Stores the route from each address without routes to its closest stop
+        by network distance, found for all addresses in one search over the
+        street graph. Requires a wrapper with get_closest_stop_routes, such
+        as a LocalRoutingWrapper.
+
+        Args:
+            verbose (bool): If True (default), displays status information.
+            mode (str): Mode of travel. Options are 'walking' (default),
+                'driving', and 'cycling'.
+            write_batch_size (int): Number of routes written to the database
+                in each transaction.
+        Returns:
+            the number of routes stored.
         """
-        address_generator = self.handler.get_address_generator(verbose=verbose)
-        for address in address_generator:
+        addresses = self.handler.get_address_generator(verbose=verbose)
+        count = 0
+        with RouteWriter(self.handler, flush_rows=write_batch_size) as writer:
+            for address, stop, result in self.wrapper.get_closest_stop_routes(
+                    addresses, self.stops, mode):
+                if stop is None:
+                    print('no route found from address: {}'.format(address.id))
+                    continue
+                if verbose:
+                    print('address: {}, stop: {}, distance: {}, time: {}'.
+                          format(address.id, stop.id, result["distance"],
+                                 result["time"]))
+                writer.add_route(address.id, stop.id, result["distance"],
+                                 result["time"])
+                count += 1
+        return count
+
+    def _process_candidates(self, candidates, verbose, mode, workers,
+                            max_in_flight, use_matrix):
+        if use_matrix:
+            self._process_matrix(candidates, verbose, mode)
+            return
+        if workers > 1:
+            self._process_concurrently(candidates, verbose, mode, workers,
+                                       max_in_flight or 2 * workers)
+            return
+        for address, closest_stops in candidates:
             if verbose:
                 print('processing address: {}, {}, id: {}'.
                       format(address.latitude, address.longitude, address.id))
-            closest_stops = self._get_closest_locations(address,
-                                                        self.stops,
-                                                        n=stops_per_address)
+            self._start_address(address, len(closest_stops))
             for stop in closest_stops:
                 try:
                     self.process_stop(address, stop, verbose, mode)
                 except requests.exceptions.RequestException as e:
                     print('error processing stop: {}'.format(e.message))
+                    self._finish_route(address, e)
                     continue
+                self._finish_route(address)
+
+    def _process_pruned(self, candidates, verbose, mode, snap_allowance=0):
+        metric = HaversineMetric()
+        for address, closest_stops in candidates:
+            if verbose:
+                print('processing address: {}, {}, id: {}'.
+                      format(address.latitude, address.longitude, address.id))
+            self._start_address(address, len(closest_stops))
+            # A route can never be shorter than the great-circle distance,
+            # less the distance its ends were moved when snapped to streets
+            bounds = self.PRUNE_TOLERANCE * metric.distance(
+                address.latitude, address.longitude,
+                [stop.latitude for stop in closest_stops],
+                [stop.longitude for stop in closest_stops]) - snap_allowance
+            order = sorted(range(len(closest_stops)),
+                           key=lambda i: (bounds[i], i))
+            shortest = None
+            for queried, i in enumerate(order):
+                if shortest is not None and shortest <= bounds[i]:
+                    if verbose:
+                        print('skipping {} stops'.format(len(order) - queried))
+                    self._finish_route(address, count=len(order) - queried)
+                    break
+                stop = closest_stops[i]
+                if verbose:
+                    print('processing stop: {}, {}, id: {}'.
+                          format(stop.latitude, stop.longitude, stop.id))
+                try:
+                    result = self.wrapper.get_distance_from_api(address, stop,
+                                                                mode)
+                except requests.exceptions.RequestException as e:
+                    print('error processing stop: {}'.format(e))
+                    self._finish_route(address, e)
+                    continue
+                self._save_route(address, stop, result, verbose)
+                self._finish_route(address)
+                if shortest is None or result["distance"] < shortest:
+                    shortest = result["distance"]
 
     def process_stop(self, address, stop, verbose, mode='walking'):
         if verbose:
             print('processing stop: {}, {}, id: {}'.
                   format(stop.latitude, stop.longitude, stop.id))
         result = self.wrapper.get_distance_from_api(address, stop, mode)
+        self._save_route(address, stop, result, verbose)
+
+    def _save_route(self, address, stop, result, verbose):
         if verbose:
             print('distance: {}, time: {}'.format(result["distance"],
                                                   result["time"]))
-        self.handler.add_route(address.id,
-                               stop.id,
-                               result["distance"],
-                               result["time"])
+        if self.route_writer is None:
+            writer = self.handler
+        else:
+            writer = self.route_writer
+        writer.add_route(address.id,
+                         stop.id,
+                         result["distance"],
+                         result["time"])
+
+    def _process_concurrently(self, candidates, verbose, mode, workers,
+                              max_in_flight):
+        """
+        Queries routes for each (address, [stops]) candidate on a pool of
+        worker threads. The calling thread is the only one that writes to the
+        database, so the handler's connection is never shared across threads.
+        """
+        tasks = queue.Queue()
+        results = queue.Queue()
+        threads = [threading.Thread(target=self._route_worker,
+                                    args=(tasks, results, mode))
+                   for _ in range(workers)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        in_flight = 0
+        try:
+            for address, closest_stops in candidates:
+                if verbose:
+                    print('processing address: {}, {}, id: {}'.
+                          format(address.latitude, address.longitude,
+                                 address.id))
+                self._start_address(address, len(closest_stops))
+                for stop in closest_stops:
+                    while in_flight >= max_in_flight:
+                        self._write_result(results.get(), verbose)
+                        in_flight -= 1
+                    tasks.put((address, stop))
+                    in_flight += 1
+            while in_flight > 0:
+                self._write_result(results.get(), verbose)
+                in_flight -= 1
+        finally:
+            for _ in threads:
+                tasks.put(None)
+
+    def _process_matrix(self, candidates, verbose, mode):
+        """
+        Groups (address, [stops]) candidates so that each group's addresses
+        and the union of their stops fit in one matrix request, then stores
+        the route from each address to each of its own stops.
+        """
+        limit = self.wrapper.MATRIX_COORDINATE_LIMIT
+        group = []
+        group_stops = collections.OrderedDict()
+        for address, closest_stops in candidates:
+            if verbose:
+                print('processing address: {}, {}, id: {}'.
+                      format(address.latitude, address.longitude, address.id))
+            if 1 + len(closest_stops) > limit:
+                # The address's stops don't fit in one request with it, so
+                # they are split across several requests of their own
+                if group:
+                    self._process_matrix_group(group, group_stops, verbose,
+                                               mode)
+                    group = []
+                    group_stops = collections.OrderedDict()
+                self._start_address(address, len(closest_stops))
+                for i in range(0, len(closest_stops), limit - 1):
+                    chunk = closest_stops[i:i + limit - 1]
+                    self._process_matrix_group(
+                        [(address, chunk)],
+                        collections.OrderedDict((self._location_key(stop),
+                                                 stop) for stop in chunk),
+                        verbose, mode)
+                continue
+            new_stops = set(self._location_key(stop) for stop in closest_stops
+                            if self._location_key(stop) not in group_stops)
+            if group and \
+                    len(group) + 1 + len(group_stops) + len(new_stops) > limit:
+                self._process_matrix_group(group, group_stops, verbose, mode)
+                group = []
+                group_stops = collections.OrderedDict()
+            self._start_address(address, len(closest_stops))
+            group.append((address, closest_stops))
+            for stop in closest_stops:
+                group_stops.setdefault(self._location_key(stop), stop)
+        if group:
+            self._process_matrix_group(group, group_stops, verbose, mode)
+
+    def _process_matrix_group(self, group, group_stops, verbose, mode):
+        origins = [address for address, _ in group]
+        destinations = list(group_stops.values())
+        columns = dict((self._location_key(stop), i)
+                       for i, stop in enumerate(destinations))
+        try:
+            matrix = self.wrapper.get_distance_matrix(origins, destinations,
+                                                      mode)
+        except requests.exceptions.RequestException as e:
+            print('error processing addresses: {}'.format(e))
+            for address, closest_stops in group:
+                for _ in closest_stops:
+                    self._finish_route(address, e)
+            return
+        for row, (address, closest_stops) in enumerate(group):
+            for stop in closest_stops:
+                result = matrix[row][columns[self._location_key(stop)]]
+                if result is None:
+                    print('no route found to stop: {}'.format(stop.id))
+                else:
+                    self._save_route(address, stop, result, verbose)
+                self._finish_route(address)
+
+    def _location_key(self, location):
+        return location.id, location.latitude, location.longitude
+
+    def _route_worker(self, tasks, results, mode):
+        while True:
+            task = tasks.get()
+            if task is None:
+                return
+            address, stop = task
+            try:
+                result = self.wrapper.get_distance_from_api(address, stop, mode)
+                results.put((address, stop, result, None))
+            except Exception as e:
+                # Every task must put a result, or the calling thread waits
+                # for it forever
+                results.put((address, stop, None, e))
+
+    def _write_result(self, task_result, verbose):
+        address, stop, result, error = task_result
+        if error is not None:
+            if not isinstance(error, requests.exceptions.RequestException):
+                raise error
+            print('error processing stop: {}'.format(error))
+            self._finish_route(address, error)
+            return
+        if verbose:
+            print('processed stop: {}, {}, id: {}'.
+                  format(stop.latitude, stop.longitude, stop.id))
+        self._save_route(address, stop, result, verbose)
+        self._finish_route(address)
+
+    def _iter_claimed_addresses(self, claim_size, worker_id, max_attempts,
+                                verbose):
+        while True:
+            addresses = self.handler.claim_addresses(
+                claim_size, worker_id=worker_id, max_attempts=max_attempts)
+            if verbose:
+                print('claimed {} addresses'.format(len(addresses)))
+            if not addresses:
+                return
+            for address in addresses:
+                yield address
+
+    def _skip_existing_routes(self, candidates):
+        # a retried address only needs the routes that failed last time
+        for address, closest_stops in candidates:
+            existing = self.handler.get_route_stop_ids(address.id)
+            yield address, [stop for stop in closest_stops
+                            if stop.id not in existing]
+
+    def _start_address(self, address, route_count):
+        if self.address_progress is None:
+            return
+        self.address_progress[address.id] = [route_count, None]
+        if route_count == 0:
+            self._finish_route(address, count=0)
+
+    def _finish_route(self, address, error=None, count=1):
+        """
+        Records that one of an address's routes has been handled. Once all of
+        them have, the address is marked done or failed in the work queue
+        after its routes have been written to the database.
+        """
+        if self.address_progress is None:
+            return
+        progress = self.address_progress[address.id]
+        progress[0] -= count
+        if error is not None:
+            progress[1] = error
+        if progress[0] > 0:
+            return
+        del self.address_progress[address.id]
+        if progress[1] is None:
+            def update():
+                self.handler.mark_address_done(address.id)
+        else:
+            def update():
+                self.handler.mark_address_failed(address.id, progress[1])
+        if self.route_writer is None:
+            update()
+        else:
+            self.route_writer.on_flush(update)
 
     def _get_database_handler(self, db_file_name='db.sqlite3'):
         handler = DatabaseHandler(db_file_name)
@@ -89,10 +490,87 @@ class DataGenerator:
         wrapper.load_api_key_from_file(api_key_file)
         return wrapper
 
+    def _build_stop_index(self, spatial_index, stops):
+        if spatial_index is None:
+            return None
+        if spatial_index in self.SPATIAL_INDEXES:
+            return self.SPATIAL_INDEXES[spatial_index](stops,
+                                                       metric=self.metric)
+        if callable(spatial_index):
+            return spatial_index(stops)
+        raise ValueError('unknown spatial index: {}'.format(spatial_index))
+
+    def get_closest_stops(self, location, n):
+        """
+        Returns:
+            the n stops closest to location by straight line distance,
+            ordered from closest to furthest.
+        """
+        if self.stop_index is None:
+            return self._get_closest_locations(location, self.stops, n=n)
+        return self.stop_index.nearest(location, n=n)
+
+    def _iter_closest_locations(self, sources, n):
+        for source in sources:
+            yield source, self.get_closest_stops(source, n)
+
+    def _get_closest_locations_batch(self, sources, destinations, n,
+                                     chunk_size=1000):
+        """
+        Vectorized equivalent of _get_closest_locations over many sources.
+        Sources are consumed chunk_size at a time, so only one
+        chunk_size x len(destinations) distance tile is held in memory.
+
+        Yields:
+            (source, [closest destinations]) tuples in the order of sources.
+        """
+        n = min(n, len(destinations))
+        destination_coordinates = np.array(
+            [(d.latitude, d.longitude) for d in destinations],
+            dtype=np.float64).reshape(-1, 2)
+        sources = iter(sources)
+        while True:
+            chunk = list(itertools.islice(sources, chunk_size))
+            if not chunk:
+                return
+            if n <= 0:
+                for source in chunk:
+                    yield source, []
+                continue
+            source_coordinates = np.array(
+                [(s.latitude, s.longitude) for s in chunk], dtype=np.float64)
+            distances = self._distance_tile(source_coordinates,
+                                            destination_coordinates)
+            if n < len(destinations):
+                candidates = np.argpartition(distances, n - 1, axis=1)[:, :n]
+            else:
+                candidates = np.tile(np.arange(n), (len(chunk), 1))
+            candidate_distances = np.take_along_axis(distances, candidates,
+                                                     axis=1)
+            for row, source in enumerate(chunk):
+                # order by distance, then by position in destinations
+                order = np.lexsort((candidates[row], candidate_distances[row]))
+                yield source, [destinations[i] for i in candidates[row][order]]
+
+    def _distance_tile(self, sources, destinations):
+        return self.metric.distance(sources[:, 0, np.newaxis],
+                                    sources[:, 1, np.newaxis],
+                                    destinations[np.newaxis, :, 0],
+                                    destinations[np.newaxis, :, 1])
+
     def _get_closest_locations(self, source, destinations, n):
-        location_list = []
-        for destination in destinations:
-            distance = math.sqrt((source.latitude - destination.latitude)**2 +
-                                 (source.longitude - destination.longitude)**2)
-            location_list.append((distance, destination))
-        return [loc[1] for loc in sorted(location_list)[0:n]]
+        if n <= 0 or not destinations:
+            return []
+        # Built on every call, so changes to destinations are always seen
+        count = len(destinations)
+        latitudes = np.fromiter([location.latitude
+                                 for location in destinations],
+                                dtype=np.float64, count=count)
+        longitudes = np.fromiter([location.longitude
+                                  for location in destinations],
+                                 dtype=np.float64, count=count)
+        distances = self.metric.distance(source.latitude, source.longitude,
+                                         latitudes, longitudes)
+        # order by distance, then by position in destinations
+        order = np.argsort(distances, kind='mergesort')[:n]
+        return [destinations[i] for i in order]
@@ -1,22 +1,58 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import gzip
+import json
 import sqlite3 as sql
+import time
+import uuid
+import numpy as np
 import pandas as pd
 from DataGeneration.MapLocation import MapLocation
 
+# Columns of the routes output, in order
+ROUTE_COLUMNS = ['address_latitude', 'address_longitude', 'stop_latitude',
+                 'stop_longitude', 'distance', 'time']
+# Column types used for columnar exports
+ROUTE_EXPORT_TYPES = {'address_latitude': 'float64',
+                      'address_longitude': 'float64',
+                      'stop_latitude': 'float64',
+                      'stop_longitude': 'float64',
+                      'distance': 'float32',
+                      'time': 'float32'}
+
 
 class DatabaseHandler:
 
-    def __init__(self, db_file_name='db.sqlite3', full=True):
+    def __init__(self, db_file_name='db.sqlite3', full=True,
+                 performance=False, timeout=None):
+        """
+        Args:
+            db_file_name (str): file path to the sqlite3 database.
+            full (bool): If True (default), connects to the database and
+                creates any missing tables.
+            performance (bool): If True, enables the performance profile. See
+                enable_performance_profile().
+            timeout (float): seconds to wait for another connection's lock
+                on the database before raising an error. Defaults to
+                sqlite3's default of 5 seconds.
+        """
+        self.db_file_name = db_file_name
+        self._routes_address_indexed = False
         if full:
-            self.conn = sql.connect(db_file_name)
+            if timeout is None:
+                self.conn = sql.connect(db_file_name)
+            else:
+                self.conn = sql.connect(db_file_name, timeout=timeout)
             self.initialize_db()
+            if performance:
+                self.enable_performance_profile()
 
     def initialize_db(self):
         self._add_addresses_table()
         self._add_stops_table()
         self._add_routes_table()
+        self._add_address_status_table()
         self.conn.commit()
 
     def _add_addresses_table(self):
@@ -55,14 +91,262 @@ class DatabaseHandler:
                   """)
         c.close()
 
-    def add_addresses_from_file(self, file_name):
-        df = pd.read_csv(file_name)
-        df.to_sql('addresses', self.conn, if_exists='append', index=False)
+    def _add_address_status_table(self):
+        c = self.conn.cursor()
+        c.execute("""
+                  CREATE TABLE IF NOT EXISTS address_status
+                  (address_id INTEGER PRIMARY KEY,
+                  status text NOT NULL DEFAULT 'pending',
+                  attempts INTEGER NOT NULL DEFAULT 0,
+                  claimed_by text,
+                  claimed_at real,
+                  last_error text,
+                  FOREIGN KEY(address_id) REFERENCES addresses(id))
+                  """)
+        c.execute("CREATE INDEX IF NOT EXISTS address_status_status "
+                  "ON address_status (status, address_id)")
+        c.close()
+
+    def enable_performance_profile(self, cache_size_mb=64,
+                                   mmap_size_mb=256):
+        """
+        Tunes the database for large runs. Enables write-ahead logging so
+        reads don't block writes, relaxes fsync to once per checkpoint, enlarges
+        the page cache and memory maps the database file. Also creates the
+        indexes on the routes table, which existing databases are migrated to
+        the first time this is called.
+
+        Journal mode is stored in the database file; the other settings only
+        apply to this connection.
+
+        Args:
+            cache_size_mb (int): size of the page cache in megabytes.
+            mmap_size_mb (int): maximum size of the memory map in megabytes.
+        """
+        c = self.conn.cursor()
+        c.execute("PRAGMA journal_mode=WAL")
+        c.execute("PRAGMA synchronous=NORMAL")
+        c.execute("PRAGMA temp_store=MEMORY")
+        c.execute("PRAGMA cache_size=-{}".format(int(cache_size_mb * 1024)))
+        c.execute("PRAGMA mmap_size={}".format(int(mmap_size_mb * 1024 ** 2)))
+        c.close()
+        self._add_routes_indexes()
+
+    def _add_routes_indexes(self):
+        c = self.conn.cursor()
+        # covers the join in get_address_generator and the per-address
+        # minimum distance used to find the closest stops
+        c.execute("CREATE INDEX IF NOT EXISTS routes_address_id_distance "
+                  "ON routes (address_id, distance)")
+        c.execute("CREATE INDEX IF NOT EXISTS routes_stop_id "
+                  "ON routes (stop_id)")
+        c.execute("PRAGMA optimize")
+        self.conn.commit()
+        c.close()
+
+    def _add_routes_address_index(self):
+        """
+        Makes sure routes can be looked up by address_id without scanning the
+        whole table. This only adds a plain index, unless the performance
+        profile's index, which also starts with address_id, already exists.
+        """
+        if self._routes_address_indexed:
+            return
+        c = self.conn.cursor()
+        c.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND "
+                  "name IN ('routes_address_id_distance', "
+                  "'routes_address_id_stop_id')")
+        if c.fetchone() is None:
+            c.execute("CREATE INDEX IF NOT EXISTS routes_address_id_stop_id "
+                      "ON routes (address_id, stop_id)")
+            self.conn.commit()
+        c.close()
+        self._routes_address_indexed = True
+
+    def add_addresses_from_file(self, file_name, chunksize=100000,
+                                precision=6, skip_invalid=False):
+        """
+        Adds the addresses in a .csv file with latitude and longitude columns.
+        See _import_locations for the arguments.
+
+        Returns:
+            the number of addresses added.
+        """
+        self._add_addresses_table()
+        return self._import_locations(file_name, 'addresses', [], chunksize,
+                                      precision, skip_invalid)
+
+    def add_stops_from_file(self, file_name, chunksize=100000, precision=6,
+                            skip_invalid=False):
+        """
+        Adds the stops in a .csv file with latitude and longitude columns,
+        and optionally stop_id and stop_name columns. Stops without a
+        stop_id are given 0, and stops without a stop_name an empty name.
+        See _import_locations for the other arguments.
+
+        Returns:
+            the number of stops added.
+        """
+        self._add_stops_table()
+        return self._import_locations(file_name, 'stops',
+                                      [('stop_id', 0), ('stop_name', '')],
+                                      chunksize, precision, skip_invalid)
+
+    def _import_locations(self, file_name, table, extra_columns, chunksize,
+                          precision, skip_invalid):
+        """
+        Reads a .csv file in chunks and inserts its rows into a table in one
+        transaction. Spaces after the commas are ignored. Rows are skipped if
+        a row at the same coordinates, rounded to precision decimal places,
+        is already in the table or earlier in the file, so importing a file
+        twice adds nothing the second time.
+
+        Args:
+            file_name (str): path to the .csv file.
+            table (str): 'addresses' or 'stops'.
+            extra_columns (list): (column, default) pairs of other columns to
+                import. The default is used when the file doesn't have the
+                column.
+            chunksize (int): number of rows parsed at a time.
+            precision (int): decimal places coordinates are rounded to when
+                looking for duplicates. At most 7.
+            skip_invalid (bool): If True, rows with missing or out of range
+                coordinates are skipped. If False (default), a ValueError is
+                raised and nothing is added.
+        """
+        if not 0 <= precision <= 7:
+            raise ValueError('precision must be between 0 and 7')
+        header = pd.read_csv(file_name, nrows=0, skipinitialspace=True)
+        present = [column for column, _ in extra_columns
+                   if column in header.columns]
+        columns = ['latitude', 'longitude'] + \
+            [column for column, _ in extra_columns]
+        dtypes = dict((column, str) for column in present)
+        dtypes.update(latitude=np.float64, longitude=np.float64)
+        existing = self._get_location_keys(table, precision)
+        insert = "INSERT INTO {} ({}) VALUES ({})".format(
+            table, ', '.join(columns), ', '.join('?' * len(columns)))
+        count = 0
+        line = 2
+        c = self.conn.cursor()
+        try:
+            for chunk in pd.read_csv(file_name, skipinitialspace=True,
+                                     usecols=['latitude', 'longitude'] +
+                                     present, dtype=dtypes,
+                                     chunksize=chunksize):
+                latitudes = chunk['latitude'].values
+                longitudes = chunk['longitude'].values
+                with np.errstate(invalid='ignore'):
+                    valid = (np.abs(latitudes) <= 90) & \
+                        (np.abs(longitudes) <= 180)
+                if not valid.all() and not skip_invalid:
+                    raise ValueError(
+                        'invalid coordinates on line {} of {}'.format(
+                            line + int(np.argmin(valid)), file_name))
+                line += len(chunk)
+                keys = _location_keys(latitudes[valid], longitudes[valid],
+                                      precision)
+                # first occurrence of each key that isn't in the table yet
+                keys, first = np.unique(keys, return_index=True)
+                new = ~np.isin(keys, existing, assume_unique=True)
+                rows = np.flatnonzero(valid)[np.sort(first[new])]
+                existing = np.union1d(existing, keys[new])
+                values = [chunk['latitude'].values[rows].tolist(),
+                          chunk['longitude'].values[rows].tolist()]
+                for column, default in extra_columns:
+                    if column in present:
+                        values.append(chunk[column].fillna(default).
+                                      values[rows].tolist())
+                    else:
+                        values.append([default] * len(rows))
+                c.executemany(insert, zip(*values))
+                count += len(rows)
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        finally:
+            c.close()
+        return count
+
+    def _get_location_keys(self, table, precision):
+        c = self.conn.cursor()
+        c.execute("SELECT latitude, longitude FROM {}".format(table))
+        coordinates = np.array(c.fetchall(), dtype=np.float64).reshape(-1, 2)
+        c.close()
+        return np.unique(_location_keys(coordinates[:, 0], coordinates[:, 1],
+                                        precision))
+
+    def get_location_ids(self, table, precision):
+        """
+        Returns:
+            a dict from the coordinates of each row of table, packed into one
+            integer after rounding to precision decimal places, to the row's
+            id. Coordinates are packed the same way as when looking for
+            duplicates in add_addresses_from_file.
+        """
+        c = self.conn.cursor()
+        c.execute("SELECT id, latitude, longitude FROM {}".format(table))
+        rows = np.array(c.fetchall(), dtype=np.float64).reshape(-1, 3)
+        c.close()
+        keys = _location_keys(rows[:, 1], rows[:, 2], precision)
+        return dict(zip(keys.tolist(), rows[:, 0].astype(np.int64).tolist()))
+
+    def add_addresses(self, coordinates, ids=None):
+        """
+        Inserts many addresses in a single transaction.
+
+        Args:
+            coordinates: iterable of (latitude, longitude) pairs.
+            ids: optional iterable of an id for each address. Addresses whose
+                id is already in the table are skipped.
+        Returns:
+            the number of addresses added.
+        """
+        changes = self.conn.total_changes
+        c = self.conn.cursor()
+        try:
+            if ids is None:
+                c.executemany("INSERT INTO addresses (latitude, longitude) "
+                              "VALUES (?, ?)", coordinates)
+            else:
+                c.executemany("INSERT OR IGNORE INTO addresses "
+                              "(id, latitude, longitude) VALUES (?, ?, ?)",
+                              ((address_id, latitude, longitude)
+                               for address_id, (latitude, longitude)
+                               in zip(ids, coordinates)))
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        finally:
+            c.close()
+        return self.conn.total_changes - changes
 
-    def add_stops_from_file(self, file_name):
-        df = pd.read_csv(file_name)
-        df = df[["stop_id", "stop_name", "longitude", "latitude"]]
-        df.to_sql('stops', self.conn, if_exists='append', index=False)
+    def add_address_locations(self, locations):
+        """
+        Inserts many MapLocations as addresses in a single transaction and
+        sets the id of each one to its new address id.
+
+        Returns:
+            the list of new address ids.
+        """
+        ids = []
+        c = self.conn.cursor()
+        try:
+            for location in locations:
+                c.execute("INSERT INTO addresses (latitude, longitude) "
+                          "VALUES (?, ?)",
+                          (location.latitude, location.longitude))
+                location.id = c.lastrowid
+                ids.append(location.id)
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        finally:
+            c.close()
+        return ids
 
     def add_address(self, location):
         if not hasattr(location, 'latitude'):
@@ -78,7 +362,9 @@ class DatabaseHandler:
             c.execute("INSERT INTO addresses (latitude, longitude) "
                       "VALUES (?, ?)", (location.latitude, location.longitude))
         self.conn.commit()
+        address_id = c.lastrowid
         c.close()
+        return address_id
 
     def add_stop(self, location):
         if not hasattr(location, 'latitude'):
@@ -98,30 +384,318 @@ class DatabaseHandler:
         c.close()
 
     def add_route(self, address, stop, distance, time):
+        self.add_routes([(address, stop, distance, time)])
+
+    def add_routes(self, routes):
+        """
+        Inserts many routes in a single transaction.
+
+        Args:
+            routes: iterable of (address_id, stop_id, distance, time) tuples.
+        """
+        c = self.conn.cursor()
+        try:
+            c.executemany("INSERT INTO routes "
+                          "(address_id, stop_id, distance, time) "
+                          "VALUES (?, ?, ?, ?)",
+                          routes)
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        finally:
+            c.close()
+
+    # Information Retrieval
+    def get_address_generator(self, verbose=False, page_size=1000,
+                              dedicated_connection=False):
+        """
+        Yields a MapLocation for each address that doesn't have any routes.
+        Addresses are read in pages ordered by id, with each page starting
+        after the last id of the previous one, so memory use is constant
+        regardless of the size of the addresses table and routes added while
+        iterating don't shift later pages.
+
+        Args:
+            verbose (bool): If True, displays status information.
+            page_size (int): number of addresses read from the database at a
+                time.
+            dedicated_connection (bool): If True, addresses are read on a
+                separate connection to the database file, which only sees
+                committed routes.
+        """
+        # every page joins against routes by address_id
+        self._add_routes_address_index()
+        if dedicated_connection:
+            conn = sql.connect(self.db_file_name)
+        else:
+            conn = self.conn
+        if verbose:
+            print("fetching addresses without routes...")
+        count = 0
+        last_id = None
+        try:
+            while True:
+                c = conn.cursor()
+                if last_id is None:
+                    c.execute("SELECT "
+                              "addresses.latitude, addresses.longitude, "
+                              "addresses.id "
+                              "FROM addresses LEFT JOIN routes "
+                              "ON routes.address_id = addresses.id "
+                              "WHERE routes.id IS NULL "
+                              "ORDER BY addresses.id LIMIT ?",
+                              (page_size,))
+                else:
+                    c.execute("SELECT "
+                              "addresses.latitude, addresses.longitude, "
+                              "addresses.id "
+                              "FROM addresses LEFT JOIN routes "
+                              "ON routes.address_id = addresses.id "
+                              "WHERE routes.id IS NULL AND addresses.id > ? "
+                              "ORDER BY addresses.id LIMIT ?",
+                              (last_id, page_size))
+                rows = c.fetchall()
+                c.close()
+                if not rows:
+                    break
+                count += len(rows)
+                last_id = rows[-1][2]
+                for row in rows:
+                    yield MapLocation(latitude=row[0], longitude=row[1],
+                                      id=row[2])
+        finally:
+            if dedicated_connection:
+                conn.close()
+        if verbose:
+            print("fetched {} addresses".format(count))
+
+    # Work Queue
+    def populate_address_queue(self):
+        """
+        Adds every address that isn't in the address_status work queue yet.
+        Addresses that already have routes are added as done, all others as
+        pending.
+
+        Returns:
+            the number of addresses added to the queue.
+        """
+        self._add_routes_address_index()
         c = self.conn.cursor()
-        c.execute("INSERT INTO routes "
-                  "(address_id, stop_id, distance, time) "
-                  "VALUES (?, ?, ?, ?)",
-                  (address, stop, distance, time))
+        c.execute("INSERT OR IGNORE INTO address_status (address_id, status) "
+                  "SELECT addresses.id, "
+                  "CASE WHEN EXISTS (SELECT 1 FROM routes "
+                  "WHERE routes.address_id = addresses.id) "
+                  "THEN 'done' ELSE 'pending' END "
+                  "FROM addresses")
+        added = c.rowcount
         self.conn.commit()
         c.close()
+        return added
 
-    # Information Retrieval
-    def get_address_generator(self, verbose=False):
+    def claim_addresses(self, count, worker_id='', max_attempts=3,
+                        stale_after=3600):
+        """
+        Marks up to count addresses as in progress and returns them. Each
+        address can only be claimed by one caller at a time, even across
+        processes sharing the database.
+
+        Pending addresses are claimed first, in id order, along with failed
+        addresses that have been attempted fewer than max_attempts times and
+        addresses that were claimed more than stale_after seconds ago without
+        being finished, such as after a crash. A stale address that has
+        already been attempted max_attempts times is marked failed instead,
+        so an address that crashes every worker isn't retried forever.
+
+        Args:
+            count (int): maximum number of addresses to claim.
+            worker_id (str): identifies the caller in the claimed_by column.
+            max_attempts (int): number of times an address is tried before
+                it is left as failed.
+            stale_after (float): seconds after which an unfinished claim can
+                be claimed again. If None, claims never go stale.
+        Returns:
+            list of claimed MapLocations.
+        """
+        token = '{}:{}'.format(worker_id, uuid.uuid4().hex)
+        now = time.time()
+        stale_before = -1 if stale_after is None else now - stale_after
         c = self.conn.cursor()
+        c.execute("UPDATE address_status "
+                  "SET status = 'failed', last_error = ? "
+                  "WHERE status = 'in_progress' AND claimed_at < ? "
+                  "AND attempts >= ?",
+                  ('claim went stale after {} attempts'.format(max_attempts),
+                   stale_before, max_attempts))
+        c.execute("UPDATE address_status "
+                  "SET status = 'in_progress', claimed_by = ?, "
+                  "claimed_at = ?, attempts = attempts + 1 "
+                  "WHERE address_id IN "
+                  "(SELECT address_id FROM address_status "
+                  "WHERE status = 'pending' "
+                  "OR (status = 'failed' AND attempts < ?) "
+                  "OR (status = 'in_progress' AND claimed_at < ? "
+                  "AND attempts < ?) "
+                  "ORDER BY address_id LIMIT ?)",
+                  (token, now, max_attempts, stale_before, max_attempts,
+                   count))
+        self.conn.commit()
         c.execute("SELECT "
                   "addresses.latitude, addresses.longitude, addresses.id "
-                  "FROM addresses LEFT JOIN routes "
-                  "ON routes.address_id = addresses.id "
-                  "WHERE routes.id IS NULL")
-        if verbose:
-            print("fetching all addresses without routes...")
+                  "FROM address_status JOIN addresses "
+                  "ON addresses.id = address_status.address_id "
+                  "WHERE address_status.claimed_by = ? "
+                  "AND address_status.status = 'in_progress' "
+                  "ORDER BY addresses.id", (token,))
         rows = c.fetchall()
         c.close()
-        if verbose:
-            print("fetched {} addresses".format(len(rows)))
-        for row in rows:
-            yield MapLocation(latitude=row[0], longitude=row[1], id=row[2])
+        return [MapLocation(latitude=row[0], longitude=row[1], id=row[2])
+                for row in rows]
+
+    def mark_address_done(self, address_id):
+        self._set_address_status(address_id, 'done', None)
+
+    def mark_address_failed(self, address_id, error=''):
+        self._set_address_status(address_id, 'failed', str(error))
+
+    def _set_address_status(self, address_id, status, error):
+        c = self.conn.cursor()
+        c.execute("UPDATE address_status SET status = ?, last_error = ? "
+                  "WHERE address_id = ?", (status, error, address_id))
+        self.conn.commit()
+        c.close()
+
+    def get_route_stop_ids(self, address_id):
+        """
+        Returns:
+            the set of stop ids that already have a route from an address.
+        """
+        self._add_routes_address_index()
+        c = self.conn.cursor()
+        c.execute("SELECT stop_id FROM routes WHERE address_id = ?",
+                  (address_id,))
+        stop_ids = set(row[0] for row in c.fetchall())
+        c.close()
+        return stop_ids
+
+    def get_routes_by_address(self, address_ids, chunk_size=500):
+        """
+        Returns:
+            a dict from each of address_ids that has routes to a dict from
+            stop id to the (distance, time) of the route to that stop.
+        """
+        address_ids = list(address_ids)
+        routes = {}
+        c = self.conn.cursor()
+        for start in range(0, len(address_ids), chunk_size):
+            chunk = address_ids[start:start + chunk_size]
+            c.execute("SELECT address_id, stop_id, distance, time "
+                      "FROM routes WHERE address_id IN ({})".format(
+                          ', '.join('?' * len(chunk))), chunk)
+            for address_id, stop_id, distance, route_time in c.fetchall():
+                routes.setdefault(address_id, {})[stop_id] = (distance,
+                                                              route_time)
+        c.close()
+        return routes
+
+    def address_queue_counts(self):
+        """
+        Returns:
+            a dict of the number of addresses in the work queue by status.
+        """
+        c = self.conn.cursor()
+        c.execute("SELECT status, COUNT(*) FROM address_status "
+                  "GROUP BY status")
+        counts = dict(c.fetchall())
+        c.close()
+        return counts
+
+    # Sharding
+    def get_id_ranges(self, count):
+        """
+        Splits the addresses into contiguous id ranges holding roughly the
+        same number of addresses.
+
+        Args:
+            count (int): number of ranges.
+        Returns:
+            list of (min_id, max_id) tuples, inclusive. There are fewer than
+            count ranges if there are fewer addresses than count.
+        """
+        c = self.conn.cursor()
+        c.execute("SELECT COUNT(*) FROM addresses")
+        total = c.fetchone()[0]
+        ranges = []
+        for i in range(count):
+            start = total * i // count
+            end = total * (i + 1) // count
+            if end <= start:
+                continue
+            c.execute("SELECT id FROM addresses ORDER BY id LIMIT 1 OFFSET ?",
+                      (start,))
+            min_id = c.fetchone()[0]
+            c.execute("SELECT id FROM addresses ORDER BY id LIMIT 1 OFFSET ?",
+                      (end - 1,))
+            max_id = c.fetchone()[0]
+            ranges.append((min_id, max_id))
+        c.close()
+        return ranges
+
+    def export_shard(self, shard_file_name, min_id, max_id):
+        """
+        Creates a database holding the addresses with ids from min_id to
+        max_id, their routes, and every stop, so a DataGenerator can process
+        the shard on its own. Ids are kept, so the shard's routes can later be
+        folded back in with merge_routes().
+        """
+        DatabaseHandler(shard_file_name).conn.close()
+        self.conn.commit()
+        c = self.conn.cursor()
+        c.execute("ATTACH DATABASE ? AS shard", (shard_file_name,))
+        try:
+            c.execute("INSERT INTO shard.addresses (id, latitude, longitude) "
+                      "SELECT id, latitude, longitude FROM addresses "
+                      "WHERE id BETWEEN ? AND ?", (min_id, max_id))
+            c.execute("INSERT INTO shard.stops "
+                      "(id, stop_id, stop_name, latitude, longitude) "
+                      "SELECT id, stop_id, stop_name, latitude, longitude "
+                      "FROM stops")
+            c.execute("INSERT INTO shard.routes "
+                      "(address_id, stop_id, distance, time) "
+                      "SELECT address_id, stop_id, distance, time FROM routes "
+                      "WHERE address_id BETWEEN ? AND ?", (min_id, max_id))
+            self.conn.commit()
+        finally:
+            c.execute("DETACH DATABASE shard")
+            c.close()
+
+    def merge_routes(self, shard_file_name):
+        """
+        Copies routes from a shard database created by export_shard() into
+        this database, skipping address-stop pairs that already have a route.
+
+        Returns:
+            the number of routes copied.
+        """
+        # each shard route is checked against the routes of its address
+        self._add_routes_address_index()
+        self.conn.commit()
+        c = self.conn.cursor()
+        c.execute("ATTACH DATABASE ? AS shard", (shard_file_name,))
+        try:
+            c.execute("INSERT INTO routes "
+                      "(address_id, stop_id, distance, time) "
+                      "SELECT address_id, stop_id, distance, time "
+                      "FROM shard.routes AS shard_routes "
+                      "WHERE NOT EXISTS (SELECT 1 FROM routes "
+                      "WHERE routes.address_id = shard_routes.address_id "
+                      "AND routes.stop_id = shard_routes.stop_id)")
+            merged = c.rowcount
+            self.conn.commit()
+        finally:
+            c.execute("DETACH DATABASE shard")
+            c.close()
+        return merged
 
     def get_all_stops(self):
         c = self.conn.cursor()
@@ -131,7 +705,8 @@ class DatabaseHandler:
         return [MapLocation(latitude=row[3], longitude=row[4], id=row[0])
                 for row in rows]
 
-    def output_routes(self, file_path, closest_stops_only=False):
+    def output_routes(self, file_path, closest_stops_only=False,
+                      chunksize=None, file_format=None):
         """
 
         Args:
@@ -140,6 +715,11 @@ class DatabaseHandler:
                 closest (by the distance column) to each address. If there are
                 multiple stops per address that have the same distance, both are
                 returned.
+            chunksize (int): If set, routes are read from the database and
+                written this many rows at a time, so the whole table is never
+                held in memory. See export_routes().
+            file_format (str): Format used when chunksize is set. See
+                export_routes().
         Returns:
             A pandas DataFrame with the following columns:
                 address_latitude
@@ -156,44 +736,252 @@ class DatabaseHandler:
             can return multiple stops per address if their associated routes
             have equal distances.
         """
+        if chunksize is not None:
+            return self.export_routes(file_path, closest_stops_only,
+                                      chunksize=chunksize,
+                                      file_format=file_format)
         if closest_stops_only:
             return self.routes_dataframe_closest_stops().to_csv(file_path)
         else:
             return self.routes_dataframe().to_csv(file_path)
 
+    def export_routes(self, file_path, closest_stops_only=False,
+                      chunksize=100000, file_format=None):
+        """
+        Writes routes to a file while reading them from the database in
+        chunks, so memory use doesn't depend on the number of routes.
+
+        Args:
+            file_path (str): the file path to save the output to.
+            closest_stops_only (bool): If true, only the routes to the closest
+                stops of each address are written, as in
+                routes_dataframe_closest_stops().
+            chunksize (int): number of rows read and written at a time.
+            file_format (str): One of:
+                'csv' - comma separated values
+                'csv.gz' - gzip compressed comma separated values
+                'parquet' - Apache Parquet, with float64 coordinates and
+                    float32 distance and time columns. Requires pyarrow.
+                'geojson' - a GeoJSON FeatureCollection with a point for each
+                    address and numeric distance and time properties.
+                If None (default), the format is chosen from the extension of
+                file_path, falling back to 'csv'.
+        Returns:
+            the number of routes written.
+        """
+        if file_format is None:
+            file_format = self._get_export_format(file_path)
+        writers = {'csv': self._write_csv_chunks,
+                   'csv.gz': self._write_csv_chunks,
+                   'parquet': self._write_parquet_chunks,
+                   'geojson': self._write_geojson_chunks}
+        if file_format not in writers:
+            raise ValueError('unknown export format: {}'.format(file_format))
+        chunks = pd.read_sql_query(self._routes_query(closest_stops_only),
+                                   self.conn, chunksize=chunksize)
+        return writers[file_format](file_path, chunks,
+                                    compress=file_format == 'csv.gz')
+
+    def _get_export_format(self, file_path):
+        for extension, file_format in (('.csv.gz', 'csv.gz'),
+                                       ('.parquet', 'parquet'),
+                                       ('.geojson', 'geojson'),
+                                       ('.json', 'geojson')):
+            if file_path.lower().endswith(extension):
+                return file_format
+        return 'csv'
+
+    def _write_csv_chunks(self, file_path, chunks, compress=False):
+        if compress:
+            output_file = gzip.open(file_path, 'wb')
+        else:
+            output_file = open(file_path, 'wb')
+        count = 0
+        with output_file:
+            for chunk in chunks:
+                output_file.write(chunk.to_csv(index=False,
+                                               header=count == 0).
+                                  encode('utf-8'))
+                count += len(chunk)
+            if count == 0:
+                output_file.write((','.join(ROUTE_COLUMNS) + '\n').
+                                  encode('utf-8'))
+        return count
+
+    def _write_parquet_chunks(self, file_path, chunks, compress=False):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError('pyarrow is required to export Parquet files')
+        schema = pyarrow.schema(
+            [(column, pyarrow.float64()) for column in ROUTE_COLUMNS[:4]] +
+            [('distance', pyarrow.float32()), ('time', pyarrow.float32())])
+        count = 0
+        writer = pyarrow.parquet.ParquetWriter(file_path, schema)
+        try:
+            for chunk in chunks:
+                chunk = chunk.astype(ROUTE_EXPORT_TYPES)
+                writer.write_table(pyarrow.Table.from_pandas(
+                    chunk, schema=schema, preserve_index=False))
+                count += len(chunk)
+        finally:
+            writer.close()
+        return count
+
+    def _write_geojson_chunks(self, file_path, chunks, compress=False):
+        count = 0
+        with open(file_path, 'w') as output_file:
+            output_file.write('{"type": "FeatureCollection", "features": [')
+            for chunk in chunks:
+                for row in chunk.itertuples(index=False):
+                    if pd.isnull(row.address_latitude) or \
+                            pd.isnull(row.address_longitude):
+                        continue
+                    if count > 0:
+                        output_file.write(',')
+                    output_file.write('\n' + json.dumps({
+                        "type": "Feature",
+                        "geometry": {
+                            "type": "Point",
+                            "coordinates": [float(row.address_longitude),
+                                            float(row.address_latitude)]},
+                        "properties": {
+                            "stop_latitude": float(row.stop_latitude),
+                            "stop_longitude": float(row.stop_longitude),
+                            "distance": float(row.distance),
+                            "time": float(row.time)}}))
+                    count += 1
+            output_file.write('\n]}\n')
+        return count
+
     def routes_dataframe(self):
         """
         Returns:
             all routes along with the stop and address latitudes and longitudes
             as a pandas DataFrame.
         """
-        return pd.read_sql_query(
-            "SELECT "
-            "addresses.latitude AS address_latitude,"
-            "addresses.longitude AS address_longitude,"
-            "stops.latitude AS stop_latitude,"
-            "stops.longitude AS stop_longitude,"
-            "routes.distance AS distance,"
-            "routes.time AS time "
-            "FROM routes "
-            "LEFT JOIN addresses ON routes.address_id = addresses.id "
-            "LEFT JOIN stops ON routes.stop_id = stops.id",
-            self.conn)
+        return pd.read_sql_query(self._routes_query(), self.conn)
 
     def routes_dataframe_closest_stops(self):
         """
-        Collects all routes and groups them by address. Returns the nearest stop
-        to each address as well as the time and distance to that stop. Sorts by
-        distance.
-        """
-        df = self.routes_dataframe()
-        df_grouped = df.groupby(['address_latitude', 'address_longitude']).\
-            agg({'distance': 'min'})
-        df_grouped = df_grouped.reset_index()
-        df_grouped = df_grouped.rename(columns={'distance':'distance_min'})
-        df = pd.merge(df, df_grouped, how='left',
-                      on=['address_latitude', 'address_longitude'])
-        df = df[df['distance'] == df['distance_min']]
-        return df[['address_latitude', 'address_longitude',
-                   'stop_latitude', 'stop_longitude',
-                   'distance', 'time']].reset_index()
+        Returns the nearest stop to each address as well as the time and
+        distance to that stop. If several stops are at the same shortest
+        distance from an address, all of them are returned.
+
+        The selection is made in the database, grouping routes by address_id,
+        so only the closest routes are loaded. The grouping uses the
+        routes_address_id_distance index if enable_performance_profile() has
+        created it. If enable_closest_routes() has been called on the
+        database, the closest routes are read from the closest_routes table
+        instead.
+
+        Rows are ordered by route id and indexed from 0. Unlike earlier
+        versions, there is no separate index column.
+        """
+        return pd.read_sql_query(self._routes_query(closest_stops_only=True),
+                                 self.conn)
+
+    def _routes_query(self, closest_stops_only=False):
+        select = ("SELECT "
+                  "addresses.latitude AS address_latitude,"
+                  "addresses.longitude AS address_longitude,"
+                  "stops.latitude AS stop_latitude,"
+                  "stops.longitude AS stop_longitude,"
+                  "routes.distance AS distance,"
+                  "routes.time AS time ")
+        joins = ("LEFT JOIN addresses ON routes.address_id = addresses.id "
+                 "LEFT JOIN stops ON routes.stop_id = stops.id")
+        if not closest_stops_only:
+            return select + "FROM routes " + joins
+        if self._has_table('closest_routes'):
+            closest = "SELECT route_id AS id FROM closest_routes"
+        else:
+            closest = ("SELECT routes.id AS id FROM routes "
+                       "JOIN (SELECT address_id, MIN(distance) AS distance "
+                       "FROM routes GROUP BY address_id) AS shortest "
+                       "ON routes.address_id = shortest.address_id "
+                       "AND routes.distance = shortest.distance")
+        return (select + "FROM (" + closest + ") AS closest "
+                "JOIN routes ON routes.id = closest.id " + joins +
+                " ORDER BY routes.id")
+
+    def enable_closest_routes(self):
+        """
+        Keeps the closest routes to each address in a closest_routes table,
+        which is updated by a trigger as routes are added, so the closest
+        stops can be read without searching every route. Existing routes are
+        added to the table when it is created. The table is stored in the
+        database, so this only needs to be called once.
+        """
+        c = self.conn.cursor()
+        c.execute("""
+                  CREATE TABLE IF NOT EXISTS closest_routes
+                  (route_id INTEGER PRIMARY KEY,
+                  address_id INTEGER NOT NULL,
+                  distance INTEGER NOT NULL,
+                  FOREIGN KEY(route_id) REFERENCES routes(id))
+                  """)
+        c.execute("CREATE INDEX IF NOT EXISTS closest_routes_address_id "
+                  "ON closest_routes (address_id, distance)")
+        # A new route replaces longer closest routes, and is added unless a
+        # shorter one is already known. Routes at equal distances are kept.
+        c.execute("""
+                  CREATE TRIGGER IF NOT EXISTS routes_update_closest_routes
+                  AFTER INSERT ON routes
+                  BEGIN
+                  DELETE FROM closest_routes
+                  WHERE address_id = NEW.address_id
+                  AND distance > NEW.distance;
+                  INSERT INTO closest_routes (route_id, address_id, distance)
+                  SELECT NEW.id, NEW.address_id, NEW.distance
+                  WHERE NOT EXISTS (SELECT 1 FROM closest_routes
+                                    WHERE address_id = NEW.address_id
+                                    AND distance < NEW.distance);
+                  END
+                  """)
+        self.conn.commit()
+        c.close()
+        self.rebuild_closest_routes()
+
+    def rebuild_closest_routes(self):
+        """
+        Refills the closest_routes table from the routes table, for instance
+        after routes have been deleted or edited.
+        """
+        self._add_routes_indexes()
+        c = self.conn.cursor()
+        try:
+            c.execute("DELETE FROM closest_routes")
+            c.execute("INSERT INTO closest_routes "
+                      "(route_id, address_id, distance) "
+                      "SELECT routes.id, routes.address_id, routes.distance "
+                      "FROM routes "
+                      "JOIN (SELECT address_id, MIN(distance) AS distance "
+                      "FROM routes GROUP BY address_id) AS shortest "
+                      "ON routes.address_id = shortest.address_id "
+                      "AND routes.distance = shortest.distance")
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        finally:
+            c.close()
+
+    def _has_table(self, table_name):
+        c = self.conn.cursor()
+        c.execute("SELECT 1 FROM sqlite_master "
+                  "WHERE type = 'table' AND name = ?", (table_name,))
+        exists = c.fetchone() is not None
+        c.close()
+        return exists
+
+
+def _location_keys(latitudes, longitudes, precision):
+    # Packs coordinates rounded to precision decimal places into one int64
+    # per location. With at most 7 decimal places the key fits in 63 bits.
+    scale = 10 ** precision
+    latitudes = np.rint((np.asarray(latitudes) + 90) * scale).astype(np.int64)
+    longitudes = np.rint((np.asarray(longitudes) + 180) *
+                         scale).astype(np.int64)
+    return latitudes * (360 * scale + 1) + longitudes
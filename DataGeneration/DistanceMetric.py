@@ -0,0 +1,116 @@
+import numpy as np
+
+# Mean radius of the earth in meters
+EARTH_RADIUS = 6371008.8
+
+
+class EuclideanMetric:
+    """
+    Straight line distance in degrees, treating latitude and longitude as
+    planar coordinates. Away from the equator this over-weights differences in
+    longitude.
+    """
+
+    def distance(self, lat1, lng1, lat2, lng2):
+        """
+        Returns the distance between two points, or element-wise between
+        arrays of points, in degrees.
+        """
+        return np.sqrt((np.subtract(lat1, lat2)) ** 2 +
+                       (np.subtract(lng1, lng2)) ** 2)
+
+    def project(self, latitudes, longitudes):
+        """
+        Returns points as an array of planar coordinates in which euclidean
+        distance orders points the same way as this metric.
+        """
+        return np.stack([np.asarray(latitudes, dtype=np.float64),
+                         np.asarray(longitudes, dtype=np.float64)], axis=-1)
+
+
+class EquirectangularMetric:
+    """
+    Distance in meters on a local equirectangular projection. Longitude is
+    scaled by the cosine of a fixed reference latitude, which is accurate to
+    well under one percent across a metropolitan area.
+    """
+
+    def __init__(self, reference_latitude=41.5):
+        """
+        Args:
+            reference_latitude (float): latitude in degrees at which the
+                projection is true to scale. Defaults to the latitude of
+                Cleveland.
+        """
+        self.reference_latitude = reference_latitude
+        self.longitude_scale = np.cos(np.radians(reference_latitude))
+
+    def distance(self, lat1, lng1, lat2, lng2):
+        """
+        Returns the distance between two points, or element-wise between
+        arrays of points, in meters.
+        """
+        d_y = np.radians(np.subtract(lat1, lat2))
+        d_x = np.radians(np.subtract(lng1, lng2)) * self.longitude_scale
+        return EARTH_RADIUS * np.sqrt(d_x ** 2 + d_y ** 2)
+
+    def project(self, latitudes, longitudes):
+        """
+        Returns points as an array of x, y coordinates in meters.
+        """
+        y = EARTH_RADIUS * np.radians(np.asarray(latitudes, dtype=np.float64))
+        x = EARTH_RADIUS * self.longitude_scale * \
+            np.radians(np.asarray(longitudes, dtype=np.float64))
+        return np.stack([y, x], axis=-1)
+
+
+class HaversineMetric:
+    """
+    Great-circle distance in meters on a spherical earth.
+    """
+
+    def distance(self, lat1, lng1, lat2, lng2):
+        """
+        Returns the distance between two points, or element-wise between
+        arrays of points, in meters.
+        """
+        lat1, lng1, lat2, lng2 = [np.radians(np.asarray(value,
+                                                        dtype=np.float64))
+                                  for value in (lat1, lng1, lat2, lng2)]
+        a = np.sin((lat2 - lat1) / 2) ** 2 + \
+            np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+        return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+    def project(self, latitudes, longitudes):
+        """
+        Returns points as an array of 3D cartesian coordinates in meters.
+        Chord length between these points increases monotonically with
+        great-circle distance, so nearest neighbors are preserved.
+        """
+        latitudes = np.radians(np.asarray(latitudes, dtype=np.float64))
+        longitudes = np.radians(np.asarray(longitudes, dtype=np.float64))
+        return EARTH_RADIUS * np.stack([np.cos(latitudes) * np.cos(longitudes),
+                                        np.cos(latitudes) * np.sin(longitudes),
+                                        np.sin(latitudes)], axis=-1)
+
+
+METRICS = {
+    'euclidean': EuclideanMetric,
+    'equirectangular': EquirectangularMetric,
+    'haversine': HaversineMetric
+}
+
+
+def get_metric(metric):
+    """
+    Returns a distance metric instance.
+
+    Args:
+        metric: either the name of a metric in METRICS or an object with
+            distance() and project() methods, which is returned unchanged.
+    """
+    if metric in METRICS:
+        return METRICS[metric]()
+    if hasattr(metric, 'distance') and hasattr(metric, 'project'):
+        return metric
+    raise ValueError('unknown distance metric: {}'.format(metric))
@@ -0,0 +1,169 @@
+import json
+import numpy as np
+from DataGeneration.DistanceMetric import EARTH_RADIUS, HaversineMetric
+
+
+class GridMask:
+    """
+    Drops grid points that are not worth routing: points outside a service
+    area polygon, and points further than a straight line distance from the
+    nearest stop. Either check can be used on its own.
+    """
+
+    # Number of points compared against the stops at a time
+    CHUNK_SIZE = 256
+
+    def __init__(self, polygon=None, stops=None, max_stop_distance=None):
+        """
+        Args:
+            polygon (dict): GeoJSON Polygon or MultiPolygon, or a Feature or
+                FeatureCollection of them. Points outside every polygon are
+                dropped. Holes are respected.
+            stops (list): the stops, such as the output of
+                DatabaseHandler.get_all_stops(). Required with
+                max_stop_distance.
+            max_stop_distance (float): points further than this many meters
+                from the nearest stop are dropped.
+        """
+        if max_stop_distance is not None and not stops:
+            raise ValueError('stops are required with max_stop_distance')
+        self.polygons = _get_polygons(polygon) if polygon is not None else None
+        self.max_stop_distance = max_stop_distance
+        self.metric = HaversineMetric()
+        self.stop_latitudes = None
+        if max_stop_distance is not None:
+            latitudes = np.array([stop.latitude for stop in stops],
+                                 dtype=np.float64)
+            longitudes = np.array([stop.longitude for stop in stops],
+                                  dtype=np.float64)
+            order = np.argsort(latitudes, kind='mergesort')
+            self.stop_latitudes = latitudes[order]
+            self.stop_longitudes = longitudes[order]
+            lat_margin = np.degrees(max_stop_distance / EARTH_RADIUS)
+            self.lat_margin = lat_margin
+            max_latitude = min(max(abs(lat) for lat in latitudes) + lat_margin,
+                               90)
+            lng_margin = min(lat_margin /
+                             max(np.cos(np.radians(max_latitude)), 1e-9), 360)
+            self.stop_bounds = (min(latitudes) - lat_margin,
+                                max(latitudes) + lat_margin,
+                                min(longitudes) - lng_margin,
+                                max(longitudes) + lng_margin)
+
+    @classmethod
+    def from_geojson_file(cls, file_name, **kwargs):
+        """
+        Creates a mask from the polygon in a GeoJSON file.
+
+        Args:
+            file_name (str): file path to the GeoJSON file.
+            **kwargs: other arguments for GridMask.
+        """
+        with open(file_name) as geojson_file:
+            return cls(polygon=json.load(geojson_file), **kwargs)
+
+    def contains(self, latitudes, longitudes):
+        """
+        Returns:
+            numpy boolean array, True for each point that passes the mask.
+        """
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        keep = np.ones(latitudes.shape, dtype=bool)
+        if self.polygons is not None:
+            keep &= self._in_polygons(latitudes, longitudes)
+        if self.stop_latitudes is not None:
+            keep &= self._near_stops(latitudes, longitudes, keep)
+        return keep
+
+    def filter(self, block):
+        """
+        Returns the rows of a (k, 2) array of latitude, longitude pairs, such
+        as a block from UniformMapGenerator.get_uniform_coordinate_blocks,
+        that pass the mask.
+        """
+        block = np.asarray(block, dtype=np.float64).reshape(-1, 2)
+        return block[self.contains(block[:, 0], block[:, 1])]
+
+    def _in_polygons(self, latitudes, longitudes):
+        inside = np.zeros(latitudes.shape, dtype=bool)
+        for rings in self.polygons:
+            outer = rings[0]
+            # Only points inside the outer ring's bounding box are tested
+            candidates = np.flatnonzero(
+                (latitudes >= outer[:, 1].min()) &
+                (latitudes <= outer[:, 1].max()) &
+                (longitudes >= outer[:, 0].min()) &
+                (longitudes <= outer[:, 0].max()) & ~inside)
+            if len(candidates) == 0:
+                continue
+            lats = latitudes[candidates]
+            lngs = longitudes[candidates]
+            # Even-odd ray casting over every ring, so holes are excluded
+            crossings = np.zeros(len(candidates), dtype=bool)
+            for ring in rings:
+                x1, y1 = ring[:-1, 0], ring[:-1, 1]
+                x2, y2 = ring[1:, 0], ring[1:, 1]
+                for i in range(len(x1)):
+                    if y1[i] == y2[i]:
+                        continue
+                    straddles = (y1[i] > lats) != (y2[i] > lats)
+                    x = x1[i] + (lats - y1[i]) * \
+                        (x2[i] - x1[i]) / (y2[i] - y1[i])
+                    crossings ^= straddles & (lngs < x)
+            inside[candidates] = crossings
+        return inside
+
+    def _near_stops(self, latitudes, longitudes, keep):
+        lat_min, lat_max, lng_min, lng_max = self.stop_bounds
+        near = keep & (latitudes >= lat_min) & (latitudes <= lat_max) & \
+            (longitudes >= lng_min) & (longitudes <= lng_max)
+        # Points are sorted by latitude so that each chunk only needs to be
+        # compared with the stops in a narrow band of latitudes, since no
+        # stop further north or south than max_stop_distance can be in range
+        candidates = np.flatnonzero(near)
+        candidates = candidates[np.argsort(latitudes[candidates],
+                                           kind='mergesort')]
+        near[candidates] = False
+        for start in range(0, len(candidates), self.CHUNK_SIZE):
+            chunk = candidates[start:start + self.CHUNK_SIZE]
+            lats = latitudes[chunk]
+            low = np.searchsorted(self.stop_latitudes,
+                                  lats[0] - self.lat_margin, side='left')
+            high = np.searchsorted(self.stop_latitudes,
+                                   lats[-1] + self.lat_margin, side='right')
+            if low == high:
+                continue
+            distances = self.metric.distance(
+                lats[:, np.newaxis], longitudes[chunk, np.newaxis],
+                self.stop_latitudes[np.newaxis, low:high],
+                self.stop_longitudes[np.newaxis, low:high])
+            near[chunk] = (distances <= self.max_stop_distance).any(axis=1)
+        return near
+
+
+def _get_polygons(geojson):
+    # Returns a list of polygons, each a list of closed rings as arrays of
+    # longitude, latitude rows with the outer ring first
+    if geojson['type'] == 'FeatureCollection':
+        return [polygon for feature in geojson['features']
+                for polygon in _get_polygons(feature)]
+    if geojson['type'] == 'Feature':
+        return _get_polygons(geojson['geometry'])
+    if geojson['type'] == 'Polygon':
+        polygons = [geojson['coordinates']]
+    elif geojson['type'] == 'MultiPolygon':
+        polygons = geojson['coordinates']
+    else:
+        raise ValueError('unsupported GeoJSON type: {}'.format(
+            geojson['type']))
+    result = []
+    for polygon in polygons:
+        rings = []
+        for ring in polygon:
+            ring = np.asarray(ring, dtype=np.float64)[:, :2]
+            if not np.array_equal(ring[0], ring[-1]):
+                ring = np.vstack([ring, ring[:1]])
+            rings.append(ring)
+        result.append(rings)
+    return result
@@ -0,0 +1,278 @@
+import json
+import time
+import numpy as np
+
+
+class IsochroneGenerator:
+    """
+    Turns travel times to the closest stop into isochrone bands. Travel times
+    are averaged onto a regular raster, small gaps in the raster are filled
+    from neighboring cells, and the cells in each band between two break
+    points are traced into GeoJSON polygons.
+
+    Polygons follow the raster cells, so their detail is set by the raster
+    resolution. Outer rings are counterclockwise and holes clockwise, as
+    recommended by the GeoJSON specification.
+    """
+
+    def __init__(self, breaks=(0, 300, 600, 900, 1200, 1800, 2700),
+                 lat_res=0.001, lng_res=0.001, fill_distance=2,
+                 value_column='time'):
+        """
+        Args:
+            breaks (list): increasing break points between bands, in the units
+                of value_column. Each band covers values from one break point
+                up to, but not including, the next.
+            lat_res (float): raster cell height in degrees of latitude.
+            lng_res (float): raster cell width in degrees of longitude.
+            fill_distance (int): empty cells up to this many cells from a cell
+                with data are filled with the average of their neighbors.
+                Cells further away, such as those over the lake, stay empty
+                and are left out of every band.
+            value_column (str): column holding the travel times.
+        """
+        if len(breaks) < 2 or list(breaks) != sorted(breaks):
+            raise ValueError('breaks must hold at least two increasing values')
+        self.breaks = list(breaks)
+        self.lat_res = lat_res
+        self.lng_res = lng_res
+        self.fill_distance = fill_distance
+        self.value_column = value_column
+        self.timings = {}
+
+    def get_isochrones(self, df, verbose=False):
+        """
+        Builds the isochrone bands.
+
+        Args:
+            df (pandas.DataFrame): output of
+                DatabaseHandler.routes_dataframe_closest_stops(), or any frame
+                with address_latitude, address_longitude, and value_column
+                columns.
+            verbose (bool): if True, displays the time taken by each step.
+        Returns:
+            a GeoJSON FeatureCollection dict with one MultiPolygon feature per
+            band. Each feature has min_time and max_time properties.
+        """
+        self.timings = {}
+        start = time.time()
+        grid, origin = self.rasterize(df['address_latitude'].values,
+                                      df['address_longitude'].values,
+                                      df[self.value_column].values)
+        self._record('rasterize', start, verbose)
+
+        start = time.time()
+        grid = self.fill(grid)
+        self._record('fill', start, verbose)
+
+        start = time.time()
+        features = []
+        # Empty cells are moved below every band
+        grid = np.where(np.isnan(grid), -np.inf, grid)
+        for low, high in zip(self.breaks[:-1], self.breaks[1:]):
+            polygons = self.trace_polygons((grid >= low) & (grid < high),
+                                           origin)
+            features.append({
+                "type": "Feature",
+                "properties": {"min_time": low, "max_time": high},
+                "geometry": {"type": "MultiPolygon", "coordinates": polygons}
+            })
+        self._record('contour', start, verbose)
+        return {"type": "FeatureCollection", "features": features}
+
+    def write_geojson(self, df, file_path='isochrones.geojson', verbose=False):
+        """
+        Builds the isochrone bands and writes them to a GeoJSON file.
+
+        Args:
+            df (pandas.DataFrame): as in get_isochrones.
+            file_path (str): path of the GeoJSON file to write.
+            verbose (bool): if True, displays the time taken by each step.
+        Returns:
+            the GeoJSON FeatureCollection dict.
+        """
+        isochrones = self.get_isochrones(df, verbose=verbose)
+        start = time.time()
+        with open(file_path, 'w') as geojson_file:
+            json.dump(isochrones, geojson_file)
+        self._record('write', start, verbose)
+        return isochrones
+
+    def rasterize(self, latitudes, longitudes, values):
+        """
+        Averages values onto a raster with one row per lat_res and one column
+        per lng_res, starting at the smallest latitude and longitude.
+
+        Returns:
+            (grid, (lat_min, lng_min)) where grid is a 2D float array with NaN
+            in cells without values, and (lat_min, lng_min) is the center of
+            cell [0, 0].
+        """
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        values = np.asarray(values, dtype=np.float64)
+        valid = np.isfinite(latitudes) & np.isfinite(longitudes) & \
+            np.isfinite(values)
+        latitudes, longitudes, values = \
+            latitudes[valid], longitudes[valid], values[valid]
+        if len(values) == 0:
+            return np.full((0, 0), np.nan), (0.0, 0.0)
+        origin = (latitudes.min(), longitudes.min())
+        rows = np.rint((latitudes - origin[0]) / self.lat_res).astype(np.int64)
+        columns = np.rint((longitudes - origin[1]) /
+                          self.lng_res).astype(np.int64)
+        shape = (rows.max() + 1, columns.max() + 1)
+        cells = rows * shape[1] + columns
+        size = shape[0] * shape[1]
+        counts = np.bincount(cells, minlength=size)
+        totals = np.bincount(cells, weights=values, minlength=size)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            grid = totals / counts
+        return grid.reshape(shape), origin
+
+    def fill(self, grid):
+        """
+        Fills empty cells within fill_distance cells of data with the average
+        of their filled neighbors, one ring of cells at a time.
+        """
+        grid = grid.copy()
+        for _ in range(self.fill_distance):
+            empty = np.isnan(grid)
+            if not empty.any():
+                break
+            padded = np.pad(grid, 1, mode='constant', constant_values=np.nan)
+            totals = np.zeros(grid.shape)
+            counts = np.zeros(grid.shape)
+            for d_row in (-1, 0, 1):
+                for d_column in (-1, 0, 1):
+                    if d_row == 0 and d_column == 0:
+                        continue
+                    neighbor = padded[1 + d_row:1 + d_row + grid.shape[0],
+                                      1 + d_column:1 + d_column + grid.shape[1]]
+                    has_value = ~np.isnan(neighbor)
+                    totals += np.where(has_value, neighbor, 0)
+                    counts += has_value
+            fillable = empty & (counts > 0)
+            grid[fillable] = totals[fillable] / counts[fillable]
+        return grid
+
+    def trace_polygons(self, mask, origin):
+        """
+        Traces the outlines of the True cells of a 2D boolean raster.
+
+        Returns:
+            GeoJSON MultiPolygon coordinates: a list of polygons, each a list
+            of closed [longitude, latitude] rings with the outer ring first.
+        """
+        rings = [self._to_coordinates(rows, columns, origin)
+                 for rows, columns in self._trace_rings(mask)]
+        areas = [_signed_area(ring) for ring in rings]
+        outers = [i for i, area in enumerate(areas) if area > 0]
+        polygons = dict((i, [rings[i]]) for i in outers)
+        for hole in (i for i, area in enumerate(areas) if area < 0):
+            # The left side of every traced edge is inside the band, so a
+            # point just left of the hole's first edge is in its polygon
+            (x1, y1), (x2, y2) = rings[hole][0], rings[hole][1]
+            x = (x1 + x2) / 2.0 - np.sign(y2 - y1) * self.lng_res / 4.0
+            y = (y1 + y2) / 2.0 + np.sign(x2 - x1) * self.lat_res / 4.0
+            containing = [i for i in outers if _ring_contains(rings[i], x, y)]
+            if containing:
+                smallest = min(containing, key=lambda i: areas[i])
+                polygons[smallest].append(rings[hole])
+        return [[ring.tolist() for ring in polygons[i]] for i in outers]
+
+    def _trace_rings(self, mask):
+        # Returns rings as (rows, columns) arrays of vertices of the cell grid,
+        # where vertex (r, c) is the lower left corner of cell (r, c). Every
+        # cell's edges run counterclockwise, so only edges between a cell in
+        # the band and one outside of it are kept, with the band on the left.
+        padded = np.pad(mask, 1, mode='constant', constant_values=False)
+        below, above = padded[:-1, 1:-1], padded[1:, 1:-1]
+        left, right = padded[1:-1, :-1], padded[1:-1, 1:]
+        width = mask.shape[1] + 1
+        starts, ends = [], []
+        # Horizontal edges between rows r - 1 and r
+        r, c = np.nonzero(above & ~below)
+        starts.append(r * width + c)
+        ends.append(r * width + c + 1)
+        r, c = np.nonzero(below & ~above)
+        starts.append(r * width + c + 1)
+        ends.append(r * width + c)
+        # Vertical edges between columns c - 1 and c
+        r, c = np.nonzero(right & ~left)
+        starts.append((r + 1) * width + c)
+        ends.append(r * width + c)
+        r, c = np.nonzero(left & ~right)
+        starts.append(r * width + c)
+        ends.append((r + 1) * width + c)
+        starts = np.concatenate(starts).astype(np.int64)
+        ends = np.concatenate(ends).astype(np.int64)
+        if len(starts) == 0:
+            return []
+
+        # Each edge is followed by the edge leaving its end vertex. Where two
+        # cells touch only at a corner, two edges leave the vertex and the
+        # left turn is taken, which keeps the cells in separate rings.
+        order = np.argsort(starts, kind='mergesort')
+        position = np.searchsorted(starts[order], ends)
+        first = order[position]
+        second = order[np.minimum(position + 1, len(order) - 1)]
+        left_turn = ends + _left_offset(starts, ends, width)
+        following = np.where(
+            (starts[second] == ends) & (ends[second] == left_turn),
+            second, first).tolist()
+
+        rings = []
+        visited = bytearray(len(starts))
+        for edge in range(len(starts)):
+            if visited[edge]:
+                continue
+            ring = []
+            while not visited[edge]:
+                visited[edge] = 1
+                ring.append(edge)
+                edge = following[edge]
+            vertices = starts[ring]
+            rows, columns = vertices // width, vertices % width
+            # Drop vertices in the middle of straight runs of edges
+            d_rows, d_columns = rows - np.roll(rows, 1), \
+                columns - np.roll(columns, 1)
+            turns = d_rows * np.roll(d_columns, -1) != \
+                d_columns * np.roll(d_rows, -1)
+            rings.append((rows[turns], columns[turns]))
+        return rings
+
+    def _to_coordinates(self, rows, columns, origin):
+        coordinates = np.column_stack(
+            (origin[1] + (columns - 0.5) * self.lng_res,
+             origin[0] + (rows - 0.5) * self.lat_res))
+        return np.vstack((coordinates, coordinates[:1]))
+
+    def _record(self, step, start, verbose):
+        self.timings[step] = time.time() - start
+        if verbose:
+            print('{}: {:.3f} seconds'.format(step, self.timings[step]))
+
+
+def _left_offset(starts, ends, width):
+    # Offset in vertex ids from the end of each edge to the vertex reached
+    # by turning left there. Edges are one step along a row or a column.
+    step = ends - starts
+    d_rows = np.where(np.abs(step) == width, np.sign(step), 0)
+    d_columns = np.where(np.abs(step) == 1, step, 0)
+    return d_columns * width - d_rows
+
+
+def _signed_area(ring):
+    # Positive for counterclockwise rings
+    x, y = ring[:, 0], ring[:, 1]
+    return 0.5 * np.sum(x[:-1] * y[1:] - x[1:] * y[:-1])
+
+
+def _ring_contains(ring, x, y):
+    x1, y1 = ring[:-1, 0], ring[:-1, 1]
+    x2, y2 = ring[1:, 0], ring[1:, 1]
+    straddles = (y1 > y) != (y2 > y)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        crossing = x1 + (y - y1) * (x2 - x1) / (y2 - y1)
+        return bool(np.count_nonzero(straddles & (x < crossing)) % 2)
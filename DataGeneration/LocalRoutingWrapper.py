@@ -0,0 +1,150 @@
+import requests
+from DataGeneration.DistanceMetric import HaversineMetric
+from DataGeneration.StreetGraph import StreetGraph
+
+
+class LocalRoutingWrapper:
+    """
+    Computes routes from a local street graph instead of the Mapbox api, so
+    data can be generated offline. It can be used in place of a
+    MapboxAPIWrapper, for instance when constructing a DataGenerator.
+
+    Origins and destinations are snapped to the closest node of the graph
+    for the mode of travel. The distance from a location to its node is not
+    part of the route, as with the Mapbox api.
+    """
+
+    # Matrix requests have no coordinate limit, this only sets the number of
+    # locations grouped together by DataGenerator
+    MATRIX_COORDINATE_LIMIT = 100
+
+    def __init__(self, graph=None, max_snap_distance=500):
+        """
+        Args:
+            graph (StreetGraph): graph to route on. May also be loaded later
+                with load_graph_from_file.
+            max_snap_distance (float): a location further than this many
+                meters from the closest node of the graph can't be routed.
+        """
+        self.graph = graph
+        self.max_snap_distance = max_snap_distance
+        self.metric = HaversineMetric()
+        self.node_indexes = {}
+        self.snapped = {}
+        self.reverse_edges = {}
+
+    def load_graph_from_file(self, filename='map.osm'):
+        """
+        Loads the graph from an OpenStreetMap XML file.
+        """
+        self.graph = StreetGraph.from_osm_file(filename)
+        self.node_indexes = {}
+        self.snapped = {}
+        self.reverse_edges = {}
+
+    def get_distance_from_api(self, origin, destination, mode='walking'):
+        """
+        Returns:
+            the fastest {"distance": ..., "time": ...} route from origin to
+            destination, in meters and seconds.
+        Raises:
+            LocalRoutingError: if there is no route.
+        """
+        source = self.snap(origin, mode)
+        target = self.snap(destination, mode, remember=True)
+        result = self.graph.shortest_path(source, target, mode)
+        if result is None:
+            raise LocalRoutingError('No route found from {} to {}'.format(
+                origin, destination))
+        return {"distance": result[0], "time": result[1]}
+
+    def get_distance_matrix(self, origins, destinations, mode='walking'):
+        """
+        Returns routes from every origin to every destination, in the same
+        format as MapboxAPIWrapper.get_distance_matrix.
+        """
+        targets = [self.snap(destination, mode, remember=True)
+                   for destination in destinations]
+        matrix = []
+        for origin in origins:
+            reached = self.graph.shortest_paths([(self.snap(origin, mode),
+                                                  None)],
+                                                mode, targets=set(targets))
+            matrix.append([None if target not in reached else
+                           {"distance": reached[target][0],
+                            "time": reached[target][1]}
+                           for target in targets])
+        return matrix
+
+    def get_closest_stop_routes(self, addresses, stops, mode='walking'):
+        """
+        Finds the route to the closest stop by network distance for every
+        address at once. A single search is run over the reversed graph,
+        starting from all stops together, so the cost doesn't depend on the
+        number of addresses or stops.
+
+        Args:
+            addresses: iterable of MapLocations to route from.
+            stops (list): MapLocations of the stops.
+            mode (str): 'walking' (default), 'driving', or 'cycling'.
+        Yields:
+            (address, stop, {"distance": ..., "time": ...}) for each address,
+            in the order of addresses. stop and the route are None if no stop
+            can be reached from the address.
+        """
+        if self.graph is None:
+            raise UnboundLocalError('graph has not been loaded')
+        seeds = []
+        for i, stop in enumerate(stops):
+            try:
+                seeds.append((self.snap(stop, mode, remember=True), i))
+            except LocalRoutingError:
+                continue
+        if mode not in self.reverse_edges:
+            self.reverse_edges[mode] = self.graph.reverse_edges(mode)
+        reached = self.graph.shortest_paths(seeds, mode,
+                                            edges=self.reverse_edges[mode])
+        for address in addresses:
+            try:
+                node = self.snap(address, mode)
+            except LocalRoutingError:
+                node = None
+            if node not in reached:
+                yield address, None, None
+                continue
+            distance, time, i = reached[node]
+            yield address, stops[i], {"distance": distance, "time": time}
+
+    def snap(self, location, mode, remember=False):
+        """
+        Returns the index of the graph node closest to a location.
+
+        Args:
+            location (MapLocation): the location to snap.
+            mode (str): 'walking', 'cycling', or 'driving'.
+            remember (bool): if True, the node is kept for later calls. This
+                is used for stops, which are routed to many times.
+        Raises:
+            LocalRoutingError: if there is no node within max_snap_distance.
+        """
+        if self.graph is None:
+            raise UnboundLocalError('graph has not been loaded')
+        key = (location.latitude, location.longitude, mode)
+        if key in self.snapped:
+            return self.snapped[key]
+        if mode not in self.node_indexes:
+            self.node_indexes[mode] = self.graph.node_index(mode)
+        nearest = self.node_indexes[mode].nearest(location)
+        if not nearest or self.metric.distance(
+                location.latitude, location.longitude,
+                nearest[0].latitude, nearest[0].longitude) > \
+                self.max_snap_distance:
+            raise LocalRoutingError('No {} route near {}'.format(mode,
+                                                                 location))
+        if remember:
+            self.snapped[key] = nearest[0].id
+        return nearest[0].id
+
+
+class LocalRoutingError(requests.exceptions.RequestException):
+    pass
@@ -1,10 +1,48 @@
 import requests
 import os
+import random
+import time
+from requests.adapters import HTTPAdapter
+from DataGeneration.RateLimiter import RateLimiter
 
 
 class MapboxAPIWrapper:
-    def __init__(self):
+    # Maximum number of coordinates in one matrix request
+    MATRIX_COORDINATE_LIMIT = 25
+
+    def __init__(self, pool_size=10, timeout=(5, 30), session=None,
+                 requests_per_minute=None, max_backoff=60, cache=None,
+                 base_url='https://api.mapbox.com'):
+        """
+        Args:
+            pool_size (int): Number of connections kept alive for reuse. This
+                should be at least the number of threads sharing the wrapper.
+            timeout: Seconds to wait for the server, either a single value or
+                a (connect, read) tuple.
+            session (requests.Session): Session used for all requests.
+                Defaults to a new session with a connection pool of pool_size.
+            requests_per_minute (float): If set, requests are spaced out to
+                stay under this rate across all threads using the wrapper.
+            max_backoff (float): Longest wait in seconds between retries when
+                the server responds that requests are being rate limited.
+            cache (RouteCache): If set, routes are looked up in this cache
+                before querying the api, and new routes are stored in it.
+            base_url (str): Scheme and host that requests are sent to, such
+                as a local server for testing.
+        """
         self.key = ""
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.max_backoff = max_backoff
+        self.cache = cache
+        if requests_per_minute is None:
+            self.rate_limiter = None
+        else:
+            self.rate_limiter = RateLimiter(requests_per_minute)
+        if session is None:
+            self.session = self._create_session(pool_size)
+        else:
+            self.session = session
 
     def load_api_key_from_file(self, filename='api_key.txt'):
         if not os.path.exists(filename):
@@ -13,15 +51,43 @@ class MapboxAPIWrapper:
             self.key = key_file.read()
 
     def get_distance_from_api(self, origin, destination, mode='walking'):
+        if self.cache is not None:
+            result = self.cache.get(origin, destination, mode)
+            if result is not None:
+                return result
         request_string = self._construct_request_string(origin,
                                                         destination,
                                                         mode)
-        return self._parse_response(self._call_api(request_string))
+        result = self._parse_response(self._call_api(request_string))
+        if self.cache is not None:
+            self.cache.put(origin, destination, mode, result)
+        return result
+
+    def get_distance_matrix(self, origins, destinations, mode='walking'):
+        """
+        Fetches distances and times from every origin to every destination in
+        a single matrix request.
+
+        Args:
+            origins (list): MapLocations to route from.
+            destinations (list): MapLocations to route to. Together with
+                origins there may be at most MATRIX_COORDINATE_LIMIT
+                locations.
+            mode (str): 'walking' (default), 'driving', or 'cycling'.
+        Returns:
+            A list with one row per origin, each holding one
+            {"distance": ..., "time": ...} dict per destination, or None where
+            no route was found.
+        """
+        request_string = self._construct_matrix_request_string(origins,
+                                                               destinations,
+                                                               mode)
+        return self._parse_matrix_response(self._call_api(request_string))
 
     def _construct_request_string(self, origin, destination, mode='walking'):
         if self.key == "":
             raise UnboundLocalError('key has not been specified')
-        request_string = 'https://api.mapbox.com/v4/directions/mapbox.'
+        request_string = self.base_url + '/v4/directions/mapbox.'
         request_string += mode + '/'
         request_string += str(origin.longitude) + ','
         request_string += str(origin.latitude) + ';'
@@ -32,27 +98,102 @@ class MapboxAPIWrapper:
         request_string += self.key
         return request_string
 
-    def _call_api(self, request_url, retries=3):
+    def _construct_matrix_request_string(self, origins, destinations,
+                                         mode='walking'):
+        if self.key == "":
+            raise UnboundLocalError('key has not been specified')
+        locations = list(origins) + list(destinations)
+        if len(locations) > self.MATRIX_COORDINATE_LIMIT:
+            raise ValueError('a matrix request can have at most {} '
+                             'coordinates, got {}'.
+                             format(self.MATRIX_COORDINATE_LIMIT,
+                                    len(locations)))
+        request_string = self.base_url + '/directions-matrix/v1/mapbox/'
+        request_string += mode + '/'
+        request_string += ';'.join(str(location.longitude) + ',' +
+                                   str(location.latitude)
+                                   for location in locations)
+        request_string += '?sources='
+        request_string += ';'.join(str(i) for i in range(len(origins)))
+        request_string += '&destinations='
+        request_string += ';'.join(str(i) for i in
+                                   range(len(origins), len(locations)))
+        request_string += '&annotations=distance,duration&access_token='
+        request_string += self.key
+        return request_string
+
+    def _create_session(self, pool_size):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.headers.update({'Accept-Encoding': 'gzip, deflate',
+                                'Connection': 'keep-alive'})
+        return session
+
+    def _call_api(self, request_url, retries=3, rate_limit_retries=8):
+        attempt = 0
         while retries > 0:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
             try:
-                response = requests.get(url=request_url)
+                response = self.session.get(url=request_url,
+                                            timeout=self.timeout)
                 try:
                     response.raise_for_status()
                     return response.json()
                 except requests.exceptions.HTTPError as e:
-                    self._handle_http_error(e)
+                    if response.status_code != 429 or \
+                            attempt >= rate_limit_retries:
+                        self._handle_http_error(e)
+                    self._wait_for_rate_limit(response, attempt)
+                    attempt += 1
             except (requests.exceptions.ConnectionError,
                     requests.exceptions.Timeout) as e:
                 retries -= 1
                 if not retries:
                     self._handle_connection_error(e)
 
+    def _wait_for_rate_limit(self, response, attempt):
+        """
+        Waits after a 429 response for as long as the Retry-After or
+        X-Rate-Limit-Reset header asks, or otherwise for an exponentially
+        growing, jittered delay.
+        """
+        delay = None
+        retry_after = response.headers.get('Retry-After')
+        reset = response.headers.get('X-Rate-Limit-Reset')
+        try:
+            if retry_after is not None:
+                delay = float(retry_after)
+            elif reset is not None:
+                delay = float(reset) - time.time()
+        except ValueError:
+            delay = None
+        if delay is None or delay < 0:
+            delay = random.uniform(0, 2 ** attempt)
+        delay = min(delay, self.max_backoff)
+        if self.rate_limiter is not None:
+            self.rate_limiter.pause(delay)
+        else:
+            time.sleep(delay)
+
     def _parse_response(self, response_json):
         walking_distance = response_json['routes'][0]['distance']
         walking_duration = response_json['routes'][0]['duration']
         return {"distance": walking_distance,
                 "time": walking_duration}
 
+    def _parse_matrix_response(self, response_json):
+        matrix = []
+        for distances, durations in zip(response_json['distances'],
+                                        response_json['durations']):
+            matrix.append([None if distance is None or duration is None
+                           else {"distance": distance, "time": duration}
+                           for distance, duration in zip(distances,
+                                                         durations)])
+        return matrix
+
     def _handle_http_error(self, e):
         raise MapboxAPIError("HTTP Error: {}".format(e.message))
 
@@ -0,0 +1,60 @@
+import threading
+import time
+
+
+class RateLimiter:
+    """
+    A thread-safe token bucket. Tokens are added at a steady rate of
+    requests_per_minute and each request takes one token, blocking until a
+    token is available. Up to burst tokens can accumulate while idle.
+    """
+
+    def __init__(self, requests_per_minute, burst=1):
+        """
+        Args:
+            requests_per_minute (float): sustained request rate.
+            burst (int): maximum number of requests that can be made at once
+                after the limiter has been idle.
+        """
+        if requests_per_minute <= 0:
+            raise ValueError('requests_per_minute must be positive')
+        self.rate = requests_per_minute / 60.0
+        self.capacity = float(max(burst, 1))
+        self.tokens = self.capacity
+        self.updated = time.time()
+        self.paused_until = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Blocks until a request may be made.
+        """
+        while True:
+            with self.lock:
+                now = time.time()
+                self._refill(now)
+                wait = max(self.paused_until - now, 0)
+                if wait == 0 and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                if wait == 0:
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """
+        Blocks all requests for the next seconds, for instance after the
+        server has asked clients to back off. The bucket is emptied so that
+        requests resume at the sustained rate.
+        """
+        with self.lock:
+            now = time.time()
+            self.paused_until = max(self.paused_until, now + seconds)
+            self.tokens = 0
+            self.updated = max(self.updated, self.paused_until)
+
+    def _refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.capacity,
+                              self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
@@ -0,0 +1,142 @@
+import sqlite3 as sql
+import threading
+import time
+
+
+class RouteCache:
+    """
+    An on-disk cache of routes stored in an sqlite3 database. Routes are keyed
+    on origin and destination coordinates rounded to a number of decimal
+    places, plus the mode of travel, so nearby points share cached routes.
+    Entries older than ttl seconds are ignored, and the least recently used
+    entries are evicted once the cache holds more than max_entries routes.
+    """
+
+    def __init__(self, db_file_name='route_cache.sqlite3', precision=5,
+                 ttl=None, max_entries=None):
+        """
+        Args:
+            db_file_name (str): file path to the cache database.
+            precision (int): number of decimal places coordinates are rounded
+                to. 5 decimal places is about one meter.
+            ttl (float): seconds a cached route stays valid. If None
+                (default), routes never expire.
+            max_entries (int): maximum number of cached routes. If None
+                (default), the cache is unbounded.
+        """
+        self.precision = precision
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.conn = sql.connect(db_file_name, check_same_thread=False)
+        self._add_cache_table()
+        c = self.conn.cursor()
+        c.execute("SELECT COUNT(*) FROM route_cache")
+        self.size = c.fetchone()[0]
+        c.close()
+
+    def _add_cache_table(self):
+        c = self.conn.cursor()
+        c.execute("""
+                  CREATE TABLE IF NOT EXISTS route_cache
+                  (origin_latitude INTEGER NOT NULL,
+                  origin_longitude INTEGER NOT NULL,
+                  destination_latitude INTEGER NOT NULL,
+                  destination_longitude INTEGER NOT NULL,
+                  mode text NOT NULL,
+                  distance real NOT NULL,
+                  time real NOT NULL,
+                  created real NOT NULL,
+                  last_used real NOT NULL,
+                  PRIMARY KEY (origin_latitude, origin_longitude,
+                  destination_latitude, destination_longitude, mode))
+                  """)
+        c.execute("CREATE INDEX IF NOT EXISTS route_cache_last_used "
+                  "ON route_cache (last_used)")
+        self.conn.commit()
+        c.close()
+
+    def get(self, origin, destination, mode='walking'):
+        """
+        Returns:
+            the cached {"distance": ..., "time": ...} route from origin to
+            destination, or None if there is no valid cached route.
+        """
+        key = self._key(origin, destination, mode)
+        now = time.time()
+        with self.lock:
+            c = self.conn.cursor()
+            c.execute("SELECT distance, time, created FROM route_cache "
+                      "WHERE origin_latitude = ? AND origin_longitude = ? "
+                      "AND destination_latitude = ? "
+                      "AND destination_longitude = ? AND mode = ?", key)
+            row = c.fetchone()
+            if row is None or (self.ttl is not None and
+                               now - row[2] > self.ttl):
+                self.misses += 1
+                c.close()
+                return None
+            c.execute("UPDATE route_cache SET last_used = ? "
+                      "WHERE origin_latitude = ? AND origin_longitude = ? "
+                      "AND destination_latitude = ? "
+                      "AND destination_longitude = ? AND mode = ?",
+                      (now,) + key)
+            self.conn.commit()
+            c.close()
+            self.hits += 1
+        return {"distance": row[0], "time": row[1]}
+
+    def put(self, origin, destination, mode, result):
+        """
+        Stores a {"distance": ..., "time": ...} route in the cache.
+        """
+        key = self._key(origin, destination, mode)
+        now = time.time()
+        with self.lock:
+            c = self.conn.cursor()
+            c.execute("UPDATE route_cache "
+                      "SET distance = ?, time = ?, created = ?, last_used = ? "
+                      "WHERE origin_latitude = ? AND origin_longitude = ? "
+                      "AND destination_latitude = ? "
+                      "AND destination_longitude = ? AND mode = ?",
+                      (result["distance"], result["time"], now, now) + key)
+            if c.rowcount == 0:
+                c.execute("INSERT INTO route_cache "
+                          "(origin_latitude, origin_longitude, "
+                          "destination_latitude, destination_longitude, mode, "
+                          "distance, time, created, last_used) "
+                          "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                          key + (result["distance"], result["time"], now, now))
+                self.size += 1
+            if self.max_entries is not None and self.size > self.max_entries:
+                c.execute("DELETE FROM route_cache WHERE rowid IN "
+                          "(SELECT rowid FROM route_cache "
+                          "ORDER BY last_used LIMIT ?)",
+                          (self.size - self.max_entries,))
+                self.size -= c.rowcount
+            self.conn.commit()
+            c.close()
+
+    def clear_expired(self):
+        """
+        Deletes routes older than the cache's ttl.
+        """
+        if self.ttl is None:
+            return
+        with self.lock:
+            c = self.conn.cursor()
+            c.execute("DELETE FROM route_cache WHERE created < ?",
+                      (time.time() - self.ttl,))
+            self.size -= c.rowcount
+            self.conn.commit()
+            c.close()
+
+    def _key(self, origin, destination, mode):
+        scale = 10 ** self.precision
+        return (int(round(origin.latitude * scale)),
+                int(round(origin.longitude * scale)),
+                int(round(destination.latitude * scale)),
+                int(round(destination.longitude * scale)),
+                mode)
@@ -0,0 +1,65 @@
+import time
+
+
+class RouteWriter:
+    """
+    Buffers routes in memory and writes them to the database in batches with
+    DatabaseHandler.add_routes. The buffer is flushed once it holds
+    flush_rows routes, or when a route is added more than flush_seconds after
+    the last flush. Routes still buffered when the writer is closed are
+    flushed then.
+
+    The writer has no background thread, so it must be used from the thread
+    that owns the handler's connection.
+    """
+
+    def __init__(self, handler, flush_rows=500, flush_seconds=5.0):
+        """
+        Args:
+            handler (DatabaseHandler): handler used to write routes.
+            flush_rows (int): number of buffered routes that triggers a write.
+            flush_seconds (float): age of the last write that triggers a
+                write when another route is added.
+        """
+        self.handler = handler
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self.buffer = []
+        self.callbacks = []
+        self.last_flush = time.time()
+
+    def add_route(self, address, stop, distance, time):
+        self.buffer.append((address, stop, distance, time))
+        if len(self.buffer) >= self.flush_rows or self._flush_due():
+            self.flush()
+
+    def on_flush(self, callback):
+        """
+        Calls callback once every route added so far has been written, which
+        is immediately if nothing is buffered.
+        """
+        if self.buffer:
+            self.callbacks.append(callback)
+        else:
+            callback()
+
+    def flush(self):
+        if self.buffer:
+            self.handler.add_routes(self.buffer)
+            self.buffer = []
+        self.last_flush = time.time()
+        callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def _flush_due(self):
+        return time.time() - self.last_flush >= self.flush_seconds
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,137 @@
+import multiprocessing
+import os
+from DataGeneration.DatabaseHandler import DatabaseHandler
+from DataGeneration.MapboxAPIWrapper import MapboxAPIWrapper
+from DataGeneration.DataGenerator import DataGenerator
+from DataGeneration.RouteCache import RouteCache
+
+
+def _run_shard(task):
+    # Runs in a worker process, so the handler, wrapper, and cache are created
+    # here rather than shared with the parent.
+    db_file_name, handler_options, api_key_file, generator_options, \
+        wrapper_options, cache_options, begin_options = task
+    handler = DatabaseHandler(db_file_name, **handler_options)
+    wrapper_options = dict(wrapper_options)
+    if cache_options is not None:
+        wrapper_options['cache'] = RouteCache(**cache_options)
+    wrapper = MapboxAPIWrapper(**wrapper_options)
+    wrapper.load_api_key_from_file(api_key_file)
+    generator = DataGenerator(handler=handler, wrapper=wrapper,
+                              **generator_options)
+    generator.begin(**begin_options)
+    handler.conn.close()
+    if wrapper.cache is not None:
+        wrapper.cache.conn.close()
+    return db_file_name
+
+
+class ShardedDataGenerator:
+    """
+    Runs several DataGenerators in separate processes, each on its own share
+    of the addresses.
+    """
+
+    def __init__(self, db_file_name='db.sqlite3', api_key_file='api_key.txt',
+                 processes=4, generator_options=None, wrapper_options=None,
+                 cache_options=None, db_timeout=60):
+        """
+        Args:
+            db_file_name (str): File path to the sqlite3 database.
+            api_key_file (str): File path to a text file containing an API
+                key.
+            processes (int): Number of generator processes.
+            generator_options (dict): Keyword arguments passed to each
+                DataGenerator, such as spatial_index or metric.
+            wrapper_options (dict): Keyword arguments passed to each
+                MapboxAPIWrapper, such as pool_size or requests_per_minute.
+                requests_per_minute is the rate for all processes together,
+                so each process is given an equal share of it.
+            cache_options (dict): If set, each process opens a RouteCache
+                with these keyword arguments, such as db_file_name.
+            db_timeout (float): Seconds a process waits for another
+                process's lock on the shared database before failing.
+        """
+        self.db_file_name = db_file_name
+        self.api_key_file = api_key_file
+        self.processes = processes
+        self.generator_options = generator_options or {}
+        self.wrapper_options = wrapper_options or {}
+        self.cache_options = cache_options
+        self.db_timeout = db_timeout
+
+    def begin(self, per_shard_files=False, shard_dir='shards',
+              **begin_options):
+        """
+        Begins collection of routes in all processes and waits for them to
+        finish.
+
+        Args:
+            per_shard_files (bool): If False (default), every process works on
+                the shared database, claiming addresses from its work queue.
+                The database is switched to write-ahead logging so processes
+                can read while another writes. If True, the addresses are
+                split into contiguous id ranges, each range is copied to its
+                own database file in shard_dir, and the routes from every
+                shard file are merged into the main database once all
+                processes finish. Existing shard files are reused, so an
+                interrupted run can be resumed.
+            shard_dir (str): Directory for the shard database files.
+            **begin_options: Keyword arguments passed to each
+                DataGenerator.begin() call.
+        Returns:
+            the number of routes merged from shard files, or None if the
+            shared database was used.
+        """
+        handler = DatabaseHandler(self.db_file_name, timeout=self.db_timeout)
+        try:
+            if per_shard_files:
+                return self._begin_shard_files(handler, shard_dir,
+                                               begin_options)
+            handler.enable_performance_profile()
+            handler.populate_address_queue()
+            handler_options = {'performance': True,
+                               'timeout': self.db_timeout}
+            tasks = []
+            for i in range(self.processes):
+                options = dict(begin_options, use_queue=True,
+                               worker_id='shard-{}'.format(i))
+                tasks.append(self._get_task(self.db_file_name,
+                                            handler_options, options))
+            self._map(_run_shard, tasks)
+            return None
+        finally:
+            handler.conn.close()
+
+    def _begin_shard_files(self, handler, shard_dir, begin_options):
+        if not os.path.exists(shard_dir):
+            os.makedirs(shard_dir)
+        tasks = []
+        for i, (min_id, max_id) in enumerate(
+                handler.get_id_ranges(self.processes)):
+            shard_file_name = os.path.join(shard_dir,
+                                           'shard-{}.sqlite3'.format(i))
+            if not os.path.exists(shard_file_name):
+                handler.export_shard(shard_file_name, min_id, max_id)
+            tasks.append(self._get_task(shard_file_name, {}, begin_options))
+        merged = 0
+        for shard_file_name in self._map(_run_shard, tasks):
+            merged += handler.merge_routes(shard_file_name)
+        return merged
+
+    def _get_task(self, db_file_name, handler_options, begin_options):
+        wrapper_options = dict(self.wrapper_options)
+        if wrapper_options.get('requests_per_minute') is not None:
+            wrapper_options['requests_per_minute'] = \
+                wrapper_options['requests_per_minute'] / float(self.processes)
+        return (db_file_name, handler_options, self.api_key_file,
+                self.generator_options, wrapper_options, self.cache_options,
+                begin_options)
+
+    def _map(self, function, tasks):
+        pool = multiprocessing.Pool(processes=len(tasks) or 1)
+        try:
+            return pool.map(function, tasks)
+        finally:
+            pool.close()
+            pool.join()
@@ -0,0 +1,80 @@
+import heapq
+from DataGeneration.DistanceMetric import get_metric
+
+
+class KDTreeStopIndex:
+    """
+    A k-d tree over stop coordinates that answers k-nearest queries in
+    logarithmic time. The tree is built once from a list of stops, such as the
+    output of DatabaseHandler.get_all_stops(), and can then be queried for
+    every address.
+    """
+
+    def __init__(self, stops, metric='euclidean'):
+        """
+        Args:
+            stops (list): the stops to index.
+            metric: distance metric used to rank stops, either a name from
+                DistanceMetric.METRICS or a metric instance.
+        """
+        self.stops = list(stops)
+        self.metric = get_metric(metric)
+        coordinates = self.metric.project(
+            [stop.latitude for stop in self.stops],
+            [stop.longitude for stop in self.stops])
+        points = [(tuple(point), i)
+                  for i, point in enumerate(coordinates.tolist())]
+        self.root = self._build(points, 0)
+
+    def nearest(self, location, n=1):
+        """
+        Finds the stops closest to a location by straight line distance.
+
+        Args:
+            location (MapLocation): the location to search from.
+            n (int): the number of stops to return.
+        Returns:
+            list of up to n stops, ordered from closest to furthest. Stops at
+            an equal distance are ordered by their position in the stops list.
+        """
+        if n <= 0 or self.root is None:
+            return []
+        target = self._project(location)
+        heap = []
+        self._search(self.root, target, n, heap)
+        return [self.stops[i] for _, i in
+                sorted((-neg_distance, -neg_i) for neg_distance, neg_i in heap)]
+
+    def _project(self, location):
+        return tuple(self.metric.project(location.latitude,
+                                         location.longitude).tolist())
+
+    def _build(self, points, depth):
+        if not points:
+            return None
+        axis = depth % len(points[0][0])
+        points.sort(key=lambda point: point[0][axis])
+        median = len(points) // 2
+        coordinates, i = points[median]
+        return (coordinates, i, axis,
+                self._build(points[:median], depth + 1),
+                self._build(points[median + 1:], depth + 1))
+
+    def _search(self, node, target, n, heap):
+        if node is None:
+            return
+        coordinates, i, axis, left, right = node
+        distance = sum((a - b) ** 2 for a, b in zip(coordinates, target))
+        # heap holds (-squared distance, -index) so the furthest candidate, or
+        # the latest stop among equally distant ones, is evicted first
+        entry = (-distance, -i)
+        if len(heap) < n:
+            heapq.heappush(heap, entry)
+        elif entry > heap[0]:
+            heapq.heapreplace(heap, entry)
+
+        offset = target[axis] - coordinates[axis]
+        near, far = (left, right) if offset < 0 else (right, left)
+        self._search(near, target, n, heap)
+        if len(heap) < n or offset ** 2 <= -heap[0][0]:
+            self._search(far, target, n, heap)
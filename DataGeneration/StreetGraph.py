@@ -0,0 +1,293 @@
+import bz2
+import heapq
+import math
+from DataGeneration.DistanceMetric import EARTH_RADIUS
+from DataGeneration.MapLocation import MapLocation
+from DataGeneration.StopIndex import KDTreeStopIndex
+
+try:
+    import xml.etree.cElementTree as ElementTree
+except ImportError:
+    import xml.etree.ElementTree as ElementTree
+
+# Speeds in km/h
+WALKING_SPEED = 5.0
+CYCLING_SPEED = 16.0
+DRIVING_SPEEDS = {
+    'motorway': 100, 'motorway_link': 60,
+    'trunk': 80, 'trunk_link': 50,
+    'primary': 65, 'primary_link': 45,
+    'secondary': 55, 'secondary_link': 40,
+    'tertiary': 45, 'tertiary_link': 35,
+    'unclassified': 40, 'road': 40, 'residential': 30,
+    'living_street': 10, 'service': 15
+}
+
+# Highway types that are never routed on
+CLOSED_HIGHWAYS = set(['construction', 'proposed', 'abandoned', 'platform',
+                       'raceway', 'bus_guideway', 'corridor', 'elevator'])
+# Highway types each mode may not use unless the way is tagged otherwise
+MODE_EXCLUDED_HIGHWAYS = {
+    'walking': set(['motorway', 'motorway_link']),
+    'cycling': set(['motorway', 'motorway_link', 'steps', 'footway',
+                    'pedestrian']),
+    'driving': None
+}
+# Tags that grant or deny access to each mode
+MODE_ACCESS_TAGS = {
+    'walking': ['foot'],
+    'cycling': ['bicycle'],
+    'driving': ['motorcar', 'motor_vehicle']
+}
+MODES = ('walking', 'cycling', 'driving')
+ALLOWED = set(['yes', 'designated', 'permissive', 'destination'])
+DENIED = set(['no', 'private'])
+
+
+class StreetGraph:
+    """
+    A street network for walking, cycling, and driving, imported from an
+    OpenStreetMap XML file. Every mode has its own directed graph that
+    follows the mode's access and oneway rules. Edges are weighted by travel
+    time, and routes report both length in meters and time in seconds.
+    """
+
+    def __init__(self):
+        self.latitudes = []
+        self.longitudes = []
+        self.edges = dict((mode, []) for mode in MODES)
+        self.max_speeds = dict((mode, 0.0) for mode in MODES)
+        self.node_indexes = {}
+
+    @classmethod
+    def from_osm_file(cls, osm_file):
+        """
+        Imports the ways tagged as highways from an OpenStreetMap XML file.
+        The file is read incrementally, so only the coordinates of nodes and
+        the resulting graph are held in memory.
+
+        Args:
+            osm_file: file path to a .osm or .osm.bz2 file, or a file object.
+        Returns:
+            StreetGraph
+        """
+        if not hasattr(osm_file, 'read') and osm_file.endswith('.bz2'):
+            osm_file = bz2.BZ2File(osm_file)
+        graph = cls()
+        coordinates = {}
+        for _, element in ElementTree.iterparse(osm_file):
+            if element.tag == 'node':
+                coordinates[element.get('id')] = (float(element.get('lat')),
+                                                  float(element.get('lon')))
+            elif element.tag == 'way':
+                tags = dict((tag.get('k'), tag.get('v'))
+                            for tag in element.iter('tag'))
+                refs = [nd.get('ref') for nd in element.iter('nd')]
+                if 'highway' in tags:
+                    graph._add_way(refs, tags, coordinates)
+            if element.tag in ('node', 'way', 'relation'):
+                element.clear()
+        return graph
+
+    def _add_way(self, refs, tags, coordinates):
+        refs = [ref for ref in refs if ref in coordinates]
+        access = [(mode, _get_way_access(tags, mode)) for mode in MODES]
+        access = [(mode, rules) for mode, rules in access if rules is not None]
+        if not access or len(refs) < 2:
+            return
+        nodes = [self._add_node(ref, coordinates[ref]) for ref in refs]
+        for a, b in zip(nodes[:-1], nodes[1:]):
+            distance = self.distance(a, b)
+            for mode, (forward, backward, speed) in access:
+                edges = self.edges[mode]
+                if forward:
+                    edges[a].append((b, distance, distance / speed))
+                if backward:
+                    edges[b].append((a, distance, distance / speed))
+                self.max_speeds[mode] = max(self.max_speeds[mode], speed)
+
+    def _add_node(self, ref, coordinates):
+        if ref not in self.node_indexes:
+            self.node_indexes[ref] = len(self.latitudes)
+            self.latitudes.append(coordinates[0])
+            self.longitudes.append(coordinates[1])
+            for mode in MODES:
+                self.edges[mode].append([])
+        return self.node_indexes[ref]
+
+    def distance(self, a, b):
+        """
+        Returns the great-circle distance in meters between two nodes.
+        """
+        return _haversine(self.latitudes[a], self.longitudes[a],
+                          self.latitudes[b], self.longitudes[b])
+
+    def reverse_edges(self, mode):
+        """
+        Returns the edges of a mode's graph with their directions reversed,
+        as one list of (node, distance, time) tuples per node.
+        """
+        reverse = [[] for _ in self.latitudes]
+        for a, edges in enumerate(self.edges[mode]):
+            for b, distance, time in edges:
+                reverse[b].append((a, distance, time))
+        return reverse
+
+    def nodes_for_mode(self, mode):
+        """
+        Returns the indexes of the nodes that have an edge in a mode's graph.
+        """
+        connected = set()
+        for a, edges in enumerate(self.edges[mode]):
+            if edges:
+                connected.add(a)
+                connected.update(b for b, _, _ in edges)
+        return sorted(connected)
+
+    def node_index(self, mode):
+        """
+        Returns a KDTreeStopIndex over a mode's nodes, in which each node is a
+        MapLocation whose id is its index in the graph.
+        """
+        return KDTreeStopIndex([MapLocation(self.latitudes[i],
+                                            self.longitudes[i], i)
+                                for i in self.nodes_for_mode(mode)],
+                               metric='haversine')
+
+    def shortest_path(self, source, target, mode):
+        """
+        Finds the fastest route between two nodes with A* search, using the
+        straight line distance at the mode's top speed as the heuristic.
+
+        Returns:
+            (distance, time) of the route in meters and seconds, or None if
+            target can't be reached from source.
+        """
+        edges = self.edges[mode]
+        max_speed = self.max_speeds[mode] or 1.0
+
+        def heuristic(node):
+            return self.distance(node, target) / max_speed
+
+        times = {source: 0.0}
+        distances = {source: 0.0}
+        heap = [(heuristic(source), 0.0, source)]
+        settled = set()
+        while heap:
+            _, time, node = heapq.heappop(heap)
+            if node == target:
+                return distances[node], time
+            if node in settled:
+                continue
+            settled.add(node)
+            for neighbor, distance, edge_time in edges[node]:
+                new_time = time + edge_time
+                if new_time < times.get(neighbor, float('inf')):
+                    times[neighbor] = new_time
+                    distances[neighbor] = distances[node] + distance
+                    heapq.heappush(heap, (new_time + heuristic(neighbor),
+                                          new_time, neighbor))
+        return None
+
+    def shortest_paths(self, sources, mode, targets=None, edges=None):
+        """
+        Runs Dijkstra's algorithm from one or more sources at once. Each node
+        is reached from whichever source is fastest.
+
+        Args:
+            sources (list): (node, source id) pairs to search from.
+            mode (str): 'walking', 'cycling', or 'driving'.
+            targets (set): if given, the search stops once every target node
+                has been reached.
+            edges (list): edges to search instead of the mode's graph, such as
+                the output of reverse_edges.
+        Returns:
+            dict of node -> (distance, time, source id) for each node reached.
+        """
+        if edges is None:
+            edges = self.edges[mode]
+        remaining = None if targets is None else set(targets)
+        heap = [(0.0, 0.0, node, source_id) for node, source_id in sources]
+        heapq.heapify(heap)
+        settled = {}
+        while heap:
+            time, distance, node, source_id = heapq.heappop(heap)
+            if node in settled:
+                continue
+            settled[node] = (distance, time, source_id)
+            if remaining is not None:
+                remaining.discard(node)
+                if not remaining:
+                    break
+            for neighbor, edge_distance, edge_time in edges[node]:
+                if neighbor not in settled:
+                    heapq.heappush(heap, (time + edge_time,
+                                          distance + edge_distance,
+                                          neighbor, source_id))
+        return settled
+
+
+def _get_way_access(tags, mode):
+    # Returns (forward, backward, speed in m/s) for a way, or None if the mode
+    # may not use it
+    highway = tags['highway']
+    if highway in CLOSED_HIGHWAYS or tags.get('area') == 'yes':
+        return None
+    mode_access = None
+    for key in MODE_ACCESS_TAGS[mode]:
+        if key in tags:
+            mode_access = tags[key]
+            break
+    if mode_access in DENIED:
+        return None
+    if mode_access not in ALLOWED:
+        if tags.get('access') in DENIED:
+            return None
+        excluded = MODE_EXCLUDED_HIGHWAYS[mode]
+        if excluded is None:
+            if highway not in DRIVING_SPEEDS:
+                return None
+        elif highway in excluded:
+            return None
+
+    if mode == 'walking':
+        return True, True, WALKING_SPEED / 3.6
+    oneway = tags.get('oneway')
+    if oneway is None and (tags.get('junction') == 'roundabout' or
+                           highway == 'motorway'):
+        oneway = 'yes'
+    if mode == 'cycling':
+        if tags.get('oneway:bicycle') == 'no' or \
+                tags.get('cycleway', '').startswith('opposite'):
+            oneway = 'no'
+        speed = CYCLING_SPEED
+    else:
+        speed = _parse_speed(tags.get('maxspeed')) or \
+            DRIVING_SPEEDS.get(highway, DRIVING_SPEEDS['unclassified'])
+    if oneway in ('yes', 'true', '1'):
+        return True, False, speed / 3.6
+    if oneway == '-1':
+        return False, True, speed / 3.6
+    return True, True, speed / 3.6
+
+
+def _parse_speed(maxspeed):
+    # Returns a maxspeed tag in km/h, or None if it isn't a number
+    if not maxspeed:
+        return None
+    value = maxspeed.split()[0]
+    try:
+        speed = float(value)
+    except ValueError:
+        return None
+    if 'mph' in maxspeed:
+        speed *= 1.609344
+    return speed if speed > 0 else None
+
+
+def _haversine(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = [math.radians(value)
+                              for value in (lat1, lng1, lat2, lng2)]
+    a = math.sin((lat2 - lat1) / 2) ** 2 + \
+        math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(min(a, 1.0)))
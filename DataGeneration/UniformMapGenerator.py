@@ -1,4 +1,5 @@
 import pandas as pd    # For the dataframe
+import numpy as np     # For vectorized coordinates
 import math            # For math
 
 
@@ -35,15 +36,38 @@ class UniformMapGenerator:
             pandas.DataFrame with two columns: latitude, longitude
         """
 
+        latitudes = self.get_coordinates(lat_min, lat_max, lat_res)
+        longitudes = self.get_coordinates(lng_min, lng_max, lng_res)
+
+        if debug:
+            print('Latitude Quantity: ' + str(len(latitudes)))
+            print('Longitude Quantity: ' + str(len(longitudes)))
+            print('Total Output Rows: ' + str(len(latitudes) *
+                                              len(longitudes)))
+
+        # Every latitude paired with every longitude, with longitude varying
+        # fastest
+        lat_grid, lng_grid = np.meshgrid(latitudes, longitudes, indexing='ij')
+        return pd.DataFrame({'latitude': lat_grid.ravel(),
+                             'longitude': lng_grid.ravel()},
+                            columns=['latitude', 'longitude'])
+
+    def get_uniform_coordinate_map_reference(self,
+                                             lat_min,
+                                             lat_max,
+                                             lng_min,
+                                             lng_max,
+                                             lat_res,
+                                             lng_res):
+        """
+        Element by element implementation of get_uniform_coordinate_map,
+        kept as a reference for testing. It is much slower, and accumulates
+        floating point error along each axis.
+        """
         latitude_num = self.get_number_of_intervals(lat_min, lat_max, lat_res)
         longitude_num = self.get_number_of_intervals(lng_min, lng_max, lng_res)
         total_coordinate_rows = latitude_num * longitude_num
 
-        if debug:
-            print('Latitude Quantity: ' + str(latitude_num))
-            print('Longitude Quantity: ' + str(longitude_num))
-            print('Total Output Rows: ' + str(total_coordinate_rows))
-
         output_df = self.instantiate_output_dataframe(total_coordinate_rows)
 
         # Iterate through our latitudes and longitudes, adding all pairs
@@ -56,11 +80,92 @@ class UniformMapGenerator:
                 row_num += 1
         return output_df
 
+    def get_uniform_coordinate_blocks(self,
+                                      lat_min,
+                                      lat_max,
+                                      lng_min,
+                                      lng_max,
+                                      lat_res,
+                                      lng_res,
+                                      block_size=100000):
+        """
+        Yields the same points as get_uniform_coordinate_map, in the same
+        order, as numpy arrays of at most block_size rows. Each row is a
+        latitude, longitude pair. Only one block is held in memory at a time.
+
+        Args:
+            lat_min, lat_max, lng_min, lng_max, lat_res, lng_res: as in
+                get_uniform_coordinate_map.
+            block_size (int): maximum number of points per block.
+        """
+        latitudes = self.get_coordinates(lat_min, lat_max, lat_res)
+        longitudes = self.get_coordinates(lng_min, lng_max, lng_res)
+        total = len(latitudes) * len(longitudes)
+        for start in range(0, total, block_size):
+            index = np.arange(start, min(start + block_size, total))
+            yield np.column_stack((latitudes[index // len(longitudes)],
+                                   longitudes[index % len(longitudes)]))
+
+    def add_uniform_map_to_database(self,
+                                    handler,
+                                    lat_min,
+                                    lat_max,
+                                    lng_min,
+                                    lng_max,
+                                    lat_res,
+                                    lng_res,
+                                    block_size=100000,
+                                    mask=None,
+                                    debug=False):
+        """
+        Adds each point of a uniform grid to the addresses table of a
+        database, one block of points per transaction.
+
+        Args:
+            handler (DatabaseHandler): handler for the database.
+            lat_min, lat_max, lng_min, lng_max, lat_res, lng_res: as in
+                get_uniform_coordinate_map.
+            block_size (int): number of points inserted per transaction.
+            mask (GridMask): if given, only points that pass the mask are
+                added.
+            debug (boolean): if true, debug text is output to the console
+        Returns:
+            the number of points added.
+        """
+        count = 0
+        for block in self.get_uniform_coordinate_blocks(lat_min, lat_max,
+                                                        lng_min, lng_max,
+                                                        lat_res, lng_res,
+                                                        block_size):
+            if mask is not None:
+                block = mask.filter(block)
+            handler.add_addresses(block.tolist())
+            count += len(block)
+            if debug:
+                print('Added Rows: ' + str(count))
+        return count
+
+    def get_coordinates(self, minimum, maximum, resolution):
+        """
+        Returns the coordinates from minimum to maximum, resolution apart, as
+        a float64 numpy array. Each coordinate is computed from its index
+        rather than by repeated addition, so there is no accumulated error
+        and the last coordinate is exactly maximum when the range is a whole
+        number of steps.
+        """
+        number = self.get_number_of_intervals(minimum, maximum, resolution)
+        end = minimum + (number - 1) * resolution
+        if np.isclose(end, maximum):
+            end = maximum
+        return np.linspace(minimum, end, number)
+
     # Returns the number of intervals (int) between minimum and maximum that
     # include the minimum and maximum where each interval is 'resolution'
     # distance apart
     def get_number_of_intervals(self, minimum, maximum, resolution):
-        return int(math.ceil((maximum - minimum) / resolution + 1))
+        # Rounding keeps floating point error in the division, such as
+        # 1.1 / 0.1 == 11.000000000000002, from adding an extra interval
+        return int(math.ceil(round((maximum - minimum) / resolution, 9) + 1))
 
     def instantiate_output_dataframe(self, total_rows):
         return pd.DataFrame(columns=['latitude', 'longitude'],
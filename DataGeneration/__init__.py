@@ -3,11 +3,27 @@ from DatabaseHandler import DatabaseHandler
 from UniformMapGenerator import UniformMapGenerator
 from MapLocation import MapLocation
 from DataGenerator import DataGenerator
+from StopIndex import KDTreeStopIndex
+from RouteCache import RouteCache
+from ShardedDataGenerator import ShardedDataGenerator
+from GridMask import GridMask
+from AdaptiveSampler import AdaptiveSampler
+from StreetGraph import StreetGraph
+from LocalRoutingWrapper import LocalRoutingWrapper
+from IsochroneGenerator import IsochroneGenerator
 
 __all__ = [
     'MapboxAPIWrapper',
     'DatabaseHandler',
     'UniformMapGenerator',
     'MapLocation',
-    'DataGenerator'
+    'DataGenerator',
+    'KDTreeStopIndex',
+    'RouteCache',
+    'ShardedDataGenerator',
+    'GridMask',
+    'AdaptiveSampler',
+    'StreetGraph',
+    'LocalRoutingWrapper',
+    'IsochroneGenerator'
 ]
@@ -2,6 +2,23 @@
 # received which contains all addresses in the city to a .csv file
 import dbfread as dbf  #To read our .dbf file
 import csv             #To write to .csv
+import math            #For the state plane projection
+import numpy as np     #For vectorized parsing of records
+from DataGeneration.DatabaseHandler import _location_keys
+
+# Lambert conformal conic parameters of the NAD83 state plane zones, in
+# degrees and meters: (standard parallel 1, standard parallel 2, latitude of
+# origin, central meridian, false easting, false northing)
+STATE_PLANE_ZONES = {
+  'ohio_north': (41.7, 40.43333333333333, 39.66666666666666, -82.5,
+                 600000.0, 0.0),  # EPSG:3734 in US feet, EPSG:32122 in m
+  'ohio_south': (40.03333333333333, 38.73333333333333, 38.0, -82.5,
+                 600000.0, 0.0)   # EPSG:3735 in US feet, EPSG:32123 in m
+}
+US_SURVEY_FOOT = 1200.0 / 3937.0
+# GRS 1980 ellipsoid
+SEMI_MAJOR_AXIS = 6378137.0
+FLATTENING = 1 / 298.257222101
 
 def convert_addresses_to_csv():
   with open('addresses.csv', 'wb') as csvfile:
@@ -11,4 +28,166 @@ def convert_addresses_to_csv():
         writer = csv.DictWriter(csvfile, fieldnames=rec.keys())
         writer.writeheader()
         headerexists = True
-      writer.writerow(rec)
\ No newline at end of file
+      writer.writerow(rec)
+
+def import_addresses_from_dbf(handler, file_name='LBRS_Site.dbf',
+                              x_field='LONGITUDE', y_field='LATITUDE',
+                              id_field=None, state_plane=None,
+                              units='us_feet', batch_size=10000,
+                              precision=6):
+  """
+  Adds the addresses in a .dbf file straight to the addresses table. Records
+  are read in batches of raw bytes and only the coordinate and id fields are
+  parsed, so there is no intermediate .csv file.
+
+  Args:
+    handler (DatabaseHandler): handler for the database to add addresses to.
+    file_name (str): path to the .dbf file.
+    x_field (str): field holding the longitude, or the easting if
+      state_plane is set.
+    y_field (str): field holding the latitude, or the northing if
+      state_plane is set.
+    id_field (str): optional field used as the id of each address.
+      Addresses whose id is already in the database are skipped. Without
+      it, addresses at the same coordinates, rounded to precision decimal
+      places, as an existing address or an earlier record are skipped, as
+      with DatabaseHandler.add_addresses_from_file.
+    state_plane (str): if set, coordinates are converted from this zone of
+      STATE_PLANE_ZONES, such as 'ohio_north', to latitude and longitude.
+    units (str): units of state plane coordinates, 'us_feet' or 'meters'.
+    batch_size (int): number of records read and inserted at a time.
+    precision (int): decimal places coordinates are rounded to when looking
+      for duplicates without id_field.
+  Returns:
+    (added, skipped): the number of records added, and the number skipped
+    because they were deleted, had missing or invalid coordinates, or were
+    already in the database.
+  """
+  table = dbf.DBF(file_name, load=False)
+  names = [field.name for field in table.fields]
+  for name in [x_field, y_field] + ([id_field] if id_field else []):
+    if name not in names:
+      raise ValueError('{} has no field named {}'.format(file_name, name))
+  record_type = _get_record_dtype(table)
+  existing = None
+  if id_field is None:
+    existing = handler._get_location_keys('addresses', precision)
+  added = 0
+  skipped = 0
+  with open(file_name, 'rb') as dbf_file:
+    dbf_file.seek(table.header.headerlen)
+    remaining = table.header.numrecords
+    while remaining > 0:
+      count = min(batch_size, remaining)
+      data = dbf_file.read(count * table.header.recordlen)
+      count = len(data) // table.header.recordlen
+      if count == 0:
+        break
+      remaining -= count
+      records = np.frombuffer(data[:count * table.header.recordlen],
+                              dtype=record_type)
+      x = _parse_numbers(records[_field_key(names.index(x_field))])
+      y = _parse_numbers(records[_field_key(names.index(y_field))])
+      if state_plane is not None:
+        y, x = state_plane_to_wgs84(x, y, state_plane, units)
+      with np.errstate(invalid='ignore'):
+        valid = (records['deleted'] == b' ') & (np.abs(y) <= 90) & \
+          (np.abs(x) <= 180)
+      ids = None
+      if id_field is not None:
+        ids = _parse_numbers(records[_field_key(names.index(id_field))])
+        valid &= ~np.isnan(ids)
+        rows = np.flatnonzero(valid)
+        ids = ids[rows].astype(np.int64).tolist()
+      else:
+        keys = _location_keys(y[valid], x[valid], precision)
+        # first occurrence of each key that isn't in the table yet
+        keys, first = np.unique(keys, return_index=True)
+        new = ~np.isin(keys, existing, assume_unique=True)
+        rows = np.flatnonzero(valid)[np.sort(first[new])]
+        existing = np.union1d(existing, keys[new])
+      inserted = handler.add_addresses(
+        np.column_stack((y[rows], x[rows])).tolist(), ids=ids)
+      added += inserted
+      skipped += count - inserted
+  return added, skipped
+
+def state_plane_to_wgs84(x, y, zone='ohio_north', units='us_feet'):
+  """
+  Converts state plane coordinates to latitude and longitude with the
+  inverse Lambert conformal conic projection. NAD83 and WGS84 differ by
+  about a meter, which is ignored.
+
+  Args:
+    x: easting, or an array of eastings.
+    y: northing, or an array of northings.
+    zone (str): a zone of STATE_PLANE_ZONES.
+    units (str): 'us_feet' or 'meters'.
+  Returns:
+    (latitude, longitude) in degrees, as arrays.
+  """
+  if zone not in STATE_PLANE_ZONES:
+    raise ValueError('unknown state plane zone: {}'.format(zone))
+  if units not in ('us_feet', 'meters'):
+    raise ValueError('unknown units: {}'.format(units))
+  scale = US_SURVEY_FOOT if units == 'us_feet' else 1.0
+  parallel_1, parallel_2, origin_latitude, central_meridian, \
+    false_easting, false_northing = STATE_PLANE_ZONES[zone]
+  e = math.sqrt(2 * FLATTENING - FLATTENING ** 2)
+
+  def m(latitude):
+    latitude = math.radians(latitude)
+    return math.cos(latitude) / math.sqrt(1 - (e * math.sin(latitude)) ** 2)
+
+  def t(latitude):
+    latitude = math.radians(latitude)
+    return math.tan(math.pi / 4 - latitude / 2) / \
+      ((1 - e * math.sin(latitude)) / (1 + e * math.sin(latitude))) ** (e / 2)
+
+  n = (math.log(m(parallel_1)) - math.log(m(parallel_2))) / \
+    (math.log(t(parallel_1)) - math.log(t(parallel_2)))
+  f = m(parallel_1) / (n * t(parallel_1) ** n)
+  r_origin = SEMI_MAJOR_AXIS * f * t(origin_latitude) ** n
+
+  easting = np.asarray(x, dtype=np.float64) * scale - false_easting
+  northing = r_origin - (np.asarray(y, dtype=np.float64) * scale -
+                         false_northing)
+  r = np.sign(n) * np.hypot(easting, northing)
+  t_point = (r / (SEMI_MAJOR_AXIS * f)) ** (1 / n)
+  theta = np.arctan2(easting, northing)
+  latitude = np.pi / 2 - 2 * np.arctan(t_point)
+  for _ in range(8):
+    sin_latitude = np.sin(latitude)
+    latitude = np.pi / 2 - 2 * np.arctan(
+      t_point * ((1 - e * sin_latitude) / (1 + e * sin_latitude)) ** (e / 2))
+  longitude = theta / n + math.radians(central_meridian)
+  return np.degrees(latitude), np.degrees(longitude)
+
+def _field_key(index):
+  # Fields are named by position, since names in old files may repeat
+  return 'f{}'.format(index)
+
+def _get_record_dtype(table):
+  # Each record is a deletion flag followed by fixed-width fields
+  fields = [('deleted', 'S1')]
+  for i, field in enumerate(table.fields):
+    fields.append((_field_key(i), 'S{}'.format(field.length)))
+  length = 1 + sum(field.length for field in table.fields)
+  if length < table.header.recordlen:
+    fields.append(('padding', 'S{}'.format(table.header.recordlen - length)))
+  return np.dtype(fields)
+
+def _parse_numbers(values):
+  values = np.char.strip(values)
+  values = np.where(values == b'', b'nan', values)
+  try:
+    return values.astype(np.float64)
+  except ValueError:
+    # Fall back to parsing one value at a time when a field holds text
+    return np.array([_parse_number(value) for value in values])
+
+def _parse_number(value):
+  try:
+    return float(value)
+  except ValueError:
+    return float('nan')
@@ -0,0 +1,103 @@
+import unittest
+import requests
+from mock import Mock
+from DataGeneration.AdaptiveSampler import AdaptiveSampler
+from DataGeneration.DatabaseHandler import DatabaseHandler
+from DataGeneration.DataGenerator import DataGenerator
+from DataGeneration.MapLocation import MapLocation
+
+
+class TestAdaptiveSampler(unittest.TestCase):
+
+    def setUp(self):
+        self.handler = DatabaseHandler(':memory:')
+        self.wrapper = Mock()
+        self.stop = MapLocation(0, 0, 7)
+        self.generator = DataGenerator(handler=self.handler,
+                                       stops=[self.stop],
+                                       wrapper=self.wrapper)
+
+    def set_time_field(self, function):
+        def get_distance_from_api(origin, destination, mode):
+            time = function(origin.latitude, origin.longitude)
+            return {"distance": time, "time": time}
+        self.wrapper.get_distance_from_api.side_effect = get_distance_from_api
+
+    def sampled_points(self, samples):
+        return sorted((location.latitude, location.longitude)
+                      for location, _ in samples)
+
+    # sample tests
+    def test_sample_flat_field_keeps_coarse_grid(self):
+        self.set_time_field(lambda lat, lng: 100)
+        sampler = AdaptiveSampler(self.generator, threshold=10, max_depth=3)
+        samples = sampler.sample(0, 2, 0, 2, 1, 1)
+        self.assertEqual(9, len(samples))
+        self.assertEqual(9, sampler.api_calls)
+        self.assertEqual([100] * 9, [time for _, time in samples])
+
+    def test_sample_refines_steep_cells_only(self):
+        # time only changes across the cell between latitude 0 and 1
+        self.set_time_field(lambda lat, lng: 1000 if lat >= 1 else 0)
+        sampler = AdaptiveSampler(self.generator, threshold=10, max_depth=1)
+        samples = sampler.sample(0, 2, 0, 1, 1, 1)
+        self.assertEqual([(0, 0), (0, 0.5), (0, 1), (0.5, 0), (0.5, 0.5),
+                          (0.5, 1), (1, 0), (1, 0.5), (1, 1), (2, 0), (2, 1)],
+                         self.sampled_points(samples))
+
+    def test_sample_shares_corners_between_cells(self):
+        self.set_time_field(lambda lat, lng: 1000 * (lat + lng))
+        sampler = AdaptiveSampler(self.generator, threshold=10, max_depth=2)
+        samples = sampler.sample(0, 2, 0, 2, 1, 1)
+        # every cell is refined down to a 0.25 degree grid
+        self.assertEqual(81, len(samples))
+        self.assertEqual(81, sampler.api_calls)
+        self.assertEqual(81, self.count_rows('addresses'))
+
+    def test_sample_stores_addresses_and_routes(self):
+        self.set_time_field(lambda lat, lng: 60)
+        sampler = AdaptiveSampler(self.generator, threshold=10)
+        samples = sampler.sample(1, 1, 2, 2, 1, 1)
+        location, time = samples[0]
+        self.assertEqual((1, 2, 1), (location.latitude, location.longitude,
+                                     location.id))
+        self.assertEqual([(1, 7, 60, 60)], self.handler.conn.execute(
+            "SELECT address_id, stop_id, distance, time "
+            "FROM routes").fetchall())
+
+    def test_sample_errors_leave_time_unknown(self):
+        self.wrapper.get_distance_from_api.side_effect = \
+            requests.exceptions.RequestException('error')
+        sampler = AdaptiveSampler(self.generator, threshold=10)
+        samples = sampler.sample(0, 1, 0, 1, 1, 1)
+        self.assertEqual([None] * 4, [time for _, time in samples])
+        self.assertEqual(0, self.count_rows('routes'))
+
+    def test_sample_resumes_from_stored_points(self):
+        self.set_time_field(lambda lat, lng: 1000 * (lat + lng))
+        AdaptiveSampler(self.generator, threshold=10, max_depth=1).sample(
+            0, 1, 0, 1, 1, 1)
+        sampler = AdaptiveSampler(self.generator, threshold=10, max_depth=2)
+        samples = sampler.sample(0, 1, 0, 1, 1, 1)
+        # only the points of the new level of refinement are queried
+        self.assertEqual(25, len(samples))
+        self.assertEqual(16, sampler.api_calls)
+        self.assertEqual(25, self.count_rows('addresses'))
+        self.assertEqual(25, self.count_rows('routes'))
+        self.assertEqual(2000, dict(
+            ((location.latitude, location.longitude), time)
+            for location, time in samples)[(1, 1)])
+
+    def test_sample_adds_each_level_in_one_batch(self):
+        self.set_time_field(lambda lat, lng: 1000 * (lat + lng))
+        self.handler.add_address_locations = Mock(
+            wraps=self.handler.add_address_locations)
+        sampler = AdaptiveSampler(self.generator, threshold=10, max_depth=2)
+        sampler.sample(0, 1, 0, 1, 1, 1)
+        self.assertEqual([4, 5, 16], [
+            len(call[0][0]) for call in
+            self.handler.add_address_locations.call_args_list])
+
+    def count_rows(self, table):
+        return self.handler.conn.execute(
+            "SELECT COUNT(*) FROM {}".format(table)).fetchone()[0]
@@ -2,7 +2,10 @@ from DataGeneration import DataGenerator
 from DataGeneration import DatabaseHandler
 from DataGeneration import MapLocation
 from DataGeneration import MapboxAPIWrapper
+from DataGeneration import KDTreeStopIndex
+from DataGeneration.DistanceMetric import EuclideanMetric
 from MapboxAPIWrapper import MapboxAPIError
+import random
 import unittest
 from mock import Mock, patch, MagicMock, mock
 
@@ -260,3 +263,460 @@ class test_DataGenerator(unittest.TestCase):
                                                         n=1)
         self.assertEqual(MapLocation(1, 1, 1), closest[0],
                          "{}, should be 1, 1".format(closest[0]))
+
+    def test_get_closest_locations_sees_changed_destinations(self):
+        stops = [MapLocation(1, 1, 1), MapLocation(3, 3, 3)]
+        address = MapLocation(2.9, 2.9, 2)
+        self.assertEqual([MapLocation(3, 3, 3)],
+                         self.generator._get_closest_locations(address,
+                                                               stops, n=1))
+        self.assertEqual([MapLocation(1, 1, 1)],
+                         self.generator._get_closest_locations(
+                             address, stops[:1], n=1))
+
+    def test_get_closest_locations_sees_replaced_destination(self):
+        stops = [MapLocation(1, 1, 1), MapLocation(3, 3, 3)]
+        address = MapLocation(2.9, 2.9, 2)
+        self.assertEqual([MapLocation(3, 3, 3)],
+                         self.generator._get_closest_locations(address,
+                                                               stops, n=1))
+        stops[1] = MapLocation(9, 9, 9)
+        self.assertEqual([MapLocation(1, 1, 1)],
+                         self.generator._get_closest_locations(address,
+                                                               stops, n=1))
+
+    # spatial index tests
+    def test_constructor_leaves_stop_index_empty_by_default(self):
+        self.assertIsNone(self.generator.stop_index)
+
+    def test_constructor_builds_kdtree_stop_index(self):
+        generator = DataGenerator(handler=DatabaseHandler(full=False),
+                                  stops=[MapLocation(1, 1, 1)],
+                                  wrapper=MapboxAPIWrapper(),
+                                  spatial_index='kdtree')
+        self.assertIsInstance(generator.stop_index, KDTreeStopIndex)
+
+    def test_constructor_accepts_spatial_index_factory(self):
+        factory = Mock()
+        stops = [MapLocation(1, 1, 1)]
+        generator = DataGenerator(handler=DatabaseHandler(full=False),
+                                  stops=stops,
+                                  wrapper=MapboxAPIWrapper(),
+                                  spatial_index=factory)
+        factory.assert_called_once_with(stops)
+        self.assertEqual(factory.return_value, generator.stop_index)
+
+    def test_constructor_errors_on_unknown_spatial_index(self):
+        with self.assertRaises(ValueError):
+            DataGenerator(handler=DatabaseHandler(full=False),
+                          stops=[],
+                          wrapper=MapboxAPIWrapper(),
+                          spatial_index='octree')
+
+    def test_begin_uses_stop_index_when_configured(self):
+        address = MapLocation(1, 1, 1)
+        self.generator.handler.get_address_generator = \
+            MagicMock(return_value=[address])
+        self.generator.stop_index = Mock()
+        self.generator.stop_index.nearest.return_value = []
+        self.generator._get_closest_locations = Mock()
+
+        self.generator.begin(stops_per_address=3, verbose=False)
+
+        self.generator.stop_index.nearest.assert_called_once_with(address, n=3)
+        self.assertEqual(0, self.generator._get_closest_locations.call_count)
+
+    # batch candidate selection tests
+    def test_begin_with_batch_size_selects_stops_in_batches(self):
+        addresses = [MapLocation(1, 1, 1), MapLocation(5, 5, 2)]
+        self.generator.handler.get_address_generator = \
+            MagicMock(return_value=addresses)
+        self.generator.stops = [MapLocation(2, 2, 2), MapLocation(6, 6, 6)]
+        self.generator._get_closest_locations = Mock()
+        mock_process_stop = Mock()
+        self.generator.process_stop = mock_process_stop
+
+        self.generator.begin(stops_per_address=1, verbose=False, batch_size=1)
+
+        self.assertEqual(0, self.generator._get_closest_locations.call_count)
+        expected_calls = [mock.call(addresses[0], self.generator.stops[0],
+                                    False, 'walking'),
+                          mock.call(addresses[1], self.generator.stops[1],
+                                    False, 'walking')]
+        self.assertEqual(expected_calls, mock_process_stop.call_args_list)
+
+    def test_get_closest_locations_batch_matches_reference(self):
+        rng = random.Random(7)
+        stops = [MapLocation(rng.uniform(0, 7), rng.uniform(0, 11), i)
+                 for i in range(1, 40)]
+        addresses = [MapLocation(rng.uniform(0, 7), rng.uniform(0, 11), i)
+                     for i in range(1, 60)]
+        batch = list(self.generator._get_closest_locations_batch(
+            addresses, stops, n=4, chunk_size=16))
+        self.assertEqual(addresses, [address for address, _ in batch])
+        for address, closest in batch:
+            self.assertEqual(
+                self.generator._get_closest_locations(address, stops, n=4),
+                closest)
+
+    def test_get_closest_locations_batch_returns_all_when_n_is_larger(self):
+        stops = [MapLocation(3, 3, 3), MapLocation(1, 1, 1)]
+        batch = list(self.generator._get_closest_locations_batch(
+            [MapLocation(0, 0, 0)], stops, n=5))
+        self.assertEqual([stops[1], stops[0]], batch[0][1])
+
+    # metric tests
+    def test_constructor_uses_euclidean_metric_by_default(self):
+        self.assertIsInstance(self.generator.metric, EuclideanMetric)
+
+    def test_get_closest_locations_uses_metric(self):
+        # one degree of longitude is shorter than one degree of latitude
+        # away from the equator
+        generator = DataGenerator(handler=DatabaseHandler(full=False),
+                                  stops=[],
+                                  wrapper=MapboxAPIWrapper(),
+                                  metric='haversine')
+        stops = [MapLocation(42.4, -81.5, 1), MapLocation(41.5, -80.4, 2)]
+        address = MapLocation(41.5, -81.5, 3)
+        closest = generator._get_closest_locations(address, stops, n=1)
+        self.assertEqual(MapLocation(41.5, -80.4, 2), closest[0])
+
+    def test_get_closest_locations_batch_uses_metric(self):
+        generator = DataGenerator(handler=DatabaseHandler(full=False),
+                                  stops=[],
+                                  wrapper=MapboxAPIWrapper(),
+                                  metric='equirectangular')
+        stops = [MapLocation(42.4, -81.5, 1), MapLocation(41.5, -80.4, 2)]
+        address = MapLocation(41.5, -81.5, 3)
+        batch = list(generator._get_closest_locations_batch([address],
+                                                            stops, n=1))
+        self.assertEqual([MapLocation(41.5, -80.4, 2)], batch[0][1])
+
+    # concurrent processing tests
+    def test_begin_with_workers_adds_route_for_each_stop(self):
+        addresses = [MapLocation(1, 1, 1), MapLocation(2, 2, 2)]
+        self.generator.handler.get_address_generator = \
+            MagicMock(return_value=addresses)
+        stops = [MapLocation(3, 3, 3), MapLocation(4, 4, 4)]
+        self.generator._get_closest_locations = Mock(return_value=stops)
+        self.generator.wrapper.get_distance_from_api = \
+            Mock(return_value={"distance": 6, "time": 9})
+        self.generator.handler.add_route = Mock()
+
+        self.generator.begin(stops_per_address=2, verbose=False, workers=3,
+                             max_in_flight=2)
+
+        self.assertEqual(4, self.generator.wrapper.get_distance_from_api.
+                         call_count)
+        self.assertEqual(sorted([mock.call(1, 3, 6, 9), mock.call(1, 4, 6, 9),
+                                 mock.call(2, 3, 6, 9), mock.call(2, 4, 6, 9)]),
+                         sorted(self.generator.handler.add_route.
+                                call_args_list))
+
+    def test_begin_with_workers_passes_mode(self):
+        address = MapLocation(1, 1, 1)
+        stop = MapLocation(3, 3, 3)
+        self.generator.handler.get_address_generator = \
+            MagicMock(return_value=[address])
+        self.generator._get_closest_locations = Mock(return_value=[stop])
+        self.generator.wrapper.get_distance_from_api = \
+            Mock(return_value={"distance": 6, "time": 9})
+        self.generator.handler.add_route = Mock()
+
+        self.generator.begin(stops_per_address=1, verbose=False, workers=2,
+                             mode='cycling')
+
+        self.generator.wrapper.get_distance_from_api.\
+            assert_called_once_with(address, stop, 'cycling')
+
+    def test_begin_with_workers_skips_routes_that_error(self):
+        address = MapLocation(1, 1, 1)
+        stops = [MapLocation(3, 3, 3), MapLocation(4, 4, 4)]
+        self.generator.handler.get_address_generator = \
+            MagicMock(return_value=[address])
+        self.generator._get_closest_locations = Mock(return_value=stops)
+
+        def get_distance(origin, destination, mode):
+            if destination.id == 3:
+                raise MapboxAPIError("API Error")
+            return {"distance": 6, "time": 9}
+        self.generator.wrapper.get_distance_from_api = \
+            Mock(side_effect=get_distance)
+        self.generator.handler.add_route = Mock()
+
+        self.generator.begin(stops_per_address=2, verbose=False, workers=2)
+
+        self.generator.handler.add_route.assert_called_once_with(1, 4, 6, 9)
+
+    def test_begin_with_workers_raises_other_errors(self):
+        addresses = [MapLocation(1, 1, 1), MapLocation(2, 2, 2)]
+        stops = [MapLocation(3, 3, 3), MapLocation(4, 4, 4)]
+        self.generator.handler.get_address_generator = \
+            MagicMock(return_value=addresses)
+        self.generator._get_closest_locations = Mock(return_value=stops)
+        self.generator.wrapper.get_distance_from_api = \
+            Mock(side_effect=KeyError('routes'))
+        self.generator.handler.add_route = Mock()
+
+        with self.assertRaises(KeyError):
+            self.generator.begin(stops_per_address=2, verbose=False,
+                                 workers=2, max_in_flight=1)
+        self.generator.handler.add_route.assert_not_called()
+
+    # matrix processing tests
+    def test_begin_with_matrix_adds_route_for_each_address_stop(self):
+        addresses = [MapLocation(1, 1, 1), MapLocation(2, 2, 2)]
+        self.generator.handler.get_address_generator = \
+            MagicMock(return_value=addresses)
+        stops = [MapLocation(3, 3, 3), MapLocation(4, 4, 4)]
+        self.generator._get_closest_locations = \
+            Mock(side_effect=[stops, stops[1:]])
+        self.generator.wrapper.get_distance_matrix = Mock(return_value=[
+            [{"distance": 13, "time": 130}, {"distance": 14, "time": 140}],
+            [{"distance": 23, "time": 230}, {"distance": 24, "time": 240}]])
+        self.generator.handler.add_route = Mock()
+
+        self.generator.begin(stops_per_address=2, verbose=False,
+                             use_matrix=True, mode='driving')
+
+        self.generator.wrapper.get_distance_matrix.assert_called_once_with(
+            addresses, stops, 'driving')
+        self.assertEqual([mock.call(1, 3, 13, 130), mock.call(1, 4, 14, 140),
+                          mock.call(2, 4, 24, 240)],
+                         self.generator.handler.add_route.call_args_list)
+
+    def test_begin_with_matrix_splits_requests_at_coordinate_limit(self):
+        addresses = [MapLocation(1, 1, i) for i in range(1, 6)]
+        self.generator.handler.get_address_generator = \
+            MagicMock(return_value=addresses)
+        self.generator._get_closest_locations = Mock(
+            side_effect=[[MapLocation(i, i, 100 + i)] for i in range(1, 6)])
+        self.generator.wrapper.MATRIX_COORDINATE_LIMIT = 4
+        self.generator.wrapper.get_distance_matrix = Mock(
+            side_effect=lambda origins, destinations, mode:
+            [[{"distance": 1, "time": 1}] * len(destinations)] * len(origins))
+        self.generator.handler.add_route = Mock()
+
+        self.generator.begin(stops_per_address=1, verbose=False,
+                             use_matrix=True)
+
+        self.assertEqual(3, self.generator.wrapper.get_distance_matrix.
+                         call_count)
+        self.assertEqual(5, self.generator.handler.add_route.call_count)
+
+    def test_begin_with_matrix_splits_stops_of_one_address(self):
+        addresses = [MapLocation(1, 1, 1), MapLocation(2, 2, 2)]
+        self.generator.handler.get_address_generator = \
+            MagicMock(return_value=addresses)
+        self.generator._get_closest_locations = Mock(side_effect=[
+            [MapLocation(i, i, 100 + i) for i in range(7)],
+            [MapLocation(9, 9, 109)]])
+        self.generator.wrapper.MATRIX_COORDINATE_LIMIT = 4
+        self.generator.wrapper.get_distance_matrix = Mock(
+            side_effect=lambda origins, destinations, mode:
+            [[{"distance": 1, "time": 1}] * len(destinations)] * len(origins))
+        self.generator.handler.add_route = Mock()
+
+        self.generator.begin(stops_per_address=7, verbose=False,
+                             use_matrix=True)
+
+        self.assertEqual([(1, 3), (1, 3), (1, 1), (1, 1)],
+                         [(len(call[0][0]), len(call[0][1])) for call in
+                          self.generator.wrapper.get_distance_matrix.
+                          call_args_list])
+        self.assertEqual(8, self.generator.handler.add_route.call_count)
+
+    def test_begin_with_matrix_skips_missing_routes(self):
+        address = MapLocation(1, 1, 1)
+        self.generator.handler.get_address_generator = \
+            MagicMock(return_value=[address])
+        stops = [MapLocation(3, 3, 3), MapLocation(4, 4, 4)]
+        self.generator._get_closest_locations = Mock(return_value=stops)
+        self.generator.wrapper.get_distance_matrix = Mock(
+            return_value=[[None, {"distance": 14, "time": 140}]])
+        self.generator.handler.add_route = Mock()
+
+        self.generator.begin(stops_per_address=2, verbose=False,
+                             use_matrix=True)
+
+        self.generator.handler.add_route.assert_called_once_with(1, 4, 14, 140)
+
+    # write batching tests
+    def test_begin_with_write_batch_size_writes_routes_in_batches(self):
+        address = MapLocation(1, 1, 1)
+        self.generator.handler.get_address_generator = \
+            MagicMock(return_value=[address])
+        stops = [MapLocation(3, 3, 3), MapLocation(4, 4, 4),
+                 MapLocation(5, 5, 5)]
+        self.generator._get_closest_locations = Mock(return_value=stops)
+        self.generator.wrapper.get_distance_from_api = \
+            Mock(return_value={"distance": 6, "time": 9})
+        self.generator.handler.add_route = Mock()
+        self.generator.handler.add_routes = Mock()
+
+        self.generator.begin(stops_per_address=3, verbose=False,
+                             write_batch_size=2)
+
+        self.assertEqual(0, self.generator.handler.add_route.call_count)
+        self.assertEqual([mock.call([(1, 3, 6, 9), (1, 4, 6, 9)]),
+                          mock.call([(1, 5, 6, 9)])],
+                         self.generator.handler.add_routes.call_args_list)
+        self.assertIsNone(self.generator.route_writer)
+
+    # work queue tests
+    def _setup_queue(self, addresses, stops):
+        self.generator.handler.populate_address_queue = Mock()
+        self.generator.handler.claim_addresses = \
+            Mock(side_effect=[addresses, []])
+        self.generator.handler.get_route_stop_ids = Mock(return_value=set())
+        self.generator.handler.mark_address_done = Mock()
+        self.generator.handler.mark_address_failed = Mock()
+        self.generator.handler.add_route = Mock()
+        self.generator._get_closest_locations = Mock(return_value=stops)
+
+    def test_begin_with_queue_claims_addresses_and_marks_done(self):
+        addresses = [MapLocation(1, 1, 1), MapLocation(2, 2, 2)]
+        self._setup_queue(addresses, [MapLocation(3, 3, 3)])
+        self.generator.handler.get_address_generator = MagicMock()
+        self.generator.wrapper.get_distance_from_api = \
+            Mock(return_value={"distance": 6, "time": 9})
+
+        self.generator.begin(stops_per_address=1, verbose=False,
+                             use_queue=True, claim_size=10, worker_id='w1')
+
+        self.generator.handler.populate_address_queue.assert_called_once_with()
+        self.assertEqual(0, self.generator.handler.get_address_generator.
+                         call_count)
+        self.generator.handler.claim_addresses.assert_called_with(
+            10, worker_id='w1', max_attempts=3)
+        self.assertEqual([mock.call(1), mock.call(2)],
+                         self.generator.handler.mark_address_done.
+                         call_args_list)
+
+    def test_begin_with_queue_marks_address_failed_on_error(self):
+        address = MapLocation(1, 1, 1)
+        self._setup_queue([address], [MapLocation(3, 3, 3),
+                                      MapLocation(4, 4, 4)])
+        error = MapboxAPIError("API Error")
+        self.generator.wrapper.get_distance_from_api = \
+            Mock(side_effect=[{"distance": 6, "time": 9}, error])
+
+        self.generator.begin(stops_per_address=2, verbose=False,
+                             use_queue=True)
+
+        self.generator.handler.add_route.assert_called_once_with(1, 3, 6, 9)
+        self.generator.handler.mark_address_failed.assert_called_once_with(
+            1, error)
+        self.assertEqual(0, self.generator.handler.mark_address_done.
+                         call_count)
+
+    def test_begin_with_queue_skips_stops_that_already_have_routes(self):
+        address = MapLocation(1, 1, 1)
+        stops = [MapLocation(3, 3, 3), MapLocation(4, 4, 4)]
+        self._setup_queue([address], stops)
+        self.generator.handler.get_route_stop_ids = Mock(return_value=set([3]))
+        self.generator.wrapper.get_distance_from_api = \
+            Mock(return_value={"distance": 6, "time": 9})
+
+        self.generator.begin(stops_per_address=2, verbose=False,
+                             use_queue=True)
+
+        self.generator.wrapper.get_distance_from_api.assert_called_once_with(
+            address, stops[1], 'walking')
+        self.generator.handler.mark_address_done.assert_called_once_with(1)
+
+    def test_begin_with_queue_marks_done_after_routes_are_written(self):
+        address = MapLocation(1, 1, 1)
+        self._setup_queue([address], [MapLocation(3, 3, 3)])
+        self.generator.handler.add_routes = Mock()
+        self.generator.handler.mark_address_done = Mock(
+            side_effect=lambda address_id: self.assertEqual(
+                1, self.generator.handler.add_routes.call_count))
+        self.generator.wrapper.get_distance_from_api = \
+            Mock(return_value={"distance": 6, "time": 9})
+
+        self.generator.begin(stops_per_address=1, verbose=False,
+                             use_queue=True, write_batch_size=100)
+
+        self.generator.handler.mark_address_done.assert_called_once_with(1)
+
+    def test_begin_with_queue_and_workers_marks_done(self):
+        addresses = [MapLocation(1, 1, 1), MapLocation(2, 2, 2)]
+        self._setup_queue(addresses, [MapLocation(3, 3, 3),
+                                      MapLocation(4, 4, 4)])
+        self.generator.wrapper.get_distance_from_api = \
+            Mock(return_value={"distance": 6, "time": 9})
+
+        self.generator.begin(stops_per_address=2, verbose=False,
+                             use_queue=True, workers=2)
+
+        self.assertEqual([mock.call(1), mock.call(2)],
+                         sorted(self.generator.handler.mark_address_done.
+                                call_args_list))
+
+    # pruning tests
+    def _setup_prune(self, distances):
+        self.address = MapLocation(41.5, -81.7, 1)
+        # about 1110, 110, and 2220 meters from the address
+        self.stops = [MapLocation(41.51, -81.7, 2),
+                      MapLocation(41.501, -81.7, 3),
+                      MapLocation(41.52, -81.7, 4)]
+        self.generator.handler.get_address_generator = \
+            MagicMock(return_value=[self.address])
+        self.generator._get_closest_locations = Mock(return_value=self.stops)
+
+        def get_distance(origin, destination, mode):
+            if destination.id not in distances:
+                raise MapboxAPIError("API Error")
+            return {"distance": distances[destination.id], "time": 1}
+        self.generator.wrapper.get_distance_from_api = \
+            Mock(side_effect=get_distance)
+        self.generator.handler.add_route = Mock()
+
+    def test_begin_with_prune_skips_stops_that_cannot_be_closer(self):
+        self._setup_prune({2: 1500, 3: 500, 4: 2500})
+
+        self.generator.begin(stops_per_address=3, verbose=False, prune=True)
+
+        self.generator.wrapper.get_distance_from_api.assert_called_once_with(
+            self.address, self.stops[1], 'walking')
+        self.generator.handler.add_route.assert_called_once_with(1, 3, 500, 1)
+
+    def test_begin_with_prune_queries_in_straight_line_order(self):
+        self._setup_prune({2: 1200, 3: 1500, 4: 2500})
+
+        self.generator.begin(stops_per_address=3, verbose=False, prune=True)
+
+        self.assertEqual([mock.call(self.address, self.stops[1], 'walking'),
+                          mock.call(self.address, self.stops[0], 'walking')],
+                         self.generator.wrapper.get_distance_from_api.
+                         call_args_list)
+
+    def test_begin_with_prune_snap_allowance_queries_more_stops(self):
+        self._setup_prune({2: 1200, 3: 1500, 4: 1150})
+
+        self.generator.begin(stops_per_address=3, verbose=False, prune=True,
+                             prune_snap_allowance=1100)
+
+        self.assertEqual([mock.call(self.address, self.stops[1], 'walking'),
+                          mock.call(self.address, self.stops[0], 'walking'),
+                          mock.call(self.address, self.stops[2], 'walking')],
+                         self.generator.wrapper.get_distance_from_api.
+                         call_args_list)
+        self.generator.handler.add_route.assert_any_call(1, 4, 1150, 1)
+
+    def test_begin_with_prune_continues_after_errors(self):
+        self._setup_prune({2: 1200, 4: 2500})
+
+        self.generator.begin(stops_per_address=3, verbose=False, prune=True)
+
+        self.generator.handler.add_route.assert_called_once_with(1, 2, 1200, 1)
+
+    def test_begin_with_prune_and_queue_counts_skipped_stops(self):
+        self._setup_prune({2: 1500, 3: 500, 4: 2500})
+        self._setup_queue([self.address], self.stops)
+
+        self.generator.begin(stops_per_address=3, verbose=False,
+                             use_queue=True, prune=True)
+
+        self.generator.handler.mark_address_done.assert_called_once_with(1)
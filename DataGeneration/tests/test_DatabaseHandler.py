@@ -2,7 +2,10 @@ import unittest
 from mock import patch, MagicMock, Mock
 from DatabaseHandler import DatabaseHandler
 from DataGeneration.MapLocation import MapLocation
+import gzip
+import json
 import os
+import sys
 import types
 import pandas as pd
 
@@ -18,8 +21,16 @@ class TestDatabaseHandler(unittest.TestCase):
     def tearDown(self):
         if os.path.exists('unit_test_db.sqlite3'):
             os.remove('unit_test_db.sqlite3')
+        if os.path.exists('unit_test_shard.sqlite3'):
+            os.remove('unit_test_shard.sqlite3')
+        for suffix in ('-wal', '-shm'):
+            if os.path.exists('unit_test_db.sqlite3' + suffix):
+                os.remove('unit_test_db.sqlite3' + suffix)
         if os.path.exists('test_file.csv'):
             os.remove('test_file.csv')
+        for file_name in ('test_file.csv.gz', 'test_file.geojson'):
+            if os.path.exists(file_name):
+                os.remove(file_name)
 
     # constructor tests
     @patch('DatabaseHandler.DatabaseHandler.initialize_db')
@@ -64,6 +75,50 @@ class TestDatabaseHandler(unittest.TestCase):
         self.assertFalse(mock_init_db.called,
                          "initialize_db shouldn't have been called")
 
+    @patch('DatabaseHandler.DatabaseHandler.enable_performance_profile')
+    def test_handler_constructor_enables_performance_profile(self,
+                                                             mock_profile):
+        handler = DatabaseHandler('unit_test_db.sqlite3', performance=True)
+        mock_profile.assert_called_once_with()
+
+    @patch('DatabaseHandler.DatabaseHandler.enable_performance_profile')
+    def test_handler_constructor_doesnt_enable_profile_by_default(self,
+                                                                  mock_profile):
+        handler = DatabaseHandler('unit_test_db.sqlite3')
+        self.assertFalse(mock_profile.called,
+                         "enable_performance_profile shouldn't have been called")
+
+    # enable_performance_profile tests
+    def test_enable_performance_profile_enables_wal(self):
+        handler = DatabaseHandler('unit_test_db.sqlite3')
+        handler.enable_performance_profile()
+        c = handler.conn.cursor()
+        c.execute("PRAGMA journal_mode")
+        self.assertEqual('wal', c.fetchone()[0])
+
+    def test_enable_performance_profile_adds_routes_indexes(self):
+        handler = DatabaseHandler('unit_test_db.sqlite3')
+        handler.enable_performance_profile()
+        c = handler.conn.cursor()
+        c.execute("SELECT name FROM sqlite_master WHERE "
+                  "type='index' AND tbl_name='routes'")
+        indexes = [row[0] for row in c.fetchall()]
+        self.assertIn('routes_address_id_distance', indexes)
+        self.assertIn('routes_stop_id', indexes)
+
+    def test_enable_performance_profile_migrates_existing_database(self):
+        handler = DatabaseHandler('unit_test_db.sqlite3')
+        handler.add_routes([(1, 1, 10, 20)])
+        handler.conn.close()
+        handler = DatabaseHandler('unit_test_db.sqlite3', performance=True)
+        handler.enable_performance_profile()
+        c = handler.conn.cursor()
+        c.execute("SELECT COUNT(*) FROM sqlite_master WHERE type='index' "
+                  "AND name='routes_address_id_distance'")
+        self.assertEqual(1, c.fetchone()[0])
+        c.execute("SELECT COUNT(*) FROM routes")
+        self.assertEqual(1, c.fetchone()[0])
+
     # initialize_db tests
     def test_construct_db_calls_add_address_table(self):
         handler = DatabaseHandler('unit_test_db.sqlite3')
@@ -159,6 +214,48 @@ class TestDatabaseHandler(unittest.TestCase):
         row = c.fetchone()
         self.assertEqual((15.35, -1.5), row)
 
+    def test_add_addresses_from_file_skips_duplicates(self):
+        handler = DatabaseHandler('unit_test_db.sqlite3')
+        handler.add_address(MapLocation(latitude=1, longitude=2))
+        with open('test_file.csv', 'w') as f:
+            f.write('latitude, longitude\n')
+            f.write('  3.5, -4.25\n')
+            f.write('1.0000001, 2\n')
+            f.write('3.5, -4.25\n')
+            f.write('5, 6\n')
+        self.assertEqual(2, handler.add_addresses_from_file('test_file.csv',
+                                                            chunksize=2))
+        self.assertEqual(0, handler.add_addresses_from_file('test_file.csv'))
+        c = handler.conn.cursor()
+        c.execute("SELECT latitude, longitude FROM addresses ORDER BY id")
+        self.assertEqual([(1, 2), (3.5, -4.25), (5, 6)], c.fetchall())
+
+    def test_add_addresses_from_file_rejects_invalid_coordinates(self):
+        handler = DatabaseHandler('unit_test_db.sqlite3')
+        with open('test_file.csv', 'w') as f:
+            f.write('latitude,longitude\n')
+            f.write('1,2\n')
+            f.write('91,2\n')
+            f.write('3,\n')
+        with self.assertRaises(ValueError):
+            handler.add_addresses_from_file('test_file.csv', chunksize=1)
+        c = handler.conn.cursor()
+        c.execute("SELECT COUNT(*) FROM addresses")
+        self.assertEqual(0, c.fetchone()[0])
+        self.assertEqual(1, handler.add_addresses_from_file(
+            'test_file.csv', skip_invalid=True))
+
+    def test_add_stops_from_file_reads_sample_stops(self):
+        handler = DatabaseHandler('unit_test_db.sqlite3')
+        self.assertEqual(98, handler.add_stops_from_file(
+            os.path.join(os.path.dirname(__file__), '..', '..',
+                         'sample_data', 'sparse_stops.csv')))
+        c = handler.conn.cursor()
+        c.execute("SELECT stop_id, stop_name, latitude, longitude "
+                  "FROM stops ORDER BY id LIMIT 1")
+        self.assertEqual((1, 'COLUMBUS ST & BROADWAY', 41.392864, -81.536557),
+                         c.fetchone())
+
     # add information to tables tests
     # add_address tests
     @patch('DatabaseHandler.DatabaseHandler.initialize_db')
@@ -189,6 +286,54 @@ class TestDatabaseHandler(unittest.TestCase):
         c.execute("SELECT * FROM addresses")
         self.assertEqual(100, c.fetchone()[0])
 
+    def test_add_address_returns_new_id(self):
+        handler = DatabaseHandler('unit_test_db.sqlite3')
+        self.assertEqual(1, handler.add_address(MapLocation(1, 2)))
+        self.assertEqual(9, handler.add_address(MapLocation(3, 4, id=9)))
+
+    # add_address_locations tests
+    def test_add_address_locations_sets_ids(self):
+        handler = DatabaseHandler('unit_test_db.sqlite3')
+        handler.add_address(MapLocation(latitude=1, longitude=1, id=4))
+        locations = [MapLocation(latitude=2, longitude=2),
+                     MapLocation(latitude=3, longitude=3)]
+        self.assertEqual([5, 6], handler.add_address_locations(locations))
+        self.assertEqual([5, 6], [location.id for location in locations])
+
+    def test_get_location_ids_rounds_coordinates(self):
+        handler = DatabaseHandler('unit_test_db.sqlite3')
+        handler.add_address(MapLocation(latitude=1.0000001, longitude=2,
+                                        id=3))
+        self.assertEqual([3], list(
+            handler.get_location_ids('addresses', 6).values()))
+        # an address at the same rounded coordinates shares the key
+        handler.add_address(MapLocation(latitude=1, longitude=2, id=4))
+        self.assertEqual(1, len(handler.get_location_ids('addresses', 6)))
+        self.assertEqual(2, len(handler.get_location_ids('addresses', 7)))
+
+    def test_get_routes_by_address(self):
+        handler = DatabaseHandler('unit_test_db.sqlite3')
+        handler.add_routes([(1, 5, 10, 100), (1, 6, 20, 200),
+                            (2, 5, 30, 300)])
+        self.assertEqual({1: {5: (10, 100), 6: (20, 200)}},
+                         handler.get_routes_by_address([1, 3],
+                                                       chunk_size=1))
+
+    # add_addresses tests
+    def test_add_addresses_adds_all_addresses(self):
+        handler = DatabaseHandler('unit_test_db.sqlite3')
+        handler.add_addresses([(1.5, 2.5), (3.5, 4.5)])
+        c = handler.conn.cursor()
+        c.execute("SELECT id, latitude, longitude FROM addresses")
+        self.assertEqual([(1, 1.5, 2.5), (2, 3.5, 4.5)], c.fetchall())
+
+    def test_add_addresses_returns_number_added(self):
+        handler = DatabaseHandler('unit_test_db.sqlite3')
+        self.assertEqual(2, handler.add_addresses([(1.5, 2.5), (3.5, 4.5)],
+                                                  ids=[7, 8]))
+        self.assertEqual(1, handler.add_addresses([(1.5, 2.5), (5.5, 6.5)],
+                                                  ids=[7, 9]))
+
     # add_stop tests
     @patch('DatabaseHandler.DatabaseHandler.initialize_db')
     def test_add_stop_adds_to_stops_table(self,
@@ -229,6 +374,35 @@ class TestDatabaseHandler(unittest.TestCase):
         c.execute("SELECT * FROM routes")
         self.assertEqual((1, 1, 1, 10, 20), c.fetchone())
 
+    # add_routes tests
+    def test_add_routes_adds_all_routes(self):
+        handler = DatabaseHandler('unit_test_db.sqlite3')
+        handler.add_routes([(1, 1, 10, 20), (2, 1, 30, 40)])
+        c = handler.conn.cursor()
+        c.execute("SELECT address_id, stop_id, distance, time FROM routes")
+        self.assertEqual([(1, 1, 10, 20), (2, 1, 30, 40)], c.fetchall())
+
+    def test_add_routes_accepts_generator(self):
+        handler = DatabaseHandler('unit_test_db.sqlite3')
+        handler.add_routes((i, 1, i, i) for i in range(1, 4))
+        c = handler.conn.cursor()
+        c.execute("SELECT COUNT(*) FROM routes")
+        self.assertEqual(3, c.fetchone()[0])
+
+    def test_add_routes_writes_nothing_if_a_row_fails(self):
+        handler = DatabaseHandler('unit_test_db.sqlite3')
+        with self.assertRaises(Exception):
+            handler.add_routes([(1, 1, 10, 20), (2, 1, None, 40)])
+        c = handler.conn.cursor()
+        c.execute("SELECT COUNT(*) FROM routes")
+        self.assertEqual(0, c.fetchone()[0])
+
+    def test_add_route_calls_add_routes(self):
+        handler = DatabaseHandler(full=False)
+        handler.add_routes = Mock()
+        handler.add_route(address=1, stop=2, distance=3, time=4)
+        handler.add_routes.assert_called_once_with([(1, 2, 3, 4)])
+
     # Information Retrieval Tests
     # get_address_generator tests
     def test_get_address_without_route_generator_returns_generator(self):
@@ -284,6 +458,217 @@ class TestDatabaseHandler(unittest.TestCase):
                          address_generator.next(),
                          "second returned MapLocation was not correct")
 
+    def test_get_address_generator_reads_across_pages(self):
+        handler = DatabaseHandler('unit_test_db.sqlite3')
+        for i in range(1, 8):
+            handler.add_address(MapLocation(latitude=i, longitude=i, id=i))
+        addresses = list(handler.get_address_generator(page_size=3))
+        self.assertEqual(list(range(1, 8)),
+                         [address.id for address in addresses])
+
+    def test_get_address_generator_skips_routes_added_while_iterating(self):
+        handler = DatabaseHandler('unit_test_db.sqlite3')
+        for i in range(1, 5):
+            handler.add_address(MapLocation(latitude=i, longitude=i, id=i))
+        ids = []
+        for address in handler.get_address_generator(page_size=2):
+            ids.append(address.id)
+            handler.add_route(address=address.id, stop=1, distance=1, time=1)
+        self.assertEqual([1, 2, 3, 4], ids)
+
+    def test_get_address_generator_reads_pages_lazily(self):
+        handler = DatabaseHandler('unit_test_db.sqlite3')
+        for i in range(1, 5):
+            handler.add_address(MapLocation(latitude=i, longitude=i, id=i))
+        address_generator = handler.get_address_generator(page_size=2)
+        next(address_generator)
+        handler.add_route(address=3, stop=1, distance=1, time=1)
+        self.assertEqual([2, 4],
+                         [address.id for address in address_generator])
+
+    def test_get_address_generator_with_dedicated_connection(self):
+        handler = DatabaseHandler('unit_test_db.sqlite3')
+        handler.add_address(MapLocation(latitude=1, longitude=1, id=1))
+        handler.add_address(MapLocation(latitude=2, longitude=2, id=2))
+        handler.add_route(address=1, stop=1, distance=1, time=1)
+        addresses = list(handler.get_address_generator(
+            dedicated_connection=True))
+        self.assertEqual([MapLocation(latitude=2, longitude=2, id=2)],
+                         addresses)
+
+    def test_get_address_generator_indexes_routes_by_address(self):
+        handler = DatabaseHandler('unit_test_db.sqlite3')
+        list(handler.get_address_generator())
+        self.assertEqual(['routes_address_id_stop_id'],
+                         self._get_routes_indexes(handler))
+
+    def test_get_address_generator_uses_performance_index(self):
+        handler = DatabaseHandler('unit_test_db.sqlite3', performance=True)
+        list(handler.get_address_generator())
+        self.assertNotIn('routes_address_id_stop_id',
+                         self._get_routes_indexes(handler))
+
+    def _get_routes_indexes(self, handler):
+        c = handler.conn.cursor()
+        c.execute("SELECT name FROM sqlite_master WHERE "
+                  "type='index' AND tbl_name='routes' ORDER BY name")
+        indexes = [row[0] for row in c.fetchall()]
+        c.close()
+        return indexes
+
+    # work queue tests
+    def test_populate_address_queue_marks_addresses_with_routes_done(self):
+        handler = DatabaseHandler('unit_test_db.sqlite3')
+        handler.add_address(MapLocation(latitude=1, longitude=1, id=1))
+        handler.add_address(MapLocation(latitude=2, longitude=2, id=2))
+        handler.add_route(address=1, stop=1, distance=1, time=1)
+        self.assertEqual(2, handler.populate_address_queue())
+        self.assertEqual({'done': 1, 'pending': 1},
+                         handler.address_queue_counts())
+
+    def test_populate_address_queue_only_adds_new_addresses(self):
+        handler = DatabaseHandler('unit_test_db.sqlite3')
+        handler.add_address(MapLocation(latitude=1, longitude=1, id=1))
+        handler.populate_address_queue()
+        handler.add_address(MapLocation(latitude=2, longitude=2, id=2))
+        self.assertEqual(1, handler.populate_address_queue())
+
+    def test_claim_addresses_returns_distinct_batches(self):
+        handler = DatabaseHandler('unit_test_db.sqlite3')
+        for i in range(1, 6):
+            handler.add_address(MapLocation(latitude=i, longitude=i, id=i))
+        handler.populate_address_queue()
+        first = handler.claim_addresses(3, worker_id='a')
+        second = handler.claim_addresses(3, worker_id='b')
+        self.assertEqual([1, 2, 3], [address.id for address in first])
+        self.assertEqual([4, 5], [address.id for address in second])
+        self.assertEqual([], handler.claim_addresses(3))
+
+    def test_claim_addresses_shared_across_connections(self):
+        handler = DatabaseHandler('unit_test_db.sqlite3')
+        for i in range(1, 5):
+            handler.add_address(MapLocation(latitude=i, longitude=i, id=i))
+        handler.populate_address_queue()
+        other = DatabaseHandler('unit_test_db.sqlite3')
+        first = handler.claim_addresses(2)
+        second = other.claim_addresses(2)
+        self.assertEqual([], [address.id for address in first
+                              if address in second])
+        self.assertEqual(4, len(first) + len(second))
+
+    def test_claim_addresses_retries_failed_until_max_attempts(self):
+        handler = DatabaseHandler('unit_test_db.sqlite3')
+        handler.add_address(MapLocation(latitude=1, longitude=1, id=1))
+        handler.populate_address_queue()
+        for _ in range(2):
+            self.assertEqual(1, len(handler.claim_addresses(1,
+                                                            max_attempts=2)))
+            handler.mark_address_failed(1, 'error')
+        self.assertEqual([], handler.claim_addresses(1, max_attempts=2))
+        self.assertEqual({'failed': 1}, handler.address_queue_counts())
+
+    def test_claim_addresses_doesnt_reclaim_done_addresses(self):
+        handler = DatabaseHandler('unit_test_db.sqlite3')
+        handler.add_address(MapLocation(latitude=1, longitude=1, id=1))
+        handler.populate_address_queue()
+        handler.claim_addresses(1)
+        handler.mark_address_done(1)
+        self.assertEqual([], handler.claim_addresses(1))
+
+    @patch('time.time')
+    def test_claim_addresses_reclaims_stale_claims(self, mock_time):
+        handler = DatabaseHandler('unit_test_db.sqlite3')
+        handler.add_address(MapLocation(latitude=1, longitude=1, id=1))
+        handler.populate_address_queue()
+        mock_time.return_value = 1000
+        handler.claim_addresses(1, stale_after=60)
+        mock_time.return_value = 1030
+        self.assertEqual([], handler.claim_addresses(1, stale_after=60))
+        mock_time.return_value = 1061
+        self.assertEqual(1, len(handler.claim_addresses(1, stale_after=60)))
+
+    @patch('time.time')
+    def test_claim_addresses_fails_stale_claims_at_max_attempts(self,
+                                                                mock_time):
+        handler = DatabaseHandler('unit_test_db.sqlite3')
+        handler.add_address(MapLocation(latitude=1, longitude=1, id=1))
+        handler.populate_address_queue()
+        for attempt in range(2):
+            mock_time.return_value = 1000 + 100 * attempt
+            self.assertEqual(1, len(handler.claim_addresses(
+                1, max_attempts=2, stale_after=60)))
+        mock_time.return_value = 1300
+        self.assertEqual([], handler.claim_addresses(1, max_attempts=2,
+                                                     stale_after=60))
+        self.assertEqual({'failed': 1}, handler.address_queue_counts())
+
+    def test_populate_address_queue_only_adds_address_index(self):
+        handler = DatabaseHandler('unit_test_db.sqlite3')
+        handler.populate_address_queue()
+        self.assertEqual(['routes_address_id_stop_id'],
+                         self._get_routes_indexes(handler))
+
+    def test_get_route_stop_ids_indexes_routes_by_address(self):
+        handler = DatabaseHandler('unit_test_db.sqlite3')
+        handler.get_route_stop_ids(1)
+        self.assertEqual(['routes_address_id_stop_id'],
+                         self._get_routes_indexes(handler))
+
+    def test_get_route_stop_ids_returns_stops_with_routes(self):
+        handler = DatabaseHandler('unit_test_db.sqlite3')
+        handler.add_routes([(1, 5, 1, 1), (1, 6, 1, 1), (2, 7, 1, 1)])
+        self.assertEqual(set([5, 6]), handler.get_route_stop_ids(1))
+
+    # sharding tests
+    def test_get_id_ranges_splits_addresses_evenly(self):
+        handler = DatabaseHandler('unit_test_db.sqlite3')
+        for i in [2, 3, 5, 8, 13, 21, 34]:
+            handler.add_address(MapLocation(latitude=1, longitude=1, id=i))
+        self.assertEqual([(2, 3), (5, 8), (13, 34)],
+                         handler.get_id_ranges(3))
+
+    def test_get_id_ranges_with_fewer_addresses_than_ranges(self):
+        handler = DatabaseHandler('unit_test_db.sqlite3')
+        handler.add_address(MapLocation(latitude=1, longitude=1, id=4))
+        self.assertEqual([(4, 4)], handler.get_id_ranges(3))
+
+    def test_export_shard_copies_addresses_in_range_and_routes(self):
+        handler = DatabaseHandler('unit_test_db.sqlite3')
+        for i in range(1, 5):
+            handler.add_address(MapLocation(latitude=i, longitude=i, id=i))
+        handler.add_routes([(2, 1, 10, 10), (4, 1, 10, 10)])
+        handler.export_shard('unit_test_shard.sqlite3', 2, 3)
+        shard = DatabaseHandler('unit_test_shard.sqlite3')
+        c = shard.conn.cursor()
+        c.execute("SELECT id FROM addresses")
+        self.assertEqual([(2,), (3,)], c.fetchall())
+        c.execute("SELECT address_id FROM routes")
+        self.assertEqual([(2,)], c.fetchall())
+
+    def test_merge_routes_skips_existing_routes(self):
+        handler = DatabaseHandler('unit_test_db.sqlite3')
+        handler.add_routes([(1, 1, 10, 10)])
+        shard = DatabaseHandler('unit_test_shard.sqlite3')
+        shard.add_routes([(1, 1, 10, 10), (2, 1, 20, 20)])
+        self.assertEqual(1, handler.merge_routes('unit_test_shard.sqlite3'))
+        c = handler.conn.cursor()
+        c.execute("SELECT address_id, stop_id, distance FROM routes")
+        self.assertEqual([(1, 1, 10), (2, 1, 20)], c.fetchall())
+
+    def test_merge_routes_merges_many_routes(self):
+        handler = DatabaseHandler('unit_test_db.sqlite3')
+        handler.add_routes([(i, i % 7, 1, 1) for i in range(20000)])
+        shard = DatabaseHandler('unit_test_shard.sqlite3')
+        # half of the shard's routes are already in the main database
+        shard.add_routes([(i, i % 7, 2, 2) for i in range(10000, 30000)])
+        self.assertEqual(10000,
+                         handler.merge_routes('unit_test_shard.sqlite3'))
+        c = handler.conn.cursor()
+        c.execute("SELECT COUNT(*), SUM(distance) FROM routes")
+        self.assertEqual((30000, 40000), c.fetchone())
+        self.assertIn('routes_address_id_stop_id',
+                      self._get_routes_indexes(handler))
+
     # get_all_stops tests
     @patch('DatabaseHandler.DatabaseHandler.initialize_db')
     def test_get_all_stops_returns_list_of_MapLocations(self,
@@ -424,3 +809,125 @@ class TestDatabaseHandler(unittest.TestCase):
         self.assertEqual(1, df.ix[0, 'distance'],
                          "distance for the first row should be 1 "
                          "since that is the shortest route distance")
+
+    def _add_closest_stops_data(self, handler):
+        handler.add_address(MapLocation(latitude=1, longitude=1, id=1))
+        handler.add_address(MapLocation(latitude=1, longitude=1, id=2))
+        handler.conn.executemany(
+            "INSERT INTO stops (id, stop_id, stop_name, latitude, longitude) "
+            "VALUES (?, ?, ?, ?, ?)",
+            [(3, 3, 'a', 3, 3), (4, 4, 'b', 4, 4), (5, 5, 'c', 5, 5)])
+        handler.add_routes([(1, 3, 20, 200), (1, 4, 10, 100),
+                            (2, 3, 30, 300), (1, 5, 10, 110),
+                            (2, 5, 5, 50)])
+
+    def test_routes_dataframe_closest_stops_groups_by_address_id(self):
+        handler = DatabaseHandler('unit_test_db.sqlite3')
+        self._add_closest_stops_data(handler)
+        df = handler.routes_dataframe_closest_stops()
+        self.assertEqual(['address_latitude', 'address_longitude',
+                          'stop_latitude', 'stop_longitude', 'distance',
+                          'time'], list(df.columns))
+        # both addresses share coordinates, and address 1 has a tie
+        self.assertEqual([(4, 10, 100), (5, 10, 110), (5, 5, 50)],
+                         list(zip(df['stop_latitude'], df['distance'],
+                                  df['time'])))
+
+    def test_routes_dataframe_closest_stops_doesnt_add_indexes(self):
+        handler = DatabaseHandler('unit_test_db.sqlite3')
+        self._add_closest_stops_data(handler)
+        handler.routes_dataframe_closest_stops()
+        c = handler.conn.cursor()
+        c.execute("SELECT name FROM sqlite_master WHERE "
+                  "type='index' AND tbl_name='routes'")
+        self.assertEqual([], c.fetchall())
+
+    def test_enable_closest_routes_backfills_and_tracks_new_routes(self):
+        handler = DatabaseHandler('unit_test_db.sqlite3')
+        self._add_closest_stops_data(handler)
+        handler.enable_closest_routes()
+        self.assertEqual([2, 4, 5], sorted(
+            row[0] for row in handler.conn.execute(
+                "SELECT route_id FROM closest_routes")))
+        handler.add_route(address=1, stop=3, distance=7, time=70)
+        handler.add_route(address=2, stop=4, distance=5, time=55)
+        handler.add_route(address=2, stop=3, distance=6, time=60)
+        df = handler.routes_dataframe_closest_stops()
+        self.assertEqual([(5, 5, 50), (3, 7, 70), (4, 5, 55)],
+                         list(zip(df['stop_latitude'], df['distance'],
+                                  df['time'])))
+
+    def test_enable_closest_routes_is_used_by_new_handlers(self):
+        handler = DatabaseHandler('unit_test_db.sqlite3')
+        self._add_closest_stops_data(handler)
+        handler.enable_closest_routes()
+        handler.conn.execute("DELETE FROM closest_routes WHERE route_id = 4")
+        handler.conn.commit()
+        handler.conn.close()
+        handler = DatabaseHandler('unit_test_db.sqlite3')
+        self.assertEqual(2, len(handler.routes_dataframe_closest_stops()))
+        handler.rebuild_closest_routes()
+        self.assertEqual(3, len(handler.routes_dataframe_closest_stops()))
+
+    # export_routes tests
+    def test_export_routes_writes_csv_in_chunks(self):
+        handler = DatabaseHandler('unit_test_db.sqlite3')
+        self._add_closest_stops_data(handler)
+        self.assertEqual(5, handler.export_routes('test_file.csv',
+                                                  chunksize=2))
+        df = pd.read_csv('test_file.csv')
+        self.assertEqual(['address_latitude', 'address_longitude',
+                          'stop_latitude', 'stop_longitude', 'distance',
+                          'time'], list(df.columns))
+        self.assertEqual([200, 100, 300, 110, 50], list(df['time']))
+
+    def test_export_routes_writes_compressed_closest_routes(self):
+        handler = DatabaseHandler('unit_test_db.sqlite3')
+        self._add_closest_stops_data(handler)
+        self.assertEqual(3, handler.export_routes('test_file.csv.gz',
+                                                  closest_stops_only=True,
+                                                  chunksize=2))
+        with gzip.open('test_file.csv.gz') as csv_file:
+            df = pd.read_csv(csv_file)
+        self.assertEqual([100, 110, 50], list(df['time']))
+
+    def test_export_routes_writes_header_without_routes(self):
+        handler = DatabaseHandler('unit_test_db.sqlite3')
+        self.assertEqual(0, handler.export_routes('test_file.csv'))
+        self.assertEqual(0, len(pd.read_csv('test_file.csv')))
+
+    def test_export_routes_writes_geojson_points_with_numeric_time(self):
+        handler = DatabaseHandler('unit_test_db.sqlite3')
+        self._add_closest_stops_data(handler)
+        handler.export_routes('test_file.geojson', closest_stops_only=True,
+                              chunksize=2)
+        with open('test_file.geojson') as geojson_file:
+            geojson = json.load(geojson_file)
+        self.assertEqual(3, len(geojson['features']))
+        feature = geojson['features'][0]
+        self.assertEqual({'type': 'Point', 'coordinates': [1, 1]},
+                         feature['geometry'])
+        self.assertEqual({'stop_latitude': 4, 'stop_longitude': 4,
+                          'distance': 10, 'time': 100},
+                         feature['properties'])
+        self.assertIsInstance(feature['properties']['time'], float)
+
+    def test_export_routes_parquet_requires_pyarrow(self):
+        handler = DatabaseHandler('unit_test_db.sqlite3')
+        with patch.dict(sys.modules, {'pyarrow': None}):
+            self.assertRaises(ImportError, handler.export_routes,
+                              'test_file.parquet')
+
+    def test_export_routes_rejects_unknown_format(self):
+        handler = DatabaseHandler('unit_test_db.sqlite3')
+        self.assertRaises(ValueError, handler.export_routes, 'test_file.csv',
+                          file_format='xlsx')
+
+    def test_output_routes_with_chunksize_streams(self):
+        handler = DatabaseHandler('unit_test_db.sqlite3')
+        handler.export_routes = Mock()
+        handler.routes_dataframe = Mock()
+        handler.output_routes('test_file.csv', chunksize=10)
+        handler.export_routes.assert_called_once_with(
+            'test_file.csv', False, chunksize=10, file_format=None)
+        self.assertEqual(0, handler.routes_dataframe.call_count)
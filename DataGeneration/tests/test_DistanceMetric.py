@@ -0,0 +1,61 @@
+import unittest
+import numpy as np
+from DataGeneration.DistanceMetric import EuclideanMetric
+from DataGeneration.DistanceMetric import EquirectangularMetric
+from DataGeneration.DistanceMetric import HaversineMetric
+from DataGeneration.DistanceMetric import get_metric
+
+
+class TestDistanceMetric(unittest.TestCase):
+
+    # get_metric tests
+    def test_get_metric_returns_metric_by_name(self):
+        self.assertIsInstance(get_metric('haversine'), HaversineMetric)
+
+    def test_get_metric_returns_metric_instance_unchanged(self):
+        metric = EquirectangularMetric(reference_latitude=10)
+        self.assertIs(metric, get_metric(metric))
+
+    def test_get_metric_errors_on_unknown_metric(self):
+        self.assertRaises(ValueError, get_metric, 'manhattan')
+
+    # distance tests
+    def test_euclidean_distance_is_in_degrees(self):
+        self.assertAlmostEqual(5, EuclideanMetric().distance(0, 0, 3, 4))
+
+    def test_haversine_distance_of_one_degree_latitude(self):
+        distance = HaversineMetric().distance(41, -81.5, 42, -81.5)
+        self.assertAlmostEqual(111195, distance, delta=1)
+
+    def test_haversine_distance_scales_longitude_by_latitude(self):
+        distance = HaversineMetric().distance(41.5, -82, 41.5, -81)
+        self.assertAlmostEqual(111195 * np.cos(np.radians(41.5)), distance,
+                               delta=10)
+
+    def test_equirectangular_distance_close_to_haversine(self):
+        args = (41.4, -81.8, 41.55, -81.55)
+        self.assertAlmostEqual(HaversineMetric().distance(*args),
+                               EquirectangularMetric().distance(*args),
+                               delta=25)
+
+    def test_distance_is_vectorized(self):
+        distances = HaversineMetric().distance(np.array([41, 41]),
+                                               np.array([-81, -81]),
+                                               np.array([41, 42]),
+                                               np.array([-81, -81]))
+        self.assertEqual((2,), distances.shape)
+        self.assertEqual(0, distances[0])
+
+    # project tests
+    def test_haversine_projection_preserves_distance_order(self):
+        metric = HaversineMetric()
+        points = metric.project([41.5, 42.4, 41.5], [-81.5, -81.5, -80.4])
+        chords = np.sqrt(((points[1:] - points[0]) ** 2).sum(axis=1))
+        distances = metric.distance(41.5, -81.5, [42.4, 41.5], [-81.5, -80.4])
+        self.assertEqual(list(np.argsort(distances)), list(np.argsort(chords)))
+
+    def test_equirectangular_projection_matches_distance(self):
+        metric = EquirectangularMetric()
+        points = metric.project([41.4, 41.55], [-81.8, -81.55])
+        self.assertAlmostEqual(metric.distance(41.4, -81.8, 41.55, -81.55),
+                               np.sqrt(((points[1] - points[0]) ** 2).sum()))
@@ -0,0 +1,103 @@
+import json
+import os
+import unittest
+import numpy as np
+from mock import Mock
+from DataGeneration.GridMask import GridMask
+from DataGeneration.MapLocation import MapLocation
+from DataGeneration.UniformMapGenerator import UniformMapGenerator
+
+
+SQUARE_WITH_HOLE = {
+    "type": "Polygon",
+    "coordinates": [
+        [[0, 0], [10, 0], [10, 10], [0, 10], [0, 0]],
+        [[4, 4], [6, 4], [6, 6], [4, 6], [4, 4]]
+    ]
+}
+
+
+class TestGridMask(unittest.TestCase):
+
+    def tearDown(self):
+        if os.path.exists('unit_test_mask.geojson'):
+            os.remove('unit_test_mask.geojson')
+
+    # polygon tests
+    def test_contains_respects_polygon_and_hole(self):
+        mask = GridMask(polygon=SQUARE_WITH_HOLE)
+        # latitude is the second GeoJSON coordinate
+        result = mask.contains([1, 5, 11, 5, 9.5], [1, 5, 5, 11, 2])
+        self.assertEqual([True, False, False, False, True], result.tolist())
+
+    def test_contains_multipolygon_feature_collection(self):
+        triangle = {"type": "Polygon",
+                    "coordinates": [[[20, 20], [30, 20], [20, 30]]]}
+        mask = GridMask(polygon={
+            "type": "FeatureCollection",
+            "features": [
+                {"type": "Feature", "geometry": {
+                    "type": "MultiPolygon",
+                    "coordinates": [SQUARE_WITH_HOLE["coordinates"]]}},
+                {"type": "Feature", "geometry": triangle}]})
+        result = mask.contains([1, 21, 29, 15], [1, 21, 29, 15])
+        self.assertEqual([True, True, False, False], result.tolist())
+
+    def test_unsupported_geometry_raises(self):
+        with self.assertRaises(ValueError):
+            GridMask(polygon={"type": "Point", "coordinates": [0, 0]})
+
+    def test_from_geojson_file(self):
+        with open('unit_test_mask.geojson', 'w') as geojson_file:
+            json.dump(SQUARE_WITH_HOLE, geojson_file)
+        mask = GridMask.from_geojson_file('unit_test_mask.geojson')
+        self.assertEqual([True, False], mask.contains([1, 5], [1, 5]).tolist())
+
+    # stop distance tests
+    def test_contains_drops_points_far_from_stops(self):
+        stops = [MapLocation(41.5, -81.7, 1), MapLocation(41.4, -81.6, 2)]
+        mask = GridMask(stops=stops, max_stop_distance=500)
+        # 0.004 degrees of latitude is about 445 meters
+        result = mask.contains([41.504, 41.406, 41.45, 45.0],
+                               [-81.7, -81.6, -81.65, -81.7])
+        self.assertEqual([True, False, False, False], result.tolist())
+
+    def test_contains_matches_brute_force_stop_distance(self):
+        random = np.random.RandomState(0)
+        stops = [MapLocation(lat, lng, i) for i, (lat, lng) in enumerate(
+            zip(random.uniform(41.3, 41.6, 50),
+                random.uniform(-81.9, -81.5, 50)))]
+        latitudes = random.uniform(41.2, 41.7, 2000)
+        longitudes = random.uniform(-82.0, -81.4, 2000)
+        mask = GridMask(stops=stops, max_stop_distance=1500)
+        mask.CHUNK_SIZE = 64
+        distances = mask.metric.distance(
+            latitudes[:, np.newaxis], longitudes[:, np.newaxis],
+            np.array([[stop.latitude for stop in stops]]),
+            np.array([[stop.longitude for stop in stops]]))
+        expected = distances.min(axis=1) <= 1500
+        self.assertTrue(expected.any())
+        self.assertEqual(expected.tolist(),
+                         mask.contains(latitudes, longitudes).tolist())
+
+    def test_max_stop_distance_requires_stops(self):
+        with self.assertRaises(ValueError):
+            GridMask(max_stop_distance=500)
+
+    def test_filter_combines_polygon_and_stops(self):
+        mask = GridMask(polygon=SQUARE_WITH_HOLE,
+                        stops=[MapLocation(1, 1, 1)],
+                        max_stop_distance=200000)
+        block = np.array([[1, 1], [1, 2.5], [3, 1], [5, 5]])
+        self.assertEqual([[1, 1], [1, 2.5]], mask.filter(block).tolist())
+
+    # UniformMapGenerator integration
+    def test_add_uniform_map_to_database_applies_mask(self):
+        handler = Mock()
+        count = UniformMapGenerator().add_uniform_map_to_database(
+            handler, 0, 10, 0, 10, 1, 1, mask=GridMask(SQUARE_WITH_HOLE))
+        added = [point for call in handler.add_addresses.call_args_list
+                 for point in call[0][0]]
+        self.assertEqual(count, len(added))
+        self.assertNotIn([5.0, 5.0], added)
+        self.assertIn([1.0, 1.0], added)
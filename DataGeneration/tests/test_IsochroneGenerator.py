@@ -0,0 +1,107 @@
+import json
+import os
+import unittest
+import numpy as np
+import pandas as pd
+from DataGeneration.IsochroneGenerator import IsochroneGenerator
+
+
+class TestIsochroneGenerator(unittest.TestCase):
+
+    def setUp(self):
+        self.generator = IsochroneGenerator(breaks=[0, 1, 2], lat_res=1,
+                                            lng_res=1, fill_distance=0)
+
+    def tearDown(self):
+        if os.path.exists('unit_test_isochrones.geojson'):
+            os.remove('unit_test_isochrones.geojson')
+
+    def test_init_rejects_unordered_breaks(self):
+        with self.assertRaises(ValueError):
+            IsochroneGenerator(breaks=[600, 300])
+
+    # rasterize tests
+    def test_rasterize_averages_values_per_cell(self):
+        grid, origin = self.generator.rasterize([10, 10.2, 12, 10],
+                                                [20, 19.9, 21, 21],
+                                                [1, 3, 5, 7])
+        self.assertEqual((10, 19.9), origin)
+        self.assertEqual((3, 2), grid.shape)
+        self.assertEqual(2, grid[0, 0])
+        self.assertEqual(7, grid[0, 1])
+        self.assertEqual(5, grid[2, 1])
+        self.assertTrue(np.isnan(grid[1]).all())
+
+    # fill tests
+    def test_fill_only_reaches_fill_distance(self):
+        generator = IsochroneGenerator(fill_distance=1)
+        grid = np.full((1, 4), np.nan)
+        grid[0, 0] = 4
+        filled = generator.fill(grid)
+        self.assertEqual(4, filled[0, 1])
+        self.assertTrue(np.isnan(filled[0, 2:]).all())
+        self.assertTrue(np.isnan(grid[0, 1]))
+
+    def test_fill_averages_neighbors(self):
+        generator = IsochroneGenerator(fill_distance=1)
+        grid = np.array([[2, np.nan, 4]])
+        self.assertEqual(3, generator.fill(grid)[0, 1])
+
+    # trace_polygons tests
+    def test_trace_polygons_outer_ring_is_counterclockwise(self):
+        mask = np.array([[True, True], [True, True]])
+        self.assertEqual([[[[-0.5, -0.5], [1.5, -0.5], [1.5, 1.5],
+                            [-0.5, 1.5], [-0.5, -0.5]]]],
+                         self.generator.trace_polygons(mask, (0, 0)))
+
+    def test_trace_polygons_assigns_holes(self):
+        mask = np.ones((5, 5), dtype=bool)
+        mask[1:4, 1:4] = False
+        mask[2, 2] = True
+        polygons = self.generator.trace_polygons(mask, (0, 0))
+        self.assertEqual(2, len(polygons))
+        frame = [polygon for polygon in polygons if len(polygon) == 2][0]
+        island = [polygon for polygon in polygons if len(polygon) == 1][0]
+        self.assertEqual([[1.5, 1.5], [2.5, 1.5], [2.5, 2.5], [1.5, 2.5],
+                          [1.5, 1.5]], island[0])
+        hole = frame[1]
+        self.assertEqual(hole[0], hole[-1])
+        self.assertEqual(sorted([[0.5, 0.5], [0.5, 3.5], [3.5, 3.5],
+                                 [3.5, 0.5]]), sorted(hole[:-1]))
+        # the hole runs clockwise
+        area = sum(x1 * y2 - x2 * y1
+                   for (x1, y1), (x2, y2) in zip(hole[:-1], hole[1:]))
+        self.assertLess(area, 0)
+
+    def test_trace_polygons_splits_cells_touching_at_corner(self):
+        mask = np.array([[True, False], [False, True]])
+        polygons = self.generator.trace_polygons(mask, (0, 0))
+        self.assertEqual(2, len(polygons))
+        self.assertEqual([5, 5], [len(polygon[0]) for polygon in polygons])
+
+    # get_isochrones tests
+    def test_get_isochrones_one_feature_per_band(self):
+        df = pd.DataFrame({'address_latitude': [0, 0, 0, 5],
+                           'address_longitude': [0, 1, 2, 5],
+                           'time': [0.5, 0.5, 1.5, 9]})
+        isochrones = self.generator.get_isochrones(df)
+        features = isochrones["features"]
+        self.assertEqual([{"min_time": 0, "max_time": 1},
+                          {"min_time": 1, "max_time": 2}],
+                         [feature["properties"] for feature in features])
+        self.assertEqual([[[[-0.5, -0.5], [1.5, -0.5], [1.5, 0.5],
+                            [-0.5, 0.5], [-0.5, -0.5]]]],
+                         features[0]["geometry"]["coordinates"])
+        self.assertEqual(1, len(features[1]["geometry"]["coordinates"]))
+        self.assertEqual(set(['rasterize', 'fill', 'contour']),
+                         set(self.generator.timings))
+
+    def test_write_geojson(self):
+        df = pd.DataFrame({'address_latitude': [41.5], 'address_longitude':
+                           [-81.7], 'time': [0.5]})
+        self.generator.write_geojson(df, 'unit_test_isochrones.geojson')
+        with open('unit_test_isochrones.geojson') as geojson_file:
+            isochrones = json.load(geojson_file)
+        self.assertEqual("FeatureCollection", isochrones["type"])
+        self.assertEqual(1, len(isochrones["features"][0]["geometry"]
+                                ["coordinates"]))
@@ -0,0 +1,135 @@
+import io
+import unittest
+from mock import Mock
+from DataGeneration.DataGenerator import DataGenerator
+from DataGeneration.LocalRoutingWrapper import LocalRoutingWrapper, \
+    LocalRoutingError
+from DataGeneration.MapLocation import MapLocation
+from DataGeneration.StreetGraph import StreetGraph
+
+OSM = b"""<?xml version='1.0' encoding='UTF-8'?>
+<osm version="0.6">
+  <node id="1" lat="41.5" lon="-81.700"/>
+  <node id="2" lat="41.5" lon="-81.699"/>
+  <node id="3" lat="41.5" lon="-81.698"/>
+  <node id="4" lat="41.501" lon="-81.698"/>
+  <way id="10">
+    <nd ref="1"/><nd ref="2"/><nd ref="3"/>
+    <tag k="highway" v="residential"/>
+    <tag k="oneway" v="yes"/>
+  </way>
+  <way id="11">
+    <nd ref="1"/><nd ref="4"/>
+    <tag k="highway" v="primary"/>
+  </way>
+</osm>
+"""
+
+
+class TestLocalRoutingWrapper(unittest.TestCase):
+
+    def setUp(self):
+        self.graph = StreetGraph.from_osm_file(io.BytesIO(OSM))
+        self.wrapper = LocalRoutingWrapper(self.graph)
+
+    # get_distance_from_api tests
+    def test_get_distance_from_api_snaps_to_closest_nodes(self):
+        origin = MapLocation(41.5001, -81.7001)
+        destination = MapLocation(41.4999, -81.6981)
+        result = self.wrapper.get_distance_from_api(origin, destination,
+                                                    'walking')
+        distance, time = self.graph.shortest_path(
+            self.graph.node_indexes['1'], self.graph.node_indexes['3'],
+            'walking')
+        self.assertEqual({"distance": distance, "time": time}, result)
+
+    def test_get_distance_from_api_raises_without_route(self):
+        with self.assertRaises(LocalRoutingError):
+            self.wrapper.get_distance_from_api(MapLocation(41.5, -81.698),
+                                               MapLocation(41.5, -81.7),
+                                               'driving')
+
+    def test_get_distance_from_api_raises_far_from_graph(self):
+        with self.assertRaises(LocalRoutingError):
+            self.wrapper.get_distance_from_api(MapLocation(41.6, -81.6),
+                                               MapLocation(41.5, -81.7))
+
+    def test_get_distance_from_api_raises_without_graph(self):
+        with self.assertRaises(UnboundLocalError):
+            LocalRoutingWrapper().get_distance_from_api(
+                MapLocation(41.5, -81.7), MapLocation(41.5, -81.698))
+
+    # get_distance_matrix tests
+    def test_get_distance_matrix_matches_single_routes(self):
+        origins = [MapLocation(41.5, -81.7), MapLocation(41.5, -81.698)]
+        destinations = [MapLocation(41.5, -81.699), MapLocation(41.501,
+                                                                -81.698)]
+        matrix = self.wrapper.get_distance_matrix(origins, destinations,
+                                                  'driving')
+        self.assertEqual(
+            self.wrapper.get_distance_from_api(origins[0], destinations[0],
+                                               'driving'), matrix[0][0])
+        self.assertIsNone(matrix[1][0])
+        self.assertEqual(
+            self.wrapper.get_distance_from_api(origins[0], destinations[1],
+                                               'driving')["distance"],
+            matrix[0][1]["distance"])
+
+    # get_closest_stop_routes tests
+    def test_get_closest_stop_routes_picks_closest_stop(self):
+        addresses = [MapLocation(41.5009, -81.698, 1),
+                     MapLocation(41.5, -81.699, 2)]
+        stops = [MapLocation(41.501, -81.698, 3), MapLocation(41.5, -81.698, 4)]
+        routes = list(self.wrapper.get_closest_stop_routes(addresses, stops,
+                                                           'walking'))
+        self.assertEqual([addresses[0], addresses[1]],
+                         [address for address, _, _ in routes])
+        self.assertEqual([stops[0], stops[1]], [stop for _, stop, _ in routes])
+        for address, stop, result in routes:
+            self.assertEqual(self.wrapper.get_distance_from_api(
+                address, stop, 'walking'), result)
+
+    def test_get_closest_stop_routes_follows_oneway_streets(self):
+        # node 3 can only be driven to, not from
+        address = MapLocation(41.5, -81.698, 1)
+        stops = [MapLocation(41.5, -81.7, 2)]
+        routes = list(self.wrapper.get_closest_stop_routes([address], stops,
+                                                           'driving'))
+        self.assertEqual([(address, None, None)], routes)
+
+    def test_get_closest_stop_routes_skips_unsnappable_locations(self):
+        address = MapLocation(41.6, -81.6, 1)
+        stops = [MapLocation(41.6, -81.6, 2), MapLocation(41.5, -81.7, 3)]
+        routes = list(self.wrapper.get_closest_stop_routes([address], stops))
+        self.assertEqual([(address, None, None)], routes)
+
+    def test_begin_closest_stops_writes_routes_in_bulk(self):
+        handler = Mock()
+        handler.get_address_generator.return_value = [
+            MapLocation(41.5, -81.7, 1), MapLocation(41.6, -81.6, 2),
+            MapLocation(41.5, -81.699, 3)]
+        generator = DataGenerator(handler=handler,
+                                  stops=[MapLocation(41.5, -81.698, 4)],
+                                  wrapper=self.wrapper)
+        count = generator.begin_closest_stops(verbose=False,
+                                              write_batch_size=10)
+        self.assertEqual(2, count)
+        self.assertEqual(1, handler.add_routes.call_count)
+        routes = handler.add_routes.call_args[0][0]
+        self.assertEqual([(1, 4), (3, 4)],
+                         [(address_id, stop_id)
+                          for address_id, stop_id, _, _ in routes])
+
+    # DataGenerator integration
+    def test_data_generator_uses_local_routes(self):
+        handler = Mock()
+        handler.get_address_generator.return_value = [
+            MapLocation(41.5, -81.7, 1)]
+        generator = DataGenerator(handler=handler,
+                                  stops=[MapLocation(41.5, -81.698, 2)],
+                                  wrapper=self.wrapper)
+        generator.begin(stops_per_address=1, verbose=False)
+        address_id, stop_id, distance, time = handler.add_route.call_args[0]
+        self.assertEqual((1, 2), (address_id, stop_id))
+        self.assertAlmostEqual(self.graph.distance(0, 1) +
+                               self.graph.distance(1, 2), distance)
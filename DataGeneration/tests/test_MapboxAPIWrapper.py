@@ -1,12 +1,20 @@
 import unittest
 from mock import patch, mock_open, mock, Mock
+import json
+import threading
 import requests
 from DataGeneration.MapboxAPIWrapper import MapboxAPIWrapper
 from DataGeneration.MapLocation import MapLocation
 from DataGeneration.MapboxAPIWrapper import MapboxAPIError
+from DataGeneration.RateLimiter import RateLimiter
 
 
 from sys import version_info
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
 if version_info.major == 2:
     import __builtin__ as builtins
 else:
@@ -70,6 +78,36 @@ class TestMapboxAPIWrapper(unittest.TestCase):
         wrapper = MapboxAPIWrapper()
         self.assertEqual(wrapper.key, "")
 
+    def test_map_api_wrapper_creates_session(self):
+        wrapper = MapboxAPIWrapper()
+        self.assertIsInstance(wrapper.session, requests.Session)
+
+    def test_map_api_wrapper_session_pool_uses_pool_size(self):
+        wrapper = MapboxAPIWrapper(pool_size=16)
+        adapter = wrapper.session.get_adapter('https://api.mapbox.com')
+        self.assertEqual(16, adapter._pool_maxsize)
+
+    def test_map_api_wrapper_session_pools_http(self):
+        wrapper = MapboxAPIWrapper(pool_size=16)
+        adapter = wrapper.session.get_adapter('http://127.0.0.1')
+        self.assertEqual(16, adapter._pool_maxsize)
+
+    def test_map_api_wrapper_accepts_base_url(self):
+        wrapper = MapboxAPIWrapper(base_url='http://localhost:8000/')
+        wrapper.key = 'api_key'
+        self.assertTrue(wrapper._construct_request_string(
+            MapLocation(1, 1), MapLocation(2, 2)).startswith(
+                'http://localhost:8000/v4/directions/mapbox.walking/'))
+
+    def test_map_api_wrapper_accepts_session(self):
+        session = requests.Session()
+        wrapper = MapboxAPIWrapper(session=session)
+        self.assertIs(session, wrapper.session)
+
+    def test_map_api_wrapper_accepts_timeout(self):
+        wrapper = MapboxAPIWrapper(timeout=3)
+        self.assertEqual(3, wrapper.timeout)
+
     # load_api_key_from_file tests
     @patch('MapboxAPIWrapper.os.path')
     def test_mapbox_load_api_key_checks_for_file_existance(self, mock_os_path):
@@ -135,9 +173,91 @@ class TestMapboxAPIWrapper(unittest.TestCase):
                          'incorrect request string returned')
 
 
+    # _construct_matrix_request_string tests
+    def test_construct_matrix_request_string_produces_correct_output(self):
+        origins = [MapLocation(latitude=50.032, longitude=40.54453)]
+        destinations = [MapLocation(latitude=51.0345, longitude=41.2314),
+                        MapLocation(latitude=52.5, longitude=42.5)]
+        self.wrapper.key = 'api_key'
+        self.assertEqual('https://api.mapbox.com/directions-matrix/v1/mapbox/'
+                         'walking/40.54453,50.032;41.2314,51.0345;42.5,52.5'
+                         '?sources=0&destinations=1;2&annotations='
+                         'distance,duration&access_token=api_key',
+                         self.wrapper._construct_matrix_request_string(
+                             origins, destinations),
+                         'incorrect request string returned')
+
+    def test_construct_matrix_request_string_errors_if_empty_key(self):
+        with self.assertRaises(UnboundLocalError):
+            self.wrapper._construct_matrix_request_string([MapLocation()],
+                                                          [MapLocation()])
+
+    def test_construct_matrix_request_string_errors_over_limit(self):
+        self.wrapper.key = 'api_key'
+        with self.assertRaises(ValueError):
+            self.wrapper._construct_matrix_request_string(
+                [MapLocation()] * 5, [MapLocation()] * 21)
+
+    # get_distance_matrix tests
+    def test_get_distance_matrix_returns_parsed_matrix(self):
+        self.wrapper._construct_matrix_request_string = \
+            Mock(return_value='request')
+        self.wrapper._call_api = Mock(return_value={
+            u'code': u'Ok',
+            u'distances': [[100.5, None], [300, 400]],
+            u'durations': [[10, None], [30, 40]]})
+
+        matrix = self.wrapper.get_distance_matrix(
+            [MapLocation(1, 1, 1), MapLocation(2, 2, 2)],
+            [MapLocation(3, 3, 3), MapLocation(4, 4, 4)], mode='cycling')
+
+        self.wrapper._call_api.assert_called_once_with('request')
+        self.assertEqual([[{"distance": 100.5, "time": 10}, None],
+                          [{"distance": 300, "time": 30},
+                           {"distance": 400, "time": 40}]], matrix)
+
+    def test_get_distance_matrix_from_local_server(self):
+        paths = []
+
+        class StubHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                paths.append(self.path)
+                body = json.dumps({"code": "Ok",
+                                   "distances": [[100.5, None]],
+                                   "durations": [[10, None]]}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer(('127.0.0.1', 0), StubHandler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        try:
+            wrapper = MapboxAPIWrapper(
+                base_url='http://127.0.0.1:{}'.format(server.server_port))
+            wrapper.session.trust_env = False
+            wrapper.key = 'api_key'
+            matrix = wrapper.get_distance_matrix(
+                [MapLocation(1, 1, 1)],
+                [MapLocation(3, 3, 3), MapLocation(4, 4, 4)])
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        self.assertEqual([[{"distance": 100.5, "time": 10}, None]], matrix)
+        self.assertEqual(['/directions-matrix/v1/mapbox/walking/1,1;3,3;4,4'
+                          '?sources=0&destinations=1;2&annotations='
+                          'distance,duration&access_token=api_key'], paths)
+
     # make_api_call tests
-    @patch('MapboxAPIWrapper.requests.get')
-    def test_call_api_calls_requests_get(self, mock_get):
+    def test_call_api_calls_session_get(self):
+        mock_get = self.wrapper.session.get = Mock()
         mock_response = Mock()
 
         mock_response.json.return_value = self.expected_dict
@@ -149,14 +269,14 @@ class TestMapboxAPIWrapper(unittest.TestCase):
               'access_token=api_key'
 
         response_dict = self.wrapper._call_api(request_url=url)
-        mock_get.assert_called_once_with(url=url)
+        mock_get.assert_called_once_with(url=url,
+                                         timeout=self.wrapper.timeout)
         mock_response.json.assert_called_once_with()
         self.assertEqual(response_dict, self.expected_dict)
 
     @patch('DataGeneration.MapboxAPIWrapper._handle_http_error')
-    @patch('MapboxAPIWrapper.requests.get')
-    def test_call_api_handles_http_error(self,
-                                         mock_get, mock_http_error_handler):
+    def test_call_api_handles_http_error(self, mock_http_error_handler):
+        mock_get = self.wrapper.session.get = Mock()
         mock_response = Mock()
         http_error = requests.exceptions.HTTPError()
         mock_response.raise_for_status.side_effect = http_error
@@ -172,7 +292,8 @@ class TestMapboxAPIWrapper(unittest.TestCase):
         with self.assertRaises(CustomHTTPException):
             self.wrapper._call_api(request_url=url)
 
-        mock_get.assert_called_once_with(url=url)
+        mock_get.assert_called_once_with(url=url,
+                                         timeout=self.wrapper.timeout)
         self.assertEqual(1, mock_response.raise_for_status.call_count)
 
         self.assertEqual(0, mock_response.json.call_count)
@@ -180,8 +301,8 @@ class TestMapboxAPIWrapper(unittest.TestCase):
         mock_http_error_handler.assert_called_once_with(http_error)
 
     @mock.patch('DataGeneration.MapboxAPIWrapper._handle_connection_error')
-    @mock.patch('MapboxAPIWrapper.requests.get')
-    def test_call_api_connection_error(self, mock_get, mock_conn_error_handler):
+    def test_call_api_connection_error(self, mock_conn_error_handler):
+        mock_get = self.wrapper.session.get = Mock()
 
         # Make the patched `requests.get` raise a connection error
         conn_error = requests.exceptions.ConnectionError()
@@ -198,14 +319,15 @@ class TestMapboxAPIWrapper(unittest.TestCase):
             self.wrapper._call_api(request_url=url)
 
         # Check that the function tried and failed to make 3 calls
-        expected_calls = [mock.call(url=url)] * 3
+        expected_calls = [mock.call(url=url,
+                                    timeout=self.wrapper.timeout)] * 3
         self.assertEqual(expected_calls, mock_get.call_args_list)
 
         # Make sure that the connection error handler is called
         mock_conn_error_handler.assert_called_once_with(conn_error)
 
-    @mock.patch('MapboxAPIWrapper.requests.get')
-    def test_get_connection_error_then_success(self, mock_get):
+    def test_get_connection_error_then_success(self):
+        mock_get = self.wrapper.session.get = Mock()
 
         # construct a response object for a successful call
         mock_response = Mock()
@@ -224,13 +346,76 @@ class TestMapboxAPIWrapper(unittest.TestCase):
         response_dict = self.wrapper._call_api(request_url=url)
 
         # Check that the function made the expected internal calls
-        expected_calls = [mock.call(url=url)] * 3
+        expected_calls = [mock.call(url=url,
+                                    timeout=self.wrapper.timeout)] * 3
         self.assertEqual(expected_calls, mock_get.call_args_list)
         self.assertEqual(1, mock_response.json.call_count)
 
         # Check the result
         self.assertEqual(response_dict, self.expected_dict)
 
+    @patch('time.sleep')
+    def test_call_api_retries_after_rate_limit(self, mock_sleep):
+        throttled = Mock(status_code=429, headers={'Retry-After': '3'})
+        throttled.raise_for_status.side_effect = \
+            requests.exceptions.HTTPError()
+        success = Mock()
+        success.json.return_value = self.expected_dict
+        self.wrapper.session.get = Mock(side_effect=[throttled, success])
+
+        response_dict = self.wrapper._call_api(request_url='url')
+
+        self.assertEqual(self.expected_dict, response_dict)
+        self.assertEqual(2, self.wrapper.session.get.call_count)
+        mock_sleep.assert_called_once_with(3.0)
+
+    @patch('time.sleep')
+    def test_call_api_backs_off_exponentially_without_headers(self,
+                                                              mock_sleep):
+        throttled = Mock(status_code=429, headers={})
+        throttled.raise_for_status.side_effect = \
+            requests.exceptions.HTTPError()
+        self.wrapper.session.get = Mock(return_value=throttled)
+
+        with self.assertRaises(MapboxAPIError):
+            self.wrapper._call_api(request_url='url', rate_limit_retries=4)
+
+        self.assertEqual(5, self.wrapper.session.get.call_count)
+        delays = [call[0][0] for call in mock_sleep.call_args_list]
+        self.assertEqual(4, len(delays))
+        for attempt, delay in enumerate(delays):
+            self.assertTrue(0 <= delay <= 2 ** attempt)
+
+    @patch('time.sleep')
+    def test_call_api_caps_backoff_at_max_backoff(self, mock_sleep):
+        self.wrapper.max_backoff = 5
+        throttled = Mock(status_code=429, headers={'Retry-After': '600'})
+        throttled.raise_for_status.side_effect = \
+            requests.exceptions.HTTPError()
+        self.wrapper.session.get = Mock(return_value=throttled)
+
+        with self.assertRaises(MapboxAPIError):
+            self.wrapper._call_api(request_url='url', rate_limit_retries=1)
+
+        mock_sleep.assert_called_once_with(5)
+
+    def test_call_api_acquires_from_rate_limiter(self):
+        self.wrapper.rate_limiter = Mock()
+        response = Mock()
+        response.json.return_value = self.expected_dict
+        self.wrapper.session.get = Mock(return_value=response)
+
+        self.wrapper._call_api(request_url='url')
+
+        self.wrapper.rate_limiter.acquire.assert_called_once_with()
+
+    def test_map_api_wrapper_creates_rate_limiter(self):
+        wrapper = MapboxAPIWrapper(requests_per_minute=300)
+        self.assertIsInstance(wrapper.rate_limiter, RateLimiter)
+
+    def test_map_api_wrapper_has_no_rate_limiter_by_default(self):
+        self.assertIsNone(self.wrapper.rate_limiter)
+
     # get_distance_from_api tests
     def test_get_distance_from_api_constructs_request_string(self):
         self.wrapper._construct_request_string = Mock(return_value='request')
@@ -274,6 +459,34 @@ class TestMapboxAPIWrapper(unittest.TestCase):
         self.assertEqual([5, 10], dist)
 
 
+    def test_get_distance_from_api_returns_cached_route(self):
+        self.wrapper.cache = Mock()
+        self.wrapper.cache.get.return_value = {"distance": 1, "time": 2}
+        self.wrapper._call_api = Mock()
+
+        origin = MapLocation(1, 1, 1)
+        destination = MapLocation(2, 2, 2)
+        result = self.wrapper.get_distance_from_api(origin, destination)
+
+        self.assertEqual({"distance": 1, "time": 2}, result)
+        self.wrapper.cache.get.assert_called_once_with(origin, destination,
+                                                       'walking')
+        self.assertEqual(0, self.wrapper._call_api.call_count)
+
+    def test_get_distance_from_api_caches_new_route(self):
+        self.wrapper.cache = Mock()
+        self.wrapper.cache.get.return_value = None
+        self.wrapper._construct_request_string = Mock(return_value='request')
+        self.wrapper._call_api = Mock(return_value=self.expected_dict)
+
+        origin = MapLocation(1, 1, 1)
+        destination = MapLocation(2, 2, 2)
+        result = self.wrapper.get_distance_from_api(origin, destination,
+                                                    mode='driving')
+
+        self.wrapper.cache.put.assert_called_once_with(origin, destination,
+                                                       'driving', result)
+
     # _parse_response tests
     def test_parse_response_returns_tuple(self):
         self.assertIsInstance(self.wrapper._parse_response(self.expected_dict),
@@ -0,0 +1,53 @@
+import unittest
+from mock import patch
+from DataGeneration.RateLimiter import RateLimiter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        time_patcher = patch('DataGeneration.RateLimiter.time')
+        mock_time = time_patcher.start()
+        mock_time.time.side_effect = self.clock.time
+        mock_time.sleep.side_effect = self.clock.sleep
+        self.addCleanup(time_patcher.stop)
+
+    def test_constructor_errors_on_nonpositive_rate(self):
+        self.assertRaises(ValueError, RateLimiter, 0)
+
+    def test_acquire_doesnt_wait_for_first_request(self):
+        limiter = RateLimiter(60)
+        limiter.acquire()
+        self.assertEqual([], self.clock.sleeps)
+
+    def test_acquire_spaces_requests_at_rate(self):
+        limiter = RateLimiter(120)
+        for _ in range(5):
+            limiter.acquire()
+        self.assertAlmostEqual(2.0, self.clock.now - 1000.0)
+
+    def test_acquire_allows_burst_after_idle(self):
+        limiter = RateLimiter(60, burst=3)
+        for _ in range(3):
+            limiter.acquire()
+        self.assertEqual([], self.clock.sleeps)
+
+    def test_pause_delays_next_request(self):
+        limiter = RateLimiter(60, burst=5)
+        limiter.pause(10)
+        limiter.acquire()
+        self.assertTrue(self.clock.now - 1000.0 >= 10)
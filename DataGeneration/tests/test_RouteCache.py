@@ -0,0 +1,82 @@
+import unittest
+import os
+import sys
+from mock import patch
+from DataGeneration.RouteCache import RouteCache
+from DataGeneration.MapLocation import MapLocation
+
+
+class TestRouteCache(unittest.TestCase):
+
+    def setUp(self):
+        if os.path.exists('unit_test_cache.sqlite3'):
+            os.remove('unit_test_cache.sqlite3')
+        self.origin = MapLocation(41.4993201, -81.6944001)
+        self.destination = MapLocation(41.503712, -81.617399)
+
+    def tearDown(self):
+        if os.path.exists('unit_test_cache.sqlite3'):
+            os.remove('unit_test_cache.sqlite3')
+
+    def test_get_returns_none_when_empty(self):
+        cache = RouteCache('unit_test_cache.sqlite3')
+        self.assertIsNone(cache.get(self.origin, self.destination))
+        self.assertEqual(1, cache.misses)
+
+    def test_get_returns_route_after_put(self):
+        cache = RouteCache('unit_test_cache.sqlite3')
+        cache.put(self.origin, self.destination, 'walking',
+                  {"distance": 100, "time": 80})
+        self.assertEqual({"distance": 100, "time": 80},
+                         cache.get(self.origin, self.destination, 'walking'))
+        self.assertEqual(1, cache.hits)
+
+    def test_get_matches_coordinates_within_precision(self):
+        cache = RouteCache('unit_test_cache.sqlite3', precision=4)
+        cache.put(self.origin, self.destination, 'walking',
+                  {"distance": 100, "time": 80})
+        nearby = MapLocation(41.49934, -81.69438)
+        self.assertIsNotNone(cache.get(nearby, self.destination, 'walking'))
+
+    def test_get_keys_on_mode(self):
+        cache = RouteCache('unit_test_cache.sqlite3')
+        cache.put(self.origin, self.destination, 'walking',
+                  {"distance": 100, "time": 80})
+        self.assertIsNone(cache.get(self.origin, self.destination, 'driving'))
+
+    def test_cache_persists_across_instances(self):
+        RouteCache('unit_test_cache.sqlite3').put(
+            self.origin, self.destination, 'walking',
+            {"distance": 100, "time": 80})
+        cache = RouteCache('unit_test_cache.sqlite3')
+        self.assertEqual(1, cache.size)
+        self.assertIsNotNone(cache.get(self.origin, self.destination))
+
+    @patch.object(sys.modules[RouteCache.__module__], 'time')
+    def test_get_ignores_expired_routes(self, mock_time):
+        cache = RouteCache('unit_test_cache.sqlite3', ttl=60)
+        mock_time.time.return_value = 1000
+        cache.put(self.origin, self.destination, 'walking',
+                  {"distance": 100, "time": 80})
+        mock_time.time.return_value = 1061
+        self.assertIsNone(cache.get(self.origin, self.destination))
+
+    @patch.object(sys.modules[RouteCache.__module__], 'time')
+    def test_put_evicts_least_recently_used(self, mock_time):
+        cache = RouteCache('unit_test_cache.sqlite3', max_entries=2)
+        stops = [MapLocation(41, -81, i) for i in range(3)]
+        stops[1].latitude = 42
+        stops[2].latitude = 43
+        for i, stop in enumerate(stops[:2]):
+            mock_time.time.return_value = i
+            cache.put(self.origin, stop, 'walking',
+                      {"distance": i, "time": i})
+        mock_time.time.return_value = 5
+        cache.get(self.origin, stops[0])
+        mock_time.time.return_value = 6
+        cache.put(self.origin, stops[2], 'walking', {"distance": 2, "time": 2})
+
+        self.assertEqual(2, cache.size)
+        self.assertIsNotNone(cache.get(self.origin, stops[0]))
+        self.assertIsNone(cache.get(self.origin, stops[1]))
+        self.assertIsNotNone(cache.get(self.origin, stops[2]))
@@ -0,0 +1,54 @@
+import unittest
+from mock import Mock, patch
+from DataGeneration.RouteWriter import RouteWriter
+
+
+class TestRouteWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.handler = Mock()
+
+    def test_add_route_buffers_until_flush_rows(self):
+        writer = RouteWriter(self.handler, flush_rows=3, flush_seconds=60)
+        writer.add_route(1, 1, 10, 20)
+        writer.add_route(2, 1, 30, 40)
+        self.assertEqual(0, self.handler.add_routes.call_count)
+        writer.add_route(3, 1, 50, 60)
+        self.handler.add_routes.assert_called_once_with(
+            [(1, 1, 10, 20), (2, 1, 30, 40), (3, 1, 50, 60)])
+
+    @patch('DataGeneration.RouteWriter.time')
+    def test_add_route_flushes_after_flush_seconds(self, mock_time):
+        mock_time.time.return_value = 100
+        writer = RouteWriter(self.handler, flush_rows=100, flush_seconds=5)
+        writer.add_route(1, 1, 10, 20)
+        self.assertEqual(0, self.handler.add_routes.call_count)
+        mock_time.time.return_value = 105
+        writer.add_route(2, 1, 30, 40)
+        self.handler.add_routes.assert_called_once_with(
+            [(1, 1, 10, 20), (2, 1, 30, 40)])
+
+    def test_close_flushes_remaining_routes(self):
+        with RouteWriter(self.handler, flush_rows=100) as writer:
+            writer.add_route(1, 1, 10, 20)
+        self.handler.add_routes.assert_called_once_with([(1, 1, 10, 20)])
+
+    def test_flush_doesnt_write_empty_buffer(self):
+        RouteWriter(self.handler).flush()
+        self.assertEqual(0, self.handler.add_routes.call_count)
+
+    def test_on_flush_runs_callback_after_buffered_routes_are_written(self):
+        writer = RouteWriter(self.handler, flush_rows=100)
+        callback = Mock(side_effect=lambda: self.assertEqual(
+            1, self.handler.add_routes.call_count))
+        writer.add_route(1, 1, 10, 20)
+        writer.on_flush(callback)
+        self.assertEqual(0, callback.call_count)
+        writer.flush()
+        callback.assert_called_once_with()
+
+    def test_on_flush_runs_callback_immediately_when_empty(self):
+        writer = RouteWriter(self.handler)
+        callback = Mock()
+        writer.on_flush(callback)
+        callback.assert_called_once_with()
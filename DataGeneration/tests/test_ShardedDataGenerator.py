@@ -0,0 +1,121 @@
+import unittest
+import os
+import shutil
+import sys
+from mock import Mock, patch
+from DataGeneration.ShardedDataGenerator import ShardedDataGenerator, \
+    _run_shard
+from DataGeneration.DatabaseHandler import DatabaseHandler
+from DataGeneration.MapLocation import MapLocation
+from DataGeneration.RouteCache import RouteCache
+
+
+class TestShardedDataGenerator(unittest.TestCase):
+
+    def setUp(self):
+        self.tearDown()
+        handler = DatabaseHandler('unit_test_db.sqlite3')
+        for i in range(1, 7):
+            handler.add_address(MapLocation(latitude=i, longitude=i, id=i))
+        handler.conn.close()
+        self.generator = ShardedDataGenerator('unit_test_db.sqlite3',
+                                              processes=2)
+        self.tasks = []
+
+    def tearDown(self):
+        for file_name in ('unit_test_db.sqlite3', 'unit_test_db.sqlite3-wal',
+                          'unit_test_db.sqlite3-shm',
+                          'unit_test_cache.sqlite3'):
+            if os.path.exists(file_name):
+                os.remove(file_name)
+        if os.path.exists('unit_test_shards'):
+            shutil.rmtree('unit_test_shards')
+
+    def _fake_map(self, function, tasks):
+        self.tasks.extend(tasks)
+        return [task[0] for task in tasks]
+
+    def test_begin_runs_each_process_on_shared_queue(self):
+        self.generator._map = Mock(side_effect=self._fake_map)
+        self.assertIsNone(self.generator.begin(mode='cycling'))
+        handler_options = {'performance': True, 'timeout': 60}
+        self.assertEqual(
+            [('unit_test_db.sqlite3', handler_options, 'api_key.txt', {}, {},
+              None,
+              {'mode': 'cycling', 'use_queue': True, 'worker_id': 'shard-0'}),
+             ('unit_test_db.sqlite3', handler_options, 'api_key.txt', {}, {},
+              None,
+              {'mode': 'cycling', 'use_queue': True,
+               'worker_id': 'shard-1'})],
+            self.tasks)
+
+    def test_begin_enables_write_ahead_logging(self):
+        self.generator._map = Mock(side_effect=self._fake_map)
+        self.generator.begin()
+        handler = DatabaseHandler('unit_test_db.sqlite3')
+        c = handler.conn.cursor()
+        c.execute("PRAGMA journal_mode")
+        self.assertEqual('wal', c.fetchone()[0])
+        handler.conn.close()
+
+    def test_begin_divides_rate_limit_between_processes(self):
+        generator = ShardedDataGenerator(
+            'unit_test_db.sqlite3', processes=2,
+            wrapper_options={'requests_per_minute': 300, 'pool_size': 4},
+            cache_options={'db_file_name': 'unit_test_cache.sqlite3'})
+        generator._map = Mock(side_effect=self._fake_map)
+        generator.begin()
+        self.assertEqual([{'requests_per_minute': 150, 'pool_size': 4}] * 2,
+                         [task[4] for task in self.tasks])
+        self.assertEqual([{'db_file_name': 'unit_test_cache.sqlite3'}] * 2,
+                         [task[5] for task in self.tasks])
+
+    @patch.object(sys.modules[_run_shard.__module__], 'DataGenerator')
+    @patch.object(sys.modules[_run_shard.__module__], 'MapboxAPIWrapper')
+    def test_run_shard_builds_wrapper_with_options_and_cache(
+            self, mock_wrapper, mock_generator):
+        mock_wrapper.return_value.cache = None
+        _run_shard(('unit_test_db.sqlite3', {'timeout': 30}, 'api_key.txt',
+                    {'metric': 'haversine'}, {'pool_size': 4},
+                    {'db_file_name': 'unit_test_cache.sqlite3'},
+                    {'mode': 'driving'}))
+        options = mock_wrapper.call_args[1]
+        self.assertEqual(4, options['pool_size'])
+        self.assertIsInstance(options['cache'], RouteCache)
+        self.assertTrue(os.path.exists('unit_test_cache.sqlite3'))
+        options['cache'].conn.close()
+        mock_wrapper.return_value.load_api_key_from_file.\
+            assert_called_once_with('api_key.txt')
+        self.assertEqual('haversine', mock_generator.call_args[1]['metric'])
+        mock_generator.return_value.begin.assert_called_once_with(
+            mode='driving')
+
+    def test_begin_populates_queue_before_starting_processes(self):
+        self.generator._map = Mock(side_effect=self._fake_map)
+        self.generator.begin()
+        handler = DatabaseHandler('unit_test_db.sqlite3')
+        self.assertEqual({'pending': 6}, handler.address_queue_counts())
+
+    def test_begin_with_shard_files_exports_and_merges_routes(self):
+        def fake_map(function, tasks):
+            for i, task in enumerate(tasks):
+                shard = DatabaseHandler(task[0])
+                c = shard.conn.cursor()
+                c.execute("SELECT id FROM addresses")
+                for row in c.fetchall():
+                    shard.add_route(address=row[0], stop=1, distance=i,
+                                    time=i)
+                shard.conn.close()
+            return [task[0] for task in tasks]
+        self.generator._map = Mock(side_effect=fake_map)
+
+        merged = self.generator.begin(per_shard_files=True,
+                                      shard_dir='unit_test_shards')
+
+        self.assertEqual(6, merged)
+        handler = DatabaseHandler('unit_test_db.sqlite3')
+        c = handler.conn.cursor()
+        c.execute("SELECT address_id, distance FROM routes "
+                  "ORDER BY address_id")
+        self.assertEqual([(1, 0), (2, 0), (3, 0), (4, 1), (5, 1), (6, 1)],
+                         c.fetchall())
@@ -0,0 +1,66 @@
+import unittest
+import random
+from DataGeneration.StopIndex import KDTreeStopIndex
+from DataGeneration.MapLocation import MapLocation
+from DataGeneration.DataGenerator import DataGenerator
+from DataGeneration.DatabaseHandler import DatabaseHandler
+from DataGeneration.MapboxAPIWrapper import MapboxAPIWrapper
+
+
+class TestKDTreeStopIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.generator = DataGenerator(handler=DatabaseHandler(full=False),
+                                       stops=[],
+                                       wrapper=MapboxAPIWrapper())
+
+    # nearest tests
+    def test_nearest_returns_closest_single_location(self):
+        index = KDTreeStopIndex([MapLocation(1, 1, 1), MapLocation(2, 2, 2)])
+        self.assertEqual([MapLocation(1, 1, 1)],
+                         index.nearest(MapLocation(0, 0, 0), n=1))
+
+    def test_nearest_returns_closest_locations_in_order(self):
+        index = KDTreeStopIndex([MapLocation(1, 1, 1),
+                                 MapLocation(5, 5, 5),
+                                 MapLocation(6, 6, 6)])
+        self.assertEqual([MapLocation(5, 5, 5), MapLocation(6, 6, 6)],
+                         index.nearest(MapLocation(4, 4, 4), n=2))
+
+    def test_nearest_returns_all_stops_when_n_is_larger(self):
+        index = KDTreeStopIndex([MapLocation(1, 1, 1), MapLocation(2, 2, 2)])
+        self.assertEqual(2, len(index.nearest(MapLocation(0, 0, 0), n=5)))
+
+    def test_nearest_returns_empty_list_with_no_stops(self):
+        index = KDTreeStopIndex([])
+        self.assertEqual([], index.nearest(MapLocation(0, 0, 0), n=3))
+
+    def test_nearest_matches_brute_force_reference(self):
+        rng = random.Random(42)
+        stops = [MapLocation(rng.uniform(41.2, 41.7),
+                             rng.uniform(-82.0, -81.4), i)
+                 for i in range(1, 501)]
+        index = KDTreeStopIndex(stops)
+        for _ in range(50):
+            address = MapLocation(rng.uniform(41.2, 41.7),
+                                  rng.uniform(-82.0, -81.4))
+            expected = self.generator._get_closest_locations(address, stops,
+                                                             n=5)
+            self.assertEqual(expected, index.nearest(address, n=5))
+
+    def test_nearest_matches_brute_force_reference_with_haversine(self):
+        generator = DataGenerator(handler=DatabaseHandler(full=False),
+                                  stops=[],
+                                  wrapper=MapboxAPIWrapper(),
+                                  metric='haversine')
+        rng = random.Random(3)
+        stops = [MapLocation(rng.uniform(41.2, 41.7),
+                             rng.uniform(-82.0, -81.4), i)
+                 for i in range(1, 301)]
+        index = KDTreeStopIndex(stops, metric='haversine')
+        for _ in range(30):
+            address = MapLocation(rng.uniform(41.2, 41.7),
+                                  rng.uniform(-82.0, -81.4))
+            self.assertEqual(
+                generator._get_closest_locations(address, stops, n=3),
+                index.nearest(address, n=3))
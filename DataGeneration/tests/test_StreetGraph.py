@@ -0,0 +1,124 @@
+import io
+import unittest
+from DataGeneration.StreetGraph import StreetGraph, _get_way_access, \
+    _parse_speed
+
+OSM = b"""<?xml version='1.0' encoding='UTF-8'?>
+<osm version="0.6">
+  <node id="1" lat="41.5" lon="-81.700"/>
+  <node id="2" lat="41.5" lon="-81.699"/>
+  <node id="3" lat="41.5" lon="-81.698"/>
+  <node id="4" lat="41.501" lon="-81.698"/>
+  <node id="5" lat="41.502" lon="-81.699"/>
+  <node id="6" lat="41.6" lon="-81.6"/>
+  <way id="10">
+    <nd ref="1"/><nd ref="2"/><nd ref="3"/>
+    <tag k="highway" v="residential"/>
+    <tag k="oneway" v="yes"/>
+  </way>
+  <way id="11">
+    <nd ref="3"/><nd ref="4"/>
+    <tag k="highway" v="footway"/>
+  </way>
+  <way id="12">
+    <nd ref="1"/><nd ref="4"/>
+    <tag k="highway" v="motorway"/>
+  </way>
+  <way id="13">
+    <nd ref="2"/><nd ref="5"/>
+    <tag k="highway" v="residential"/>
+    <tag k="access" v="private"/>
+  </way>
+  <way id="14">
+    <nd ref="5"/><nd ref="6"/>
+    <tag k="building" v="yes"/>
+  </way>
+</osm>
+"""
+
+
+class TestStreetGraph(unittest.TestCase):
+
+    def setUp(self):
+        self.graph = StreetGraph.from_osm_file(io.BytesIO(OSM))
+        self.nodes = self.graph.node_indexes
+
+    # from_osm_file tests
+    def test_from_osm_file_keeps_only_routable_nodes(self):
+        self.assertEqual(set(['1', '2', '3', '4']), set(self.nodes))
+
+    def test_from_osm_file_applies_mode_access(self):
+        walking = set(self.graph.nodes_for_mode('walking'))
+        cycling = set(self.graph.nodes_for_mode('cycling'))
+        driving = set(self.graph.nodes_for_mode('driving'))
+        self.assertEqual(set(self.nodes.values()), walking)
+        self.assertNotIn(self.nodes['4'], cycling)
+        self.assertIn(self.nodes['4'], driving)
+
+    # shortest_path tests
+    def test_shortest_path_walking_ignores_oneway(self):
+        distance, time = self.graph.shortest_path(self.nodes['3'],
+                                                  self.nodes['1'], 'walking')
+        expected = self.graph.distance(self.nodes['1'], self.nodes['2']) + \
+            self.graph.distance(self.nodes['2'], self.nodes['3'])
+        self.assertAlmostEqual(expected, distance)
+        self.assertAlmostEqual(expected / (5.0 / 3.6), time)
+
+    def test_shortest_path_walking_avoids_motorway(self):
+        distance, _ = self.graph.shortest_path(self.nodes['1'],
+                                               self.nodes['4'], 'walking')
+        self.assertGreater(distance, self.graph.distance(self.nodes['1'],
+                                                         self.nodes['4']))
+
+    def test_shortest_path_driving_respects_oneway(self):
+        self.assertIsNone(self.graph.shortest_path(self.nodes['3'],
+                                                   self.nodes['1'], 'driving'))
+        distance, time = self.graph.shortest_path(self.nodes['1'],
+                                                  self.nodes['3'], 'driving')
+        self.assertAlmostEqual(distance / (30 / 3.6), time)
+
+    def test_shortest_path_driving_prefers_faster_route(self):
+        distance, _ = self.graph.shortest_path(self.nodes['1'],
+                                               self.nodes['4'], 'driving')
+        self.assertAlmostEqual(self.graph.distance(self.nodes['1'],
+                                                   self.nodes['4']), distance)
+
+    # shortest_paths tests
+    def test_shortest_paths_assigns_nodes_to_fastest_source(self):
+        reached = self.graph.shortest_paths([(self.nodes['1'], 'a'),
+                                             (self.nodes['4'], 'b')],
+                                            'walking')
+        self.assertEqual('a', reached[self.nodes['2']][2])
+        self.assertEqual('b', reached[self.nodes['3']][2])
+        self.assertEqual(0, reached[self.nodes['4']][0])
+
+    def test_shortest_paths_over_reverse_edges(self):
+        reverse = self.graph.reverse_edges('driving')
+        reached = self.graph.shortest_paths([(self.nodes['3'], 'stop')],
+                                            'driving', edges=reverse)
+        # node 1 can drive to node 3, but not the other way around
+        self.assertIn(self.nodes['1'], reached)
+        self.assertIsNone(self.graph.shortest_path(self.nodes['3'],
+                                                   self.nodes['1'], 'driving'))
+
+    # way access tests
+    def test_get_way_access_mode_tag_overrides_access(self):
+        tags = {'highway': 'service', 'access': 'no', 'foot': 'yes'}
+        self.assertIsNotNone(_get_way_access(tags, 'walking'))
+        self.assertIsNone(_get_way_access(tags, 'driving'))
+
+    def test_get_way_access_cycling_contraflow(self):
+        tags = {'highway': 'residential', 'oneway': 'yes',
+                'oneway:bicycle': 'no'}
+        self.assertEqual((True, True), _get_way_access(tags, 'cycling')[:2])
+        self.assertEqual((True, False), _get_way_access(tags, 'driving')[:2])
+
+    def test_get_way_access_reverse_oneway(self):
+        tags = {'highway': 'primary', 'oneway': '-1'}
+        self.assertEqual((False, True), _get_way_access(tags, 'driving')[:2])
+
+    def test_parse_speed(self):
+        self.assertEqual(50, _parse_speed('50'))
+        self.assertAlmostEqual(40.23, _parse_speed('25 mph'), places=2)
+        self.assertIsNone(_parse_speed('signals'))
+        self.assertIsNone(_parse_speed(None))
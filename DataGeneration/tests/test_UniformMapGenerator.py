@@ -1,5 +1,7 @@
 import unittest
 
+import numpy
+from mock import Mock, mock
 import pandas
 
 from RTAHeatMap.DataGeneration.UniformMapGenerator import UniformMapGenerator
@@ -93,3 +95,61 @@ class TestUniformMapGenerator(unittest.TestCase):
         self.assertEqual(2, df.iloc[1, 1])
         self.assertEqual(1, df.iloc[2, 1])
         self.assertEqual(2, df.iloc[3, 1])
+
+    def test_get_uniform_coordinate_map_has_float_columns(self):
+        generator = UniformMapGenerator()
+        df = generator.get_uniform_coordinate_map(1, 2, 1, 2, 1, 1)
+        self.assertEqual(['latitude', 'longitude'], list(df.columns))
+        self.assertEqual(numpy.float64, df['latitude'].dtype)
+        self.assertEqual(numpy.float64, df['longitude'].dtype)
+
+    def test_get_uniform_coordinate_map_matches_reference(self):
+        generator = UniformMapGenerator()
+        for args in [(1, 10, 6, 20, 1, 1),
+                     (41.25, 41.5, -81.75, -81.5, 0.125, 0.0625),
+                     (0.9, 1, 0.8, 1, 0.2, 0.2),
+                     (2, 3, 2, 3, 0.3, 0.3)]:
+            df = generator.get_uniform_coordinate_map(*args)
+            reference = generator.get_uniform_coordinate_map_reference(*args)
+            self.assertEqual(reference.shape, df.shape)
+            self.assertTrue(numpy.allclose(reference.values.astype(float),
+                                           df.values))
+
+    # get_coordinates tests
+    def test_get_coordinates_has_exact_endpoints(self):
+        generator = UniformMapGenerator()
+        coordinates = generator.get_coordinates(41.2, 41.6, 0.001)
+        self.assertEqual(401, len(coordinates))
+        self.assertEqual(41.2, coordinates[0])
+        self.assertEqual(41.6, coordinates[-1])
+
+    def test_get_coordinates_doesnt_accumulate_error(self):
+        generator = UniformMapGenerator()
+        coordinates = generator.get_coordinates(0, 1000, 0.1)
+        self.assertEqual(10001, len(coordinates))
+        self.assertAlmostEqual(500.0, coordinates[5000], places=12)
+
+    def test_get_number_of_intervals_ignores_division_error(self):
+        generator = UniformMapGenerator()
+        self.assertEqual(12, generator.get_number_of_intervals(0, 1.1, 0.1))
+
+    # get_uniform_coordinate_blocks tests
+    def test_get_uniform_coordinate_blocks_matches_map(self):
+        generator = UniformMapGenerator()
+        blocks = list(generator.get_uniform_coordinate_blocks(
+            1, 10, 6, 20, 1, 1, block_size=40))
+        self.assertEqual([40, 40, 40, 30], [len(block) for block in blocks])
+        df = generator.get_uniform_coordinate_map(1, 10, 6, 20, 1, 1)
+        self.assertTrue(numpy.array_equal(df.values, numpy.vstack(blocks)))
+
+    # add_uniform_map_to_database tests
+    def test_add_uniform_map_to_database_adds_blocks(self):
+        generator = UniformMapGenerator()
+        handler = Mock()
+        count = generator.add_uniform_map_to_database(handler, 1, 2, 1, 3,
+                                                      1, 1, block_size=4)
+        self.assertEqual(6, count)
+        self.assertEqual([mock.call([[1.0, 1.0], [1.0, 2.0],
+                                     [1.0, 3.0], [2.0, 1.0]]),
+                          mock.call([[2.0, 2.0], [2.0, 3.0]])],
+                         handler.add_addresses.call_args_list)
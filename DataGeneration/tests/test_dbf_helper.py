@@ -0,0 +1,135 @@
+import os
+import struct
+import unittest
+import numpy as np
+from mock import Mock
+from DataGeneration import dbf_helper
+from DataGeneration.DatabaseHandler import DatabaseHandler
+
+FIELDS = [('ADDR_ID', 'N', 8), ('STREET', 'C', 12), ('X', 'N', 14),
+          ('Y', 'N', 14)]
+
+
+def write_dbf(file_name, records, fields=FIELDS):
+    # Writes a dBASE III file; records are (deleted, values) tuples
+    record_length = 1 + sum(length for _, _, length in fields)
+    header_length = 32 + 32 * len(fields) + 1
+    with open(file_name, 'wb') as dbf_file:
+        dbf_file.write(struct.pack('<BBBBIHH20x', 3, 117, 1, 1, len(records),
+                                   header_length, record_length))
+        for name, field_type, length in fields:
+            dbf_file.write(struct.pack('<11sc4xBB14x', name.encode('ascii'),
+                                       field_type.encode('ascii'), length, 0))
+        dbf_file.write(b'\r')
+        for deleted, values in records:
+            dbf_file.write(b'*' if deleted else b' ')
+            for (_, field_type, length), value in zip(fields, values):
+                text = str(value)
+                text = text.ljust(length) if field_type == 'C' \
+                    else text.rjust(length)
+                dbf_file.write(text.encode('ascii'))
+        dbf_file.write(b'\x1a')
+
+
+class TestDbfHelper(unittest.TestCase):
+
+    def setUp(self):
+        self.tearDown()
+
+    def tearDown(self):
+        for file_name in ('unit_test.dbf', 'unit_test_dbf.sqlite3'):
+            if os.path.exists(file_name):
+                os.remove(file_name)
+
+    # state plane tests
+    def test_state_plane_to_wgs84_ohio_north(self):
+        lat, lng = dbf_helper.state_plane_to_wgs84(
+            [2171000, 1968500, 2250000.5], [630000, 0, 700000.25])
+        np.testing.assert_allclose(lat, [41.393530484319015, 39.66666666666671,
+                                         41.583438575236826], atol=1e-7)
+        np.testing.assert_allclose(lng, [-81.76194462534541, -82.5,
+                                         -81.47102304423223], atol=1e-7)
+
+    def test_state_plane_to_wgs84_ohio_south(self):
+        lat, lng = dbf_helper.state_plane_to_wgs84(1900000, 500000,
+                                                   'ohio_south')
+        self.assertAlmostEqual(39.37256017047035, float(lat), places=7)
+        self.assertAlmostEqual(-82.74231328897548, float(lng), places=7)
+
+    def test_state_plane_to_wgs84_meters(self):
+        lat, lng = dbf_helper.state_plane_to_wgs84(600000, 0, units='meters')
+        self.assertAlmostEqual(39.66666666666671, float(lat), places=7)
+        self.assertAlmostEqual(-82.5, float(lng), places=7)
+
+    def test_state_plane_to_wgs84_unknown_zone(self):
+        with self.assertRaises(ValueError):
+            dbf_helper.state_plane_to_wgs84(0, 0, 'ohio_east')
+
+    # import tests
+    def test_import_addresses_from_dbf_state_plane(self):
+        write_dbf('unit_test.dbf', [
+            (False, [11, 'MAIN ST', '2171000.00', '630000.00']),
+            (True, [12, 'DELETED ST', '2171000.00', '630000.00']),
+            (False, [13, 'NO COORDS', '', '']),
+            (False, [14, 'ELM ST', '2250000.50', '700000.25'])])
+        handler = DatabaseHandler('unit_test_dbf.sqlite3')
+        added, skipped = dbf_helper.import_addresses_from_dbf(
+            handler, 'unit_test.dbf', x_field='X', y_field='Y',
+            id_field='ADDR_ID', state_plane='ohio_north', batch_size=3)
+        self.assertEqual((2, 2), (added, skipped))
+        rows = handler.conn.cursor().execute(
+            "SELECT id, latitude, longitude FROM addresses "
+            "ORDER BY id").fetchall()
+        self.assertEqual([11, 14], [row[0] for row in rows])
+        self.assertAlmostEqual(41.393530484319015, rows[0][1], places=6)
+        self.assertAlmostEqual(-81.47102304423223, rows[1][2], places=6)
+
+    def test_import_addresses_from_dbf_skips_existing_ids(self):
+        write_dbf('unit_test.dbf', [
+            (False, [1, 'MAIN ST', '-81.5', '41.5']),
+            (False, [2, 'ELM ST', '-81.6', '41.4'])])
+        handler = DatabaseHandler('unit_test_dbf.sqlite3')
+        counts = [dbf_helper.import_addresses_from_dbf(
+            handler, 'unit_test.dbf', x_field='X', y_field='Y',
+            id_field='ADDR_ID') for _ in range(2)]
+        self.assertEqual([(2, 0), (0, 2)], counts)
+        rows = handler.conn.cursor().execute(
+            "SELECT id, latitude, longitude FROM addresses "
+            "ORDER BY id").fetchall()
+        self.assertEqual([(1, 41.5, -81.5), (2, 41.4, -81.6)], rows)
+
+    def test_import_addresses_from_dbf_skips_existing_coordinates(self):
+        write_dbf('unit_test.dbf', [
+            (False, [1, 'MAIN ST', '-81.5', '41.5']),
+            (False, [2, 'SAME PLACE', '-81.5000001', '41.5']),
+            (False, [3, 'ELM ST', '-81.6', '41.4'])])
+        handler = DatabaseHandler('unit_test_dbf.sqlite3')
+        counts = [dbf_helper.import_addresses_from_dbf(
+            handler, 'unit_test.dbf', x_field='X', y_field='Y',
+            batch_size=2) for _ in range(2)]
+        self.assertEqual([(2, 1), (0, 3)], counts)
+        rows = handler.conn.cursor().execute(
+            "SELECT latitude, longitude FROM addresses "
+            "ORDER BY id").fetchall()
+        self.assertEqual([(41.5, -81.5), (41.4, -81.6)], rows)
+
+    def test_import_addresses_from_dbf_batches(self):
+        write_dbf('unit_test.dbf', [
+            (False, [i, 'ST', '-81.5', '41.5{}'.format(i)]) for i in range(5)])
+        handler = Mock()
+        handler._get_location_keys.return_value = np.array([], dtype=np.int64)
+        handler.add_addresses.side_effect = \
+            lambda coordinates, ids: len(coordinates)
+        added, skipped = dbf_helper.import_addresses_from_dbf(
+            handler, 'unit_test.dbf', x_field='X', y_field='Y',
+            batch_size=2)
+        self.assertEqual((5, 0), (added, skipped))
+        self.assertEqual([2, 2, 1], [len(call[0][0]) for call in
+                                     handler.add_addresses.call_args_list])
+        self.assertEqual([41.54, -81.5],
+                         handler.add_addresses.call_args[0][0][0])
+
+    def test_import_addresses_from_dbf_missing_field(self):
+        write_dbf('unit_test.dbf', [(False, [1, 'ST', '-81.5', '41.5'])])
+        with self.assertRaises(ValueError):
+            dbf_helper.import_addresses_from_dbf(Mock(), 'unit_test.dbf')
@@ -7,5 +7,13 @@ __all__ = [
     'DatabaseHandler',
     'UniformMapGenerator',
     'MapLocation',
-    'DataGenerator'
+    'DataGenerator',
+    'KDTreeStopIndex',
+    'RouteCache',
+    'ShardedDataGenerator',
+    'GridMask',
+    'AdaptiveSampler',
+    'StreetGraph',
+    'LocalRoutingWrapper',
+    'IsochroneGenerator'
 ]